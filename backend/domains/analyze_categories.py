@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from pydantic import BaseModel, ConfigDict, field_validator
+from typing import List, Dict, Any, Optional
+from domains.document_model import DocumentPages
 
 
 class Category(BaseModel):
@@ -25,26 +26,71 @@ class AnalyzeDocStructureResponseData(BaseModel):
 
 class Page(BaseModel):
     """
-    extraction_category ルートのリクエストパラメータの一部
     ページ情報を表すモデル
+    extraction_category(ies) のリクエストの pages は、このモデルではなく DocumentPages に変換して保持する
     """
     page_number: int
-    width: float
-    height: float
+    # analyze_document_structure の fields で絞り込んだページ情報も受け付けるため、lines以外は任意
+    width: Optional[float] = None
+    height: Optional[float] = None
     lines: List[Dict[str, Any]]
     tables: List[Dict[str, Any]] = []
     figures: List[Dict[str, Any]] = []
 
 
-class ExtractionCategoryRequestData(BaseModel):
+class DocumentRequestData(BaseModel):
+    """
+    pages（ドキュメントのページ情報）を受け取るリクエストの基底クラス
+    pages はpydanticで検証せず、DocumentPages.from_pages で一度だけ検証・変換する
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    pages: DocumentPages
+
+    @field_validator("pages", mode="before")
+    @classmethod
+    def _convert_pages(cls, pages: Any) -> DocumentPages:
+        return DocumentPages.from_pages(pages)
+
+
+class ExtractionCategoryRequestData(DocumentRequestData):
     """
     extraction_category ルートのリクエストパラメータ
     - target_category: 対象のカテゴリ
     - categories: 全カテゴリ
     - content_markdown: ドキュメント全体のMarkdown形式
     - pages: ターゲットカテゴリに該当するページ情報
+    - context_token_budget: プロンプトに含めるドキュメント内容のトークン予算（任意。0で常に全体を送る）
+    - use_cache: Falseの場合は抽出結果キャッシュを参照せずに抽出する（結果でキャッシュは更新する）
+    - document_hash: analyze_document_structure のレスポンスの document_hash（図の画像を送る場合に指定）
+    - include_images: Trueの場合は、ページ内の図の画像もAzure OpenAIに送る
     """
     target_category: Category
     categories: List[Category]
     content_markdown: str
-    pages: List[Page]
+    context_token_budget: Optional[int] = None
+    use_cache: bool = True
+    document_hash: Optional[str] = None
+    include_images: bool = False
+
+
+class ExtractionCategoriesRequestData(DocumentRequestData):
+    """
+    extraction_categories ルートのリクエストパラメータ
+    analyze_document_structure のレスポンスをそのまま受け取り、全分類を一括で抽出する
+    - categories: 全カテゴリ（抽出対象）
+    - content_markdown: ドキュメント全体のMarkdown形式
+    - pages: ドキュメント全体のページ情報
+    - max_concurrency: 同時に実行する抽出数の上限（任意）
+    - context_token_budget: プロンプトに含めるドキュメント内容のトークン予算（任意。0で常に全体を送る）
+    - use_cache: Falseの場合は抽出結果キャッシュを参照せずに抽出する（結果でキャッシュは更新する）
+    - document_hash: analyze_document_structure のレスポンスの document_hash（図の画像を送る場合に指定）
+    - include_images: Trueの場合は、ページ内の図の画像もAzure OpenAIに送る
+    """
+    categories: List[Category]
+    content_markdown: str
+    max_concurrency: Optional[int] = None
+    context_token_budget: Optional[int] = None
+    use_cache: bool = True
+    document_hash: Optional[str] = None
+    include_images: bool = False
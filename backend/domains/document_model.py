@@ -0,0 +1,381 @@
+import ast
+import re
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Any, Iterable, List, Optional, Tuple
+
+# ドキュメントのページ情報のメモリ内表現
+# extraction_category(ies) のリクエストの pages（analyze_document_structure のレスポンスの形式）は、
+# 行ごとの辞書・ポリゴンのリスト・spansの辞書が大量に並ぶため、pydanticの List[Dict[str, Any]] として
+# 検証すると全体が複製される。ここではHTTPの境界で一度だけ変換し、以降は次の形で保持する
+# - 行のテキスト: ドキュメント全体で1つの文字列（改行区切り）と、行ごとの開始位置（array）
+# - 行のポリゴン・spans: ドキュメント全体で1つの数値配列（array）と、行ごとの開始位置
+# - ページ・テーブル・セル・図: __slots__ のクラス
+# JSONの形式に戻すのは to_pages（レスポンス・デバッグ用）だけ
+
+# 以前のバージョンのレスポンスで文字列として出力された spans（例: "{'offset': 0, 'length': 4}"）
+_SPAN_PATTERN = re.compile(r"['\"]offset['\"]:\s*(\d+).*?['\"]length['\"]:\s*(\d+)")
+# spans を保持する array("L") に格納できる最大値（範囲外の値は OverflowError になるため、変換時に ValueError にする）
+_SPAN_MAX = 2 ** (8 * array("L").itemsize) - 1
+# 文字列として出力された値（bounding_regions・spans）の最大長。解析する前にクライアントからの入力を制限する
+_LEGACY_VALUE_MAX_LENGTH = 4096
+
+
+def _get(obj: Any, *names: str, default=None):
+    """辞書（snake_case / camelCase のキー）と属性のどちらからも値を取り出す"""
+    if type(obj) is dict:
+        # JSONから読み込んだ辞書（大半のケース）は、Mapping の型チェックを省く
+        for name in names:
+            if name in obj:
+                return obj[name]
+        return default
+    for name in names:
+        if isinstance(obj, Mapping):
+            if name in obj:
+                return obj[name]
+        elif hasattr(obj, name):
+            return getattr(obj, name)
+    return default
+
+
+def _check_legacy_length(value: str, path: str) -> None:
+    if len(value) > _LEGACY_VALUE_MAX_LENGTH:
+        raise ValueError(f"{path}: value too long ({len(value)} > {_LEGACY_VALUE_MAX_LENGTH} characters)")
+
+
+def _parse_legacy(value: Any, path: str) -> Any:
+    """文字列として出力された bounding_regions などを辞書に戻す"""
+    if not isinstance(value, str):
+        return value
+    _check_legacy_length(value, path)
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        # 深くネストした入力では RecursionError・MemoryError になるため、これも検証エラーとして扱う
+        raise ValueError(f"{path}: unsupported value {value[:40]!r}")
+
+
+def _extend_polygon(target: array, polygon: Any, path: str) -> None:
+    """ポリゴン（フラットな数値配列・[x, y] の配列・{"x", "y"} の配列）を target に追加する"""
+    try:
+        if type(polygon) is list and (not polygon or type(polygon[0]) is float):
+            # フラットな数値配列（Document Intelligenceの形式）は1回で追加する
+            target.extend(polygon)
+            return
+        for point in polygon or []:
+            if isinstance(point, (int, float)):
+                target.append(point)
+            elif isinstance(point, (list, tuple)):
+                target.extend(point)
+            elif _get(point, "x") is not None:
+                target.append(_get(point, "x"))
+                target.append(_get(point, "y", default=0.0))
+            else:
+                raise TypeError(point)
+    except TypeError:
+        raise ValueError(f"{path}: numbers expected")
+
+
+def _extend_spans(target: array, spans: Any, path: str) -> None:
+    """spans（{"offset", "length"} の配列）を (offset, length) の組として target に追加する"""
+    for span in spans or []:
+        if type(span) is dict:
+            offset, length = span.get("offset"), span.get("length")
+            if type(offset) is not int or type(length) is not int:
+                raise ValueError(f"{path}: invalid span {span!r}")
+        elif isinstance(span, str):
+            _check_legacy_length(span, path)
+            match = _SPAN_PATTERN.search(span)
+            if match is None:
+                raise ValueError(f"{path}: invalid span {span[:40]!r}")
+            offset, length = int(match.group(1)), int(match.group(2))
+        else:
+            offset, length = _get(span, "offset"), _get(span, "length")
+            if not isinstance(offset, int) or not isinstance(length, int):
+                raise ValueError(f"{path}: invalid span {span!r}")
+        if not (0 <= offset <= _SPAN_MAX and 0 <= length <= _SPAN_MAX):
+            raise ValueError(f"{path}: span out of range (offset={offset}, length={length})")
+        target.append(offset)
+        target.append(length)
+
+
+def _span_dicts(values: array, start: int, end: int) -> List[dict]:
+    return [{"offset": values[i], "length": values[i + 1]} for i in range(start, end, 2)]
+
+
+class BoundingRegion:
+    """要素の領域（ページ番号とフラットなポリゴン）"""
+    __slots__ = ("page_number", "polygon")
+
+    def __init__(self, page_number: int, polygon: array) -> None:
+        self.page_number = page_number
+        self.polygon = polygon
+
+    @classmethod
+    def from_value(cls, value: Any, path: str) -> "BoundingRegion":
+        value = _parse_legacy(value, path)
+        page_number = _get(value, "page_number", "pageNumber")
+        if not isinstance(page_number, int):
+            raise ValueError(f"{path}.page_number: integer expected")
+        polygon = array("d")
+        _extend_polygon(polygon, _get(value, "polygon", default=[]), f"{path}.polygon")
+        return cls(page_number, polygon)
+
+    def to_dict(self) -> dict:
+        return {"pageNumber": self.page_number, "polygon": self.polygon.tolist()}
+
+
+def _regions(values: Any, path: str) -> List[BoundingRegion]:
+    return [BoundingRegion.from_value(value, f"{path}[{i}]") for i, value in enumerate(values or [])]
+
+
+class TableCell:
+    __slots__ = ("row_index", "column_index", "content", "bounding_regions")
+
+    def __init__(self, row_index: int, column_index: int, content: str, bounding_regions: List[BoundingRegion]) -> None:
+        self.row_index = row_index
+        self.column_index = column_index
+        self.content = content
+        self.bounding_regions = bounding_regions
+
+    def to_dict(self) -> dict:
+        return {
+            "row_index": self.row_index,
+            "column_index": self.column_index,
+            "content": self.content,
+            "bounding_regions": [region.to_dict() for region in self.bounding_regions],
+        }
+
+
+class Table:
+    __slots__ = ("row_count", "column_count", "cells")
+
+    def __init__(self, row_count: int, column_count: int, cells: List[TableCell]) -> None:
+        self.row_count = row_count
+        self.column_count = column_count
+        self.cells = cells
+
+    @classmethod
+    def from_value(cls, value: Any, path: str) -> "Table":
+        cells = [
+            TableCell(
+                row_index=_get(cell, "row_index", "rowIndex"),
+                column_index=_get(cell, "column_index", "columnIndex"),
+                content=_get(cell, "content", default=""),
+                bounding_regions=_regions(_get(cell, "bounding_regions", "boundingRegions"),
+                                          f"{path}.cells[{i}].bounding_regions"),
+            )
+            for i, cell in enumerate(_get(value, "cells", default=[]))
+        ]
+        return cls(_get(value, "row_count", "rowCount"), _get(value, "column_count", "columnCount"), cells)
+
+    def to_dict(self) -> dict:
+        return {
+            "row_count": self.row_count,
+            "column_count": self.column_count,
+            "cells": [cell.to_dict() for cell in self.cells],
+        }
+
+
+class Figure:
+    __slots__ = ("id", "bounding_regions", "spans", "elements")
+
+    def __init__(self, id: Optional[str], bounding_regions: List[BoundingRegion], spans: array, elements: List[str]) -> None:
+        self.id = id
+        self.bounding_regions = bounding_regions
+        self.spans = spans
+        self.elements = elements
+
+    @classmethod
+    def from_value(cls, value: Any, path: str) -> "Figure":
+        spans = array("L")
+        _extend_spans(spans, _get(value, "spans", default=[]), f"{path}.spans")
+        return cls(
+            id=_get(value, "id"),
+            bounding_regions=_regions(_get(value, "bounding_regions", "boundingRegions"), f"{path}.bounding_regions"),
+            spans=spans,
+            elements=list(_get(value, "elements", default=None) or []),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "bounding_regions": [region.to_dict() for region in self.bounding_regions],
+            "spans": _span_dicts(self.spans, 0, len(self.spans)),
+            "elements": self.elements,
+        }
+
+
+class PageView:
+    """
+    DocumentPages の1ページ
+    行は DocumentPages の列に保持し、text・lines で必要なときに取り出す
+    """
+    __slots__ = ("_document", "_line_start", "_line_end", "page_number", "width", "height", "tables", "figures")
+
+    def __init__(
+        self,
+        document: "DocumentPages",
+        line_start: int,
+        line_end: int,
+        page_number: int,
+        width: Optional[float],
+        height: Optional[float],
+        tables: List[Table],
+        figures: List[Figure],
+    ) -> None:
+        self._document = document
+        self._line_start = line_start
+        self._line_end = line_end
+        self.page_number = page_number
+        self.width = width
+        self.height = height
+        self.tables = tables
+        self.figures = figures
+
+    @property
+    def line_count(self) -> int:
+        return self._line_end - self._line_start
+
+    @property
+    def text(self) -> str:
+        """ページの行のテキストを改行区切りで返す（文字列のスライス1回）"""
+        return self._document._text_range(self._line_start, self._line_end)
+
+    @property
+    def lines(self) -> List[dict]:
+        """行を analyze_document_structure のレスポンスと同じ形式の辞書で返す"""
+        return [self._document._line_dict(i) for i in range(self._line_start, self._line_end)]
+
+    def to_dict(self) -> dict:
+        return {
+            "page_number": self.page_number,
+            "width": self.width,
+            "height": self.height,
+            "lines": self.lines,
+            "tables": [table.to_dict() for table in self.tables],
+            "figures": [figure.to_dict() for figure in self.figures],
+        }
+
+
+class DocumentPages(Sequence):
+    """
+    ドキュメントのページ情報（PageView のシーケンス）
+    from_pages でJSONの形式（またはSDKのモデル）から変換し、to_pages で戻す
+    select で一部のページを選んでも、行の列は複製せずに共有する
+    """
+    __slots__ = ("_text", "_line_offsets", "_polygons", "_polygon_offsets", "_spans", "_span_offsets",
+                 "_line_fields", "_pages")
+
+    def __init__(self) -> None:
+        # 行 i のテキストは _text[_line_offsets[i]:_line_offsets[i + 1] - 1]（行は改行1文字で区切る）
+        self._text = ""
+        self._line_offsets = array("L", [0])
+        self._polygons = array("d")
+        self._polygon_offsets = array("L", [0])
+        self._spans = array("L")
+        self._span_offsets = array("L", [0])
+        # 入力の行に含まれていた content 以外のフィールド（to_pages で同じ形式に戻すため）
+        self._line_fields: Tuple[str, ...] = ()
+        self._pages: List[PageView] = []
+
+    @classmethod
+    def from_pages(cls, pages: Iterable[Any]) -> "DocumentPages":
+        """
+        ページ情報（analyze_document_structure のレスポンスの pages、fields・compact で絞り込んだものを含む）を変換する
+        :raises ValueError: page_number・lines・行の content がない、または型が正しくない場合
+        """
+        if isinstance(pages, DocumentPages):
+            return pages
+        if pages is None or isinstance(pages, (str, bytes, Mapping)):
+            raise ValueError("pages: list expected")
+
+        document = cls()
+        texts: List[str] = []
+        line_offsets = document._line_offsets
+        polygons, polygon_offsets = document._polygons, document._polygon_offsets
+        spans, span_offsets = document._spans, document._span_offsets
+        has_polygon = has_spans = False
+        offset = 0
+        for page_index, page in enumerate(pages):
+            path = f"pages[{page_index}]"
+            page_number = _get(page, "page_number", "pageNumber")
+            if not isinstance(page_number, int) or isinstance(page_number, bool):
+                raise ValueError(f"{path}.page_number: integer expected")
+            lines = _get(page, "lines")
+            if lines is None:
+                raise ValueError(f"{path}.lines: field required")
+
+            line_start = len(texts)
+            for line_index, line in enumerate(lines):
+                # 行ごとにパスの文字列を作らないよう、エラーの場合だけパスを付ける
+                try:
+                    if type(line) is dict:
+                        content, polygon, line_spans = line.get("content"), line.get("polygon"), line.get("spans")
+                    else:
+                        content, polygon, line_spans = _get(line, "content"), _get(line, "polygon"), _get(line, "spans")
+                    if type(content) is not str:
+                        raise ValueError("content: str expected")
+                    if polygon is not None:
+                        has_polygon = True
+                        _extend_polygon(polygons, polygon, "polygon")
+                    if line_spans is not None:
+                        has_spans = True
+                        _extend_spans(spans, line_spans, "spans")
+                except ValueError as e:
+                    raise ValueError(f"{path}.lines[{line_index}].{e}") from None
+                texts.append(content)
+                offset += len(content) + 1
+                line_offsets.append(offset)
+                polygon_offsets.append(len(polygons))
+                span_offsets.append(len(spans))
+
+            document._pages.append(PageView(
+                document,
+                line_start,
+                len(texts),
+                page_number,
+                _get(page, "width"),
+                _get(page, "height"),
+                [Table.from_value(table, f"{path}.tables[{i}]")
+                 for i, table in enumerate(_get(page, "tables", default=None) or [])],
+                [Figure.from_value(figure, f"{path}.figures[{i}]")
+                 for i, figure in enumerate(_get(page, "figures", default=None) or [])],
+            ))
+
+        document._text = "\n".join(texts)
+        document._line_fields = tuple(
+            name for name, present in (("polygon", has_polygon), ("spans", has_spans)) if present)
+        return document
+
+    def _text_range(self, line_start: int, line_end: int) -> str:
+        if line_start >= line_end:
+            return ""
+        return self._text[self._line_offsets[line_start]:self._line_offsets[line_end] - 1]
+
+    def _line_dict(self, index: int) -> dict:
+        line = {"content": self._text_range(index, index + 1)}
+        if "polygon" in self._line_fields:
+            line["polygon"] = self._polygons[self._polygon_offsets[index]:self._polygon_offsets[index + 1]].tolist()
+        if "spans" in self._line_fields:
+            line["spans"] = _span_dicts(self._spans, self._span_offsets[index], self._span_offsets[index + 1])
+        return line
+
+    def select(self, page_numbers: Iterable[int]) -> "DocumentPages":
+        """指定したページ番号のページだけを含む DocumentPages を返す（行の列は共有する）"""
+        selected = set(page_numbers)
+        document = DocumentPages.__new__(DocumentPages)
+        for name in DocumentPages.__slots__:
+            setattr(document, name, getattr(self, name))
+        document._pages = [page for page in self._pages if page.page_number in selected]
+        return document
+
+    def to_pages(self) -> List[dict]:
+        """analyze_document_structure のレスポンスと同じ形式のページ情報に戻す"""
+        return [page.to_dict() for page in self._pages]
+
+    def __getitem__(self, index):
+        return self._pages[index]
+
+    def __len__(self) -> int:
+        return len(self._pages)
@@ -1,25 +1,119 @@
 import azure.functions as func
 import logging
-from routes.analyze_document import analyze_document_structure_route
-from routes.extraction_category import extraction_category_route
-from routes.http_trigger import http_trigger_route
+import os
+import threading
+
+# 起動時間を短くするため、ルートモジュール（openai・Document IntelligenceのSDK・pydanticのモデルを読み込む）は
+# 各ルートの最初の呼び出し時に読み込む。読み込み済みのモジュールは再利用されるため、2回目以降のコストはない
+try:
+    # HTTPストリーミング拡張はルートの型注釈で判定されるため、起動時に読み込む（任意の依存関係）
+    from azurefunctions.extensions.http.fastapi import Request, StreamingResponse
+except ImportError:  # pragma: no cover
+    Request = StreamingResponse = None
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
 
 
 @app.route(route="analyze_document_structure", methods=["POST"])
-def analyze_document_structure(req: func.HttpRequest) -> func.HttpResponse:
+async def analyze_document_structure(req: func.HttpRequest) -> func.HttpResponse:
     """ analyze_document: データ構造（分類）とDocumentIntelligenceによるOCR結果を返すルート"""
-    return analyze_document_structure_route(req)
+    from routes.analyze_document import analyze_document_structure_route_async
+    return await analyze_document_structure_route_async(req)
+
+
+if StreamingResponse is not None:
+    @app.route(route="analyze_document_batch", methods=["POST"])
+    async def analyze_document_batch(req: Request) -> StreamingResponse:
+        """ analyze_document_batch: 複数のPDFを OCR → 分類 し、完了した文書から順にNDJSONで送るルート"""
+        from routes.analyze_batch import analyze_document_batch_stream_route
+        return await analyze_document_batch_stream_route(req)
+else:
+    @app.route(route="analyze_document_batch", methods=["POST"])
+    async def analyze_document_batch(req: func.HttpRequest) -> func.HttpResponse:
+        """ analyze_document_batch: HTTPストリーミング拡張がない場合は、全文書の完了後にNDJSONをまとめて返す"""
+        from routes.analyze_batch import analyze_document_batch_route
+        return await analyze_document_batch_route(req)
 
 
 @app.route(route="extraction_category", methods=["POST"])
-def analyze_document(req: func.HttpRequest) -> func.HttpResponse:
+async def analyze_document(req: func.HttpRequest) -> func.HttpResponse:
     """ analyze_document_structure: 分類ごとに、OCR結果からドキュメント内容を返すルート"""
-    return extraction_category_route(req)
+    from routes.extraction_category import extraction_category_route_async
+    return await extraction_category_route_async(req)
+
+
+if StreamingResponse is not None:
+    @app.route(route="extraction_category_stream", methods=["POST"])
+    async def extraction_category_stream(req: Request) -> StreamingResponse:
+        """ extraction_category_stream: 分類ごとの抽出結果を、生成された順にServer-Sent Eventsで返すルート"""
+        from routes.extraction_category_stream import extraction_category_stream_route
+        return await extraction_category_stream_route(req)
+else:
+    @app.route(route="extraction_category_stream", methods=["POST"])
+    async def extraction_category_stream(req: func.HttpRequest) -> func.HttpResponse:
+        """ extraction_category_stream: HTTPストリーミング拡張がない場合は、抽出完了後にイベントをまとめて返す"""
+        from routes.extraction_category_stream import extraction_category_stream_buffered_route
+        return await extraction_category_stream_buffered_route(req)
+
+
+if StreamingResponse is not None:
+    @app.route(route="extraction_categories", methods=["POST"])
+    async def extraction_categories(req: Request) -> StreamingResponse:
+        """ extraction_categories: 全分類の内容をサーバ側で並列に抽出し、完了した分類から順にNDJSONで送るルート"""
+        from routes.extraction_categories import extraction_categories_stream_route
+        return await extraction_categories_stream_route(req)
+else:
+    @app.route(route="extraction_categories", methods=["POST"])
+    async def extraction_categories(req: func.HttpRequest) -> func.HttpResponse:
+        """ extraction_categories: HTTPストリーミング拡張がない場合は、全分類の抽出完了後にNDJSONをまとめて返す"""
+        from routes.extraction_categories import extraction_categories_route_async
+        return await extraction_categories_route_async(req)
+
+
+@app.route(route="extraction_cache", methods=["DELETE"])
+def invalidate_extraction_cache(req: func.HttpRequest) -> func.HttpResponse:
+    """ extraction_cache: 抽出結果キャッシュを無効化するルート"""
+    from routes.extraction_cache import invalidate_extraction_cache_route
+    return invalidate_extraction_cache_route(req)
+
+
+@app.route(route="analyze_jobs", methods=["POST"])
+def submit_analyze_job(req: func.HttpRequest) -> func.HttpResponse:
+    """ analyze_jobs: ドキュメント構造解析をジョブとして登録し、ジョブIDを返すルート"""
+    from routes.analyze_jobs import submit_analyze_job_route
+    return submit_analyze_job_route(req)
+
+
+@app.route(route="analyze_jobs/{job_id}", methods=["GET"])
+def get_analyze_job(req: func.HttpRequest) -> func.HttpResponse:
+    """ analyze_jobs/{job_id}: ジョブの進捗と結果を返すルート"""
+    from routes.analyze_jobs import get_analyze_job_route
+    return get_analyze_job_route(req)
 
 
 @app.route(route="http_trigger")
 def http_trigger(req: func.HttpRequest) -> func.HttpResponse:
     """ http_trigger: テスト用のHTTPトリガー"""
+    from routes.http_trigger import http_trigger_route
     return http_trigger_route(req)
+
+
+@app.route(route="metrics", methods=["GET"])
+def metrics(req: func.HttpRequest) -> func.HttpResponse:
+    """ metrics: レート制限スケジューラやキャッシュのメトリクスを返すルート"""
+    from routes.metrics import metrics_route
+    return metrics_route(req)
+
+
+@app.warm_up_trigger("warmup")
+async def warmup(warmup) -> None:
+    """ warmup: インスタンスの追加時（Premium・専用プラン）に、ルートモジュールの読み込みとクライアントの生成を済ませる"""
+    from services.warmup import warm_up_async
+    await warm_up_async()
+
+
+if os.getenv("WARMUP_ON_LOAD", "false").lower() == "true":
+    # 常時起動のインスタンスでは、読み込み直後からバックグラウンドでウォームアップする
+    from services.warmup import warm_up
+    threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    logging.info("Started background warm-up.")
@@ -0,0 +1,326 @@
+import asyncio
+import base64
+import binascii
+import logging
+import json
+import os
+import openai
+import azure.functions as func
+from typing import AsyncIterator, Callable, List, Tuple
+from routes.analyze_document import _parse_bool, build_analyze_response_body
+from services.azure.azure_openai import AsyncAzureOpenAIChatService
+from services.azure.document_intelligence import AsyncAzureAIDocumentIntelligenceService
+from services.cache.analysis_cache import get_analysis_cache
+from services.classification import classify_document_async
+from services.figure_images import register_figure_source
+from services.telemetry.token_accounting import (
+    PromptBudgetExceededError, apply_token_headers, log_token_summary, start_token_account,
+)
+from services.telemetry.tracing import span, start_trace, traced_route
+from utils.http_compression import compress_body
+
+try:
+    # HTTPストリーミング拡張（azurefunctions-extensions-http-fastapi）がインストールされている場合は、
+    # OCR・分類を終えた文書の結果をその時点でクライアントへ送る（任意の依存関係）
+    from azurefunctions.extensions.http.fastapi import PlainTextResponse, Request, StreamingResponse
+except ImportError:  # pragma: no cover
+    PlainTextResponse = Request = StreamingResponse = None
+
+# OCR（Document Intelligence）と分類（Azure OpenAI）の同時実行数の既定値と上限
+# OCRを終えた文書から分類に進むため、前の文書の分類中に後の文書のOCRが進む
+BATCH_OCR_CONCURRENCY = int(os.getenv("BATCH_OCR_CONCURRENCY", "4"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+BATCH_MAX_DOCUMENTS = int(os.getenv("BATCH_MAX_DOCUMENTS", "200"))
+# ローカルファイルの参照（documents[].path）を許可するディレクトリ。未設定の場合は参照を受け付けない
+BATCH_LOCAL_ROOT = os.getenv("BATCH_LOCAL_ROOT")
+
+# (文書名, PDFバイナリを読み込む関数)
+BatchDocument = Tuple[str, Callable[[], bytes]]
+
+
+def resolve_local_path(path: str, root: str = None) -> str:
+    """
+    ローカルファイルの参照を、BATCH_LOCAL_ROOT 配下の絶対パスに解決する
+    :raises ValueError: 参照が許可されていない場合、または BATCH_LOCAL_ROOT の外を指す場合
+    """
+    root = root if root is not None else BATCH_LOCAL_ROOT
+    if not root:
+        raise ValueError("Local file references are disabled (BATCH_LOCAL_ROOT is not set).")
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"Path is outside of BATCH_LOCAL_ROOT: {path}")
+    return resolved
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _decode_pdf_binary(data: str) -> bytes:
+    return base64.b64decode(data)
+
+
+def parse_batch_documents(options) -> List[BatchDocument]:
+    """
+    JSONのリクエストの documents を、文書名とPDFを読み込む関数の組にする
+    Base64のPDF（pdf_binary）のデコード・ファイル（path）の読み込みは、どちらもOCRの直前に行う
+    :raises ValueError: リクエストの形式が正しくない場合
+    """
+    if not isinstance(options, dict):
+        raise ValueError("Request body must be a JSON object.")
+    documents = options.get("documents") or []
+    if not isinstance(documents, list):
+        raise ValueError("documents must be a list.")
+    batch_documents: List[BatchDocument] = []
+    for index, document in enumerate(documents):
+        if not isinstance(document, dict):
+            raise ValueError(f"documents[{index}] must be an object.")
+        name = document.get("name") or document.get("path") or f"document-{index + 1}"
+        if document.get("pdf_binary"):
+            if not isinstance(document["pdf_binary"], str):
+                raise ValueError(f"Document {name}: pdf_binary must be a Base64 string.")
+            batch_documents.append((name, lambda data=document["pdf_binary"]: _decode_pdf_binary(data)))
+        elif document.get("path"):
+            path = resolve_local_path(document["path"])
+            batch_documents.append((name, lambda path=path: _read_file(path)))
+        else:
+            raise ValueError(f"Document {name} has neither pdf_binary nor path.")
+    return batch_documents
+
+
+def build_batch_options(options, documents: List[BatchDocument], cache_control: str) -> Tuple[str, List[BatchDocument], bool, int, int]:
+    """文書数・同時実行数などのオプションを検証し、parse_batch_request の戻り値の形にする"""
+    if not documents:
+        raise ValueError("Missing required fields in request body.")
+    if len(documents) > BATCH_MAX_DOCUMENTS:
+        raise ValueError(f"Too many documents: {len(documents)} > {BATCH_MAX_DOCUMENTS}")
+
+    use_cache = _parse_bool(options.get("use_cache")) and "no-cache" not in cache_control
+    # リクエストで指定された同時実行数は、環境変数の値を上限とする
+    ocr_concurrency = min(int(options.get("ocr_concurrency") or BATCH_OCR_CONCURRENCY), BATCH_OCR_CONCURRENCY)
+    llm_concurrency = min(int(options.get("llm_concurrency") or BATCH_LLM_CONCURRENCY), BATCH_LLM_CONCURRENCY)
+    if ocr_concurrency < 1 or llm_concurrency < 1:
+        raise ValueError("ocr_concurrency and llm_concurrency must be greater than 0.")
+    return options.get("classification_prompt"), documents, use_cache, ocr_concurrency, llm_concurrency
+
+
+def _content_type(headers) -> str:
+    return headers.get("Content-Type", "").split(";")[0].strip().lower()
+
+
+def parse_batch_request(req: func.HttpRequest) -> Tuple[str, List[BatchDocument], bool, int, int]:
+    """
+    analyze_document_batch のリクエストを解析する
+    - multipart/form-data: ファイルパートごとに1文書。classification_prompt・use_cache・ocr_concurrency・llm_concurrency はフォーム項目
+    - application/json: {"classification_prompt": ..., "documents": [{"name": ..., "pdf_binary": Base64} または {"name": ..., "path": ...}], ...}
+      path は BATCH_LOCAL_ROOT からの相対パス。ファイルの読み込み・Base64のデコードはOCRの直前に行う
+    :return: (classification_prompt, 文書のリスト, use_cache, OCRの同時実行数, 分類の同時実行数)
+    :raises ValueError: 必須フィールドが不足している場合・リクエストの形式が正しくない場合
+    """
+    if _content_type(req.headers) == "multipart/form-data":
+        options = req.form
+        documents: List[BatchDocument] = []
+        for field, pdf_file in req.files.items(multi=True):
+            pdf_binary = pdf_file.read()
+            documents.append(
+                (pdf_file.filename or field, lambda pdf_binary=pdf_binary: pdf_binary))
+    else:
+        options = req.get_json()
+        documents = parse_batch_documents(options)
+    return build_batch_options(options, documents, req.headers.get("Cache-Control", ""))
+
+
+async def parse_batch_stream_request(req: "Request") -> Tuple[str, List[BatchDocument], bool, int, int]:
+    """parse_batch_request のHTTPストリーミング拡張（Request）版。リクエストの形式は同じ"""
+    if _content_type(req.headers) == "multipart/form-data":
+        options = await req.form()
+        documents: List[BatchDocument] = []
+        for field, value in options.multi_items():
+            if isinstance(value, str):
+                continue
+            pdf_binary = await value.read()
+            documents.append(
+                (value.filename or field, lambda pdf_binary=pdf_binary: pdf_binary))
+    else:
+        options = await req.json()
+        documents = parse_batch_documents(options)
+    return build_batch_options(options, documents, req.headers.get("Cache-Control", ""))
+
+
+def build_batch_error_result(index: int, name: str, e: Exception) -> dict:
+    """失敗した文書の結果行を作成する"""
+    if isinstance(e, PromptBudgetExceededError):
+        status_code, message = 413, f"{e}"
+    elif isinstance(e, openai.RateLimitError):
+        status_code, message = 429, "Rate limit exceeded."
+    elif isinstance(e, OSError):
+        status_code, message = 400, f"Failed to read document: {e}"
+    elif isinstance(e, binascii.Error):
+        status_code, message = 400, f"Invalid pdf_binary: {e}"
+    else:
+        status_code, message = 500, f"Error analyzing document structure: {e}"
+    logging.error(f"Batch document failed ({name}): {e}")
+    return {"index": index, "name": name, "status": status_code, "error": message}
+
+
+async def iter_batch_results(
+    document_intelligence_service: AsyncAzureAIDocumentIntelligenceService,
+    azure_openai_service: AsyncAzureOpenAIChatService,
+    classification_prompt: str,
+    documents: List[BatchDocument],
+    use_cache: bool,
+    ocr_concurrency: int,
+    llm_concurrency: int,
+) -> AsyncIterator[str]:
+    """
+    文書ごとに OCR → 分類 を実行し、完了した順に結果行（JSON文字列）を返す
+    OCRと分類はそれぞれのセマフォで同時実行数を制限する
+    成功した行は analyze_document_structure のレスポンスに index・name・status を加えたもの
+    """
+    ocr_semaphore = asyncio.Semaphore(ocr_concurrency)
+    llm_semaphore = asyncio.Semaphore(llm_concurrency)
+
+    async def run(index: int, name: str, load: Callable[[], bytes]) -> str:
+        try:
+            async with ocr_semaphore:
+                # PDFはOCRの直前に読み込み、同時にメモリに載る文書数を抑える
+                pdf_binary = await asyncio.to_thread(load)
+                with span("ocr"):
+                    di_response = await document_intelligence_service.analyze_document(
+                        pdf_binary, use_cache=use_cache)
+                document_hash = await asyncio.to_thread(register_figure_source, pdf_binary, di_response)
+                del pdf_binary
+            async with llm_semaphore:
+                with span("classification"):
+                    categories = await classify_document_async(
+                        azure_openai_service, classification_prompt, di_response)
+            extra = {"index": index, "name": name, "status": 200}
+            if document_hash is not None:
+                extra["document_hash"] = document_hash
+            return build_analyze_response_body(categories, di_response, extra=extra)
+        except Exception as e:
+            return json.dumps(build_batch_error_result(index, name, e), ensure_ascii=False)
+
+    tasks = [run(index, name, load) for index, (name, load) in enumerate(documents)]
+    for task in asyncio.as_completed(tasks):
+        yield await task
+
+
+def create_batch_services() -> Tuple[AsyncAzureAIDocumentIntelligenceService, AsyncAzureOpenAIChatService]:
+    document_intelligence_service = AsyncAzureAIDocumentIntelligenceService(
+        endpoint=os.getenv("DI_ENDPOINT"),
+        api_key=os.getenv("DI_KEY"),
+        cache=get_analysis_cache(),
+    )
+    azure_openai_service = AsyncAzureOpenAIChatService(
+        endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version="2025-01-01-preview"
+    )
+    return document_intelligence_service, azure_openai_service
+
+
+@traced_route("analyze_document_batch")
+async def analyze_document_batch_route(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    複数のPDFをまとめて 構造解析（OCR → 分類）する
+    HTTPストリーミング拡張がない環境で使用する。全文書の完了後にまとめて返す（analyze_document_batch_stream_route を参照）
+    : param req: HTTPリクエスト（parse_batch_request を参照）
+    : return: HTTPレスポンス（NDJSON。1行に1文書の結果を完了順に出力。失敗した文書は index・name・status・error）
+    注意:
+    - OCRの同時実行数は BATCH_OCR_CONCURRENCY、分類の同時実行数は BATCH_LLM_CONCURRENCY が上限となる。
+    """
+
+    logging.info('Processing analyze_document_batch request.')
+
+    try:
+        try:
+            with span("parse_request"):
+                classification_prompt, documents, use_cache, ocr_concurrency, llm_concurrency = parse_batch_request(
+                    req)
+        except ValueError as ve:
+            logging.error(f"Validation error: {ve}")
+            return func.HttpResponse(f"Validation error: {ve}", status_code=400)
+        token_account = start_token_account()
+
+        document_intelligence_service, azure_openai_service = create_batch_services()
+        lines = []
+        async for line in iter_batch_results(
+                document_intelligence_service, azure_openai_service, classification_prompt,
+                documents, use_cache, ocr_concurrency, llm_concurrency):
+            lines.append(line)
+        logging.info(f"Analyzed {len(lines)} documents in batch.")
+
+        log_token_summary("analyze_document_batch", token_account)
+        with span("compress"):
+            body, headers = compress_body(
+                ("\n".join(lines) + "\n").encode("utf-8"), req.headers.get("Accept-Encoding"))
+        return apply_token_headers(func.HttpResponse(
+            body=body,
+            status_code=200,
+            headers=headers,
+            mimetype="application/x-ndjson"
+        ), token_account)
+    except Exception as e:
+        logging.error(f"Error analyzing document batch: {e}")
+        return func.HttpResponse(f"Error analyzing document batch: {e}", status_code=500)
+
+
+async def iter_batch_lines(
+    document_intelligence_service: AsyncAzureAIDocumentIntelligenceService,
+    azure_openai_service: AsyncAzureOpenAIChatService,
+    classification_prompt: str,
+    documents: List[BatchDocument],
+    use_cache: bool,
+    ocr_concurrency: int,
+    llm_concurrency: int,
+) -> AsyncIterator[str]:
+    """
+    全文書の結果を、完了した順にNDJSONの1行（改行付き）として返す（ストリーミング用）
+    文書ごとの失敗は結果行（index・name・status・error）として返し、それ以外の失敗は status・error の行で終える
+    """
+    trace = start_trace("analyze_document_batch_stream")
+    token_account = start_token_account()
+    status_code = 200
+    count = 0
+    try:
+        async for line in iter_batch_results(
+                document_intelligence_service, azure_openai_service, classification_prompt,
+                documents, use_cache, ocr_concurrency, llm_concurrency):
+            count += 1
+            yield line + "\n"
+        logging.info(f"Analyzed {count} documents in batch.")
+    except Exception as e:
+        logging.error(f"Error analyzing document batch: {e}")
+        status_code = 500
+        yield json.dumps({"status": status_code, "error": f"Error analyzing document batch: {e}"}, ensure_ascii=False) + "\n"
+    finally:
+        log_token_summary("analyze_document_batch", token_account)
+        trace.log(status_code)
+
+
+async def analyze_document_batch_stream_route(req: "Request") -> "StreamingResponse":
+    """
+    analyze_document_batch のストリーミング版（HTTPストリーミング拡張を使用する）
+    リクエスト・レスポンスの形式は同じだが、各文書の結果を完了した時点で送る
+    ヘッダーは最初に送るため、レスポンスの圧縮とトークン数のヘッダーは付かない（トークン数はログに出力する）
+    """
+
+    logging.info('Processing analyze_document_batch_stream_route request.')
+
+    try:
+        classification_prompt, documents, use_cache, ocr_concurrency, llm_concurrency = \
+            await parse_batch_stream_request(req)
+    except ValueError as ve:
+        logging.error(f"Validation error: {ve}")
+        return PlainTextResponse(f"Validation error: {ve}", status_code=400)
+
+    document_intelligence_service, azure_openai_service = create_batch_services()
+    return StreamingResponse(
+        iter_batch_lines(
+            document_intelligence_service, azure_openai_service, classification_prompt,
+            documents, use_cache, ocr_concurrency, llm_concurrency),
+        media_type="application/x-ndjson",
+    )
@@ -1,20 +1,244 @@
+import asyncio
 import logging
 import os
 import base64
 import json
-import html
 import azure.functions as func
 import openai
-from services.azure.document_intelligence import AzureAIDocumentIntelligenceService
-from services.azure.azure_openai import AzureOpenAIChatService
-from domains.analyze_categories import Category, AnalyzeDocStructureResponseData
-from typing import List
+from services.azure.document_intelligence import AzureAIDocumentIntelligenceService, AsyncAzureAIDocumentIntelligenceService
+from services.azure.azure_openai import AzureOpenAIChatService, AsyncAzureOpenAIChatService
+from services.cache.analysis_cache import get_analysis_cache
+from services.cache.single_flight import build_single_flight_key, run_single_flight, run_single_flight_async
+from services.classification import classify_document, classify_document_async
+from services.figure_images import register_figure_source
+from services.revision_analysis import (
+    analyze_revision_ocr, analyze_revision_ocr_async, classify_revision, classify_revision_async, plan_revision,
+    save_revision, summarize_revision,
+)
+from services.telemetry.token_accounting import (
+    PromptBudgetExceededError, apply_token_headers, log_token_summary, start_token_account,
+)
+from services.telemetry.tracing import span, traced_route
+from utils.http_compression import compress_chunks
+from utils.json_stream import dumps, iter_json_string
+from utils.page_projection import shape_pages
+from domains.analyze_categories import Category, CategoryList
+from typing import Callable, Iterator, List, Optional, Tuple
 
 # ログ設定を追加
 logging.basicConfig(level=logging.DEBUG,
                     format='[%(asctime)s] %(levelname)s: %(message)s')
 
 
+def _parse_bool(value, default: bool = True) -> bool:
+    """クエリ文字列・フォーム値・JSON値を真偽値として解釈する"""
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() not in ("false", "0", "no", "off")
+
+
+def parse_analyze_request(req: func.HttpRequest) -> Tuple[str, bytes, bool]:
+    """
+    analyze_document_structureのリクエストを解析する
+    Content-Typeに応じて、以下の3形式を受け付ける
+    - application/json: pdf_binary にBase64エンコードしたPDF（従来の形式）
+    - application/pdf: ボディがPDFそのもの。classification_prompt・use_cache はクエリ文字列で指定
+    - multipart/form-data: PDFをファイルパートで送信。classification_prompt・use_cache はフォーム項目で指定
+    :return: (classification_prompt, デコード済みのPDFバイナリ, use_cache)
+    :raises ValueError: 必須フィールドが不足している場合
+    """
+    content_type = req.headers.get(
+        "Content-Type", "").split(";")[0].strip().lower()
+
+    if content_type == "application/pdf":
+        # ボディのバイト列をBase64を経由せずにそのまま使用する
+        classification_prompt = req.params.get("classification_prompt")
+        pdf_binary = req.get_body()
+        use_cache = _parse_bool(req.params.get("use_cache"))
+    elif content_type == "multipart/form-data":
+        classification_prompt = req.form.get("classification_prompt")
+        pdf_file = req.files.get("pdf_binary") or next(
+            iter(req.files.values()), None)
+        pdf_binary = pdf_file.read() if pdf_file else None
+        use_cache = _parse_bool(req.form.get("use_cache"))
+    else:
+        # リクエストBodyをJSONとして解析
+        req_body = req.get_json()
+        classification_prompt = req_body.get(
+            "classification_prompt")  # 分類用のプロンプト
+        pdf_binary = req_body.get("pdf_binary")  # PDFファイルのバイナリデータ
+        use_cache = _parse_bool(req_body.get("use_cache"))
+        if pdf_binary:
+            # PDFバイナリをデコード
+            with span("base64_decode"):
+                pdf_binary = base64.b64decode(pdf_binary)
+
+    if not pdf_binary:
+        raise ValueError("Missing required fields in request body.")
+
+    use_cache = use_cache and \
+        "no-cache" not in req.headers.get("Cache-Control", "")
+    return classification_prompt, pdf_binary, use_cache
+
+
+def parse_document_id(req: func.HttpRequest) -> Optional[str]:
+    """
+    改訂版の差分解析に使う文書IDを取得する（クエリ文字列 document_id、multipart/form-data の場合はフォーム項目でも指定できる）
+    同じ文書IDで以前に解析した結果があれば、内容が変わったページだけを解析し直す
+    """
+    document_id = req.params.get("document_id")
+    if not document_id and req.headers.get("Content-Type", "").split(";")[0].strip().lower() == "multipart/form-data":
+        document_id = req.form.get("document_id")
+    return document_id or None
+
+
+def parse_output_options(req: func.HttpRequest) -> Tuple[Optional[str], bool]:
+    """
+    レスポンスのページ情報の形式をクエリ文字列から取得する
+    - fields: ページごとに残すフィールド（例: fields=page_number,lines.content）
+    - format: compact の場合は、行をcontentだけにし、ポリゴンをフラットな数値配列にする
+    :return: (fields, compact)
+    """
+    return req.params.get("fields"), req.params.get("format", "").lower() == "compact"
+
+
+def iter_analyze_response_chunks(
+    categories: List[Category],
+    di_response: dict,
+    fields: Optional[str] = None,
+    compact: bool = False,
+    extra: Optional[dict] = None,
+    ndjson: bool = False,
+) -> Iterator[bytes]:
+    """
+    分類結果とDocument Intelligenceの解析結果から、レスポンスをチャンク（UTF-8）ごとに作成する
+    categories・content_markdown（と extra）を先に出力し、ページ情報は1ページずつ整形・シリアライズする
+    - ndjson=False: analyze_document_structure のJSON（{"categories": ..., "content_markdown": ..., "pages": [...]}）
+    - ndjson=True: 1行目に categories・content_markdown・page_count、2行目以降に1行1ページ
+    fields・compact を指定した場合は、ページ情報を絞り込んでからシリアライズする
+    extra を指定した場合は、その項目（改訂版の差分解析の結果 revision など）をレスポンスに追加する
+    """
+    with span("validate"):
+        category_list = CategoryList(categories=categories)
+
+    # デバッグ用ログ
+    logging.info(
+        f"Analyze Doc response_data: {category_list.categories}")
+
+    header = {"categories": [category.dict() for category in category_list.categories]}
+    pages = di_response["pages"]
+    yield dumps(header)[:-1] + b',"content_markdown":'
+    yield from iter_json_string(di_response["content_markdown"], escape_html=True)
+    if ndjson:
+        yield b"," + dumps({"page_count": len(pages), **(extra or {})})[1:] + b"\n"
+        for page in pages:
+            yield dumps(shape_pages([page], fields=fields, compact=compact)[0]) + b"\n"
+        return
+
+    for key, value in (extra or {}).items():
+        yield b"," + dumps({key: value})[1:-1]
+    yield b',"pages":['
+    for index, page in enumerate(pages):
+        yield (b"," if index else b"") + dumps(shape_pages([page], fields=fields, compact=compact)[0])
+    yield b"]}"
+
+
+def build_analyze_response_body(
+    categories: List[Category],
+    di_response: dict,
+    fields: Optional[str] = None,
+    compact: bool = False,
+    extra: Optional[dict] = None,
+) -> str:
+    """iter_analyze_response_chunks のJSONを1つの文字列として返す（ジョブの結果・一括解析の1行など）"""
+    with span("serialize"):
+        return b"".join(iter_analyze_response_chunks(
+            categories, di_response, fields=fields, compact=compact, extra=extra)).decode("utf-8")
+
+
+def wants_ndjson(req: func.HttpRequest) -> bool:
+    """Acceptヘッダーに application/x-ndjson が含まれる場合は、ページ単位のNDJSONで返す"""
+    return "application/x-ndjson" in req.headers.get("Accept", "").lower()
+
+
+def build_analyze_response(
+    categories: List[Category],
+    di_response: dict,
+    req: Optional[func.HttpRequest] = None,
+    revision: Optional[dict] = None,
+    document_hash: Optional[str] = None,
+) -> func.HttpResponse:
+    """
+    分類結果とDocument Intelligenceの解析結果からHTTPレスポンスを作成する
+    req を渡した場合は、クエリ文字列の fields・format でページ情報を絞り込み、
+    Accept に応じてNDJSONで返し、Accept-Encoding に応じてレスポンスを圧縮する
+    レスポンスはページ単位で作成しながら圧縮するため、圧縮前のボディ全体を保持しない
+    document_hash を指定した場合は、レスポンスに含める（extraction_category で図の画像を送るときに使用する）
+    """
+    try:
+        fields, compact = parse_output_options(req) if req is not None else (None, False)
+        ndjson = wants_ndjson(req) if req is not None else False
+        extra = {key: value for key, value in (("revision", revision), ("document_hash", document_hash))
+                 if value is not None}
+        chunks = iter_analyze_response_chunks(
+            categories, di_response, fields=fields, compact=compact, extra=extra or None, ndjson=ndjson)
+        # シリアライズと圧縮はページごとに交互に行うため、まとめて計測する
+        with span("serialize"):
+            body, headers = compress_chunks(
+                chunks, req.headers.get("Accept-Encoding") if req is not None else None)
+        # HTTPレスポンスを作成
+        return func.HttpResponse(
+            body=body,
+            status_code=200,
+            headers=headers if req is not None else {},
+            mimetype="application/x-ndjson" if ndjson else "application/json"
+        )
+    except Exception as e:
+        logging.error(f"Error serializing JSON: {e}")
+        return func.HttpResponse(f"Error serializing JSON: {e}", status_code=500)
+
+
+def run_analyze_pipeline(
+    classification_prompt: str,
+    pdf_binary: bytes,
+    use_cache: bool = True,
+    report_stage: Optional[Callable[[str, str], None]] = None,
+) -> dict:
+    """
+    OCR → 分類のパイプラインをHTTPリクエストと切り離して実行する（ジョブワーカー用）
+    :param report_stage: ステージの進捗を受け取るコールバック（stage, status）
+    :return: analyze_document_structure のレスポンスと同じ形式の辞書
+    """
+    report_stage = report_stage or (lambda stage, status: None)
+
+    report_stage("ocr", "running")
+    document_intelligence_service = AzureAIDocumentIntelligenceService(
+        endpoint=os.getenv("DI_ENDPOINT"),
+        api_key=os.getenv("DI_KEY"),
+        cache=get_analysis_cache(),
+    )
+    di_response = document_intelligence_service.analyze_document(
+        pdf_binary, use_cache=use_cache)
+    document_hash = register_figure_source(pdf_binary, di_response)
+    report_stage("ocr", "succeeded")
+
+    report_stage("classification", "running")
+    azure_openai_service = AzureOpenAIChatService(
+        endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version="2025-01-01-preview"
+    )
+    categories = classify_document(
+        azure_openai_service, classification_prompt, di_response)
+    report_stage("classification", "succeeded")
+
+    return json.loads(build_analyze_response_body(
+        categories, di_response, extra={"document_hash": document_hash} if document_hash is not None else None))
+
+
+@traced_route("analyze_document_structure")
 def analyze_document_structure_route(req: func.HttpRequest) -> func.HttpResponse:
     """ドキュメント構造を解析するHTTPエンドポイント。
     この関数は、リクエストボディに含まれるPDFバイナリデータを解析し、
@@ -23,6 +247,14 @@ def analyze_document_structure_route(req: func.HttpRequest) -> func.HttpResponse
     :param req: HTTPリクエストオブジェクト。リクエストボディには以下のフィールドが必要です:
         - system_prompt (str): 分類用のプロンプト。
         - pdf_binary (str): PDFファイルのBase64エンコードされたバイナリデータ。
+        - use_cache (bool, 任意): Falseの場合はOCR結果のキャッシュを参照しない。
+          `Cache-Control: no-cache` ヘッダーでも同様に指定できる。
+        JSONの代わりに、`application/pdf`（PDFそのもの）や `multipart/form-data` でも送信できる。
+        詳細は parse_analyze_request を参照。
+        クエリ文字列の `fields`・`format=compact` で、レスポンスのページ情報を絞り込める（parse_output_options を参照）。
+        クエリ文字列の `document_id` を指定すると、同じ文書IDの以前の解析結果と比べて
+        内容が変わったページだけを解析・分類し直し、レスポンスの `revision` に影響する分類を含める（parse_document_id を参照）。
+        `Accept-Encoding` に gzip・br が含まれる場合はレスポンスを圧縮する。
     :return: HTTPレスポンスオブジェクト
         - 200: 正常に解析が完了した場合。
         - 400: リクエストボディに必要なフィールドが不足している場合、またはバリデーションエラーが発生した場合。
@@ -44,82 +276,39 @@ def analyze_document_structure_route(req: func.HttpRequest) -> func.HttpResponse
     logging.info('Processing analyze_document_structure request.')
 
     try:
-        # リクエストBodyをJSONとして解析
-        req_body = req.get_json()
-        classification_prompt = req_body.get(
-            "classification_prompt")  # 分類用のプロンプト
-        pdf_binary = req_body.get("pdf_binary")  # PDFファイルのバイナリデータ
-
-        # システムメッセージに、システム上固定の推論の指示を追加
-        # TOOD: 本来はDBなどに外だし
-        system_prompt = f"""あなたは与えられた業務ドキュメントを分析し、ドキュメントの内容を考慮して構造的な文書にする役割です。
-
-# 指示
-ドキュメント内容を情報のまとまりで分類分けしてください。
-分類に紐づくドキュメントのページ番号を出力してください。
-
-# ユーザメッセージで与えられるデータの説明
-- 「-------------------- Markdown --------------------」は、ドキュメント全体をMarkdownで表現したものです。
-- 「-------------------- pages --------------------」は、ページごとの情報を表しています。
-
-# ルール
-- 「-------------------- Markdown --------------------」の内容を元に、ドキュメント全体の構造を理解して分類名を生成してください。
-- 「-------------------- pages --------------------」のJson情報を元に、page_numberを提示してください。
-    - 「# ページ番号」と「## ページ内容」が与えられます。
-    - 与えられた「# ページ番号」以外のページ番号は出力してはいけません。
-    - page_numberは分類ごとに被っても構いません。
-- 「ユーザから指示された分類」は必ず含むようにしてください。
-- 分類の追加は自由です。
-
-# ユーザから指示された分類
-{classification_prompt}
-
-# 出力形式
-- category: 分類の各項目名
-- page_number: 分類に紐づくページ番号
-
-# 出力形式例
-{{
-    [
-        {{
-            "category": "目次の各項目名",
-            "page_numbers": [
-                1, 2
-            ]
-        }}
-    ]
-}}"""
-
-        if not pdf_binary or not system_prompt:
-            return func.HttpResponse("Missing required fields in request body.", status_code=400)
-
-        # PDFバイナリをデコード
-        pdf_binary = base64.b64decode(pdf_binary)
+        try:
+            with span("parse_request"):
+                classification_prompt, pdf_binary, use_cache = parse_analyze_request(
+                    req)
+            document_id = parse_document_id(req)
+        except ValueError as ve:
+            return func.HttpResponse(f"{ve}", status_code=400)
+        token_account = start_token_account()
 
         # Document Intelligenceサービスを初期化
         DI_ENDPOINT = os.getenv("DI_ENDPOINT")
         DI_KEY = os.getenv("DI_KEY")
         document_intelligence_service = AzureAIDocumentIntelligenceService(
-            endpoint=DI_ENDPOINT, api_key=DI_KEY
-        )
-
-        # PDFを解析して内容を取得
-        di_response = document_intelligence_service.analyze_document(
-            pdf_binary)
-
-        # pagesをMarkdown形式に変換
-        pages_markdown = "\n".join(
-            f"# ページ番号: {page['page_number']}\n"
-            f"## ページ内容:\n" +
-            "\n".join(line["content"] for line in page["lines"])
-            for page in di_response["pages"]
+            endpoint=DI_ENDPOINT, api_key=DI_KEY, cache=get_analysis_cache()
         )
 
-        prompt = f"""-------------------- Markdown --------------------
-{di_response["content_markdown"]}
-
--------------------- pages --------------------
-{pages_markdown}"""
+        # PDFを解析して内容を取得（同一PDFの再解析はキャッシュから返す）
+        # 文書IDが指定された場合は、以前の解析結果から内容が変わったページだけを解析する
+        revision_plan = None
+        if document_id:
+            with span("revision_plan"):
+                revision_plan = plan_revision(
+                    document_id, pdf_binary, use_cache=use_cache)
+        # 同じPDFの解析が実行中の場合は、その結果を共有する
+        pdf_key = build_single_flight_key(pdf_binary)
+        with span("ocr") as attributes:
+            if revision_plan is not None:
+                di_response = analyze_revision_ocr(
+                    document_intelligence_service, revision_plan, pdf_binary, use_cache=use_cache)
+            else:
+                di_response, attributes["coalesced"] = run_single_flight(
+                    "ocr", build_single_flight_key(pdf_key, use_cache),
+                    lambda: document_intelligence_service.analyze_document(pdf_binary, use_cache=use_cache))
 
         # Azure OpenAIサービスを初期化
         azure_openai_service = AzureOpenAIChatService(
@@ -130,11 +319,17 @@ def analyze_document_structure_route(req: func.HttpRequest) -> func.HttpResponse
 
         # 分類を抽出
         try:
-            aoai_response_content = azure_openai_service.completions_format_categories(
-                system_prompt=system_prompt,
-                text=prompt,
-                deployment_name="gpt-4o"
-            )
+            with span("classification") as attributes:
+                if revision_plan is not None:
+                    aoai_response_content = classify_revision(
+                        azure_openai_service, classification_prompt, di_response, revision_plan)
+                else:
+                    aoai_response_content, attributes["coalesced"] = run_single_flight(
+                        "classification", build_single_flight_key(pdf_key, classification_prompt),
+                        lambda: classify_document(azure_openai_service, classification_prompt, di_response))
+        except PromptBudgetExceededError as e:
+            logging.error(f"Prompt budget exceeded: {e}")
+            return func.HttpResponse(f"{e}", status_code=413)
         except openai.RateLimitError as e:
             logging.error(f"Rate limit error: {e}")
             return func.HttpResponse("Rate limit exceeded. Please try again later.", status_code=429)
@@ -142,31 +337,115 @@ def analyze_document_structure_route(req: func.HttpRequest) -> func.HttpResponse
             logging.error(f"Error during OpenAI API call: {e}")
             return func.HttpResponse(f"Error during OpenAI API call: {e}", status_code=500)
 
+        revision = None
+        if revision_plan is not None:
+            with span("revision_store"):
+                revision = summarize_revision(
+                    revision_plan, classification_prompt, aoai_response_content)
+                save_revision(revision_plan, classification_prompt,
+                              aoai_response_content, di_response)
+
+        # 図を含む場合は、抽出時に図の画像を作成できるようPDFを保存しておく（描画は抽出時に必要なページだけ行う）
+        with span("figure_source"):
+            document_hash = register_figure_source(pdf_binary, di_response)
+
+        log_token_summary("analyze_document_structure", token_account)
+        return apply_token_headers(
+            build_analyze_response(aoai_response_content, di_response, req, revision=revision,
+                                   document_hash=document_hash), token_account)
+    except ValueError as ve:
+        logging.error(f"Validation error: {ve}")
+        return func.HttpResponse(f"Validation error: {ve}", status_code=400)
+    except Exception as e:
+        logging.error(f"Error analyzing document structure: {e}")
+        return func.HttpResponse(f"Error analyzing document structure: {e}", status_code=500)
+
+
+@traced_route("analyze_document_structure")
+async def analyze_document_structure_route_async(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    analyze_document_structure_route の非同期版
+    Document Intelligenceのポーリング中やAzure OpenAIの応答待ちの間にワーカーをブロックしないため、
+    1ワーカーで多数のドキュメントを並行して処理できる。リクエスト・レスポンスの仕様は同期版と同じ。
+    """
+
+    logging.info('Processing analyze_document_structure request (async).')
+
+    try:
+        try:
+            with span("parse_request"):
+                classification_prompt, pdf_binary, use_cache = parse_analyze_request(
+                    req)
+            document_id = parse_document_id(req)
+        except ValueError as ve:
+            return func.HttpResponse(f"{ve}", status_code=400)
+        token_account = start_token_account()
+
+        # PDFを解析して内容を取得（同一PDFの再解析はキャッシュから返す）
+        document_intelligence_service = AsyncAzureAIDocumentIntelligenceService(
+            endpoint=os.getenv("DI_ENDPOINT"),
+            api_key=os.getenv("DI_KEY"),
+            cache=get_analysis_cache(),
+        )
+        # 文書IDが指定された場合は、以前の解析結果から内容が変わったページだけを解析する
+        # （PDFのハッシュ計算・ディスクの読み書きでイベントループを止めないようにスレッドで実行）
+        revision_plan = None
+        if document_id:
+            with span("revision_plan"):
+                revision_plan = await asyncio.to_thread(
+                    plan_revision, document_id, pdf_binary, use_cache)
+        # 同じPDFの解析が実行中の場合は、その結果を共有する
+        pdf_key = build_single_flight_key(pdf_binary)
+        with span("ocr") as attributes:
+            if revision_plan is not None:
+                di_response = await analyze_revision_ocr_async(
+                    document_intelligence_service, revision_plan, pdf_binary, use_cache=use_cache)
+            else:
+                di_response, attributes["coalesced"] = await run_single_flight_async(
+                    "ocr", build_single_flight_key(pdf_key, use_cache),
+                    lambda: document_intelligence_service.analyze_document(pdf_binary, use_cache=use_cache))
+
+        azure_openai_service = AsyncAzureOpenAIChatService(
+            endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version="2025-01-01-preview"
+        )
+
+        # 分類を抽出
         try:
-            # Include Document Intelligence data in the response
-            response_data = AnalyzeDocStructureResponseData(
-                categories=aoai_response_content,
-                content_markdown=html.escape(di_response["content_markdown"]),
-                pages=di_response["pages"],
-            )
-
-            # デバッグ用ログ
-            logging.info(
-                f"Analyze Doc response_data: {response_data.categories}")
-
-            # HTTPレスポンスを作成
-            return func.HttpResponse(
-                body=json.dumps(
-                    response_data.dict(),
-                    ensure_ascii=False,
-                    default=lambda o: o.dict() if hasattr(o, 'dict') else str(o)
-                ),
-                status_code=200,
-                mimetype="application/json"
-            )
+            with span("classification") as attributes:
+                if revision_plan is not None:
+                    aoai_response_content = await classify_revision_async(
+                        azure_openai_service, classification_prompt, di_response, revision_plan)
+                else:
+                    aoai_response_content, attributes["coalesced"] = await run_single_flight_async(
+                        "classification", build_single_flight_key(pdf_key, classification_prompt),
+                        lambda: classify_document_async(azure_openai_service, classification_prompt, di_response))
+        except PromptBudgetExceededError as e:
+            logging.error(f"Prompt budget exceeded: {e}")
+            return func.HttpResponse(f"{e}", status_code=413)
+        except openai.RateLimitError as e:
+            logging.error(f"Rate limit error: {e}")
+            return func.HttpResponse("Rate limit exceeded. Please try again later.", status_code=429)
         except Exception as e:
-            logging.error(f"Error serializing JSON: {e}")
-            return func.HttpResponse(f"Error serializing JSON: {e}", status_code=500)
+            logging.error(f"Error during OpenAI API call: {e}")
+            return func.HttpResponse(f"Error during OpenAI API call: {e}", status_code=500)
+
+        revision = None
+        if revision_plan is not None:
+            with span("revision_store"):
+                revision = summarize_revision(
+                    revision_plan, classification_prompt, aoai_response_content)
+                await asyncio.to_thread(save_revision, revision_plan, classification_prompt,
+                                        aoai_response_content, di_response)
+
+        with span("figure_source"):
+            document_hash = await asyncio.to_thread(register_figure_source, pdf_binary, di_response)
+
+        log_token_summary("analyze_document_structure", token_account)
+        return apply_token_headers(
+            build_analyze_response(aoai_response_content, di_response, req, revision=revision,
+                                   document_hash=document_hash), token_account)
     except ValueError as ve:
         logging.error(f"Validation error: {ve}")
         return func.HttpResponse(f"Validation error: {ve}", status_code=400)
@@ -0,0 +1,76 @@
+import logging
+import json
+import azure.functions as func
+from services.jobs.job_worker import get_job_worker
+from routes.analyze_document import parse_analyze_request, run_analyze_pipeline
+
+ANALYZE_JOB_TYPE = "analyze_document_structure"
+
+
+def submit_analyze_job_route(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    ドキュメント構造解析（OCR → 分類）をジョブとして登録し、ジョブIDをすぐに返す
+    : param req: HTTPリクエスト（analyze_document_structure と同じ形式）
+    : return: HTTPレスポンス
+        - 202: ジョブを登録した場合。job_id と status_url を返す
+        - 400: リクエストボディに必要なフィールドが不足している場合
+    注意:
+    - ジョブは JOB_MAX_CONCURRENCY を上限にバックグラウンドで実行され、超えた分はキューで待機する。
+    """
+
+    logging.info('Processing submit_analyze_job request.')
+
+    try:
+        classification_prompt, pdf_binary, use_cache = parse_analyze_request(
+            req)
+    except ValueError as ve:
+        logging.error(f"Validation error: {ve}")
+        return func.HttpResponse(f"Validation error: {ve}", status_code=400)
+
+    try:
+        job = get_job_worker().submit(
+            ANALYZE_JOB_TYPE,
+            lambda report_stage: run_analyze_pipeline(
+                classification_prompt, pdf_binary, use_cache=use_cache, report_stage=report_stage),
+        )
+        logging.info(f"Analyze job submitted: {job['job_id']}")
+
+        return func.HttpResponse(
+            body=json.dumps({
+                "job_id": job["job_id"],
+                "status": job["status"],
+                "status_url": f"/api/analyze_jobs/{job['job_id']}",
+            }),
+            status_code=202,
+            mimetype="application/json"
+        )
+    except Exception as e:
+        logging.error(f"Error submitting analyze job: {e}")
+        return func.HttpResponse(f"Error submitting analyze job: {e}", status_code=500)
+
+
+def get_analyze_job_route(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    ジョブの状態を返す。成功したジョブは result に analyze_document_structure と同じ形式の結果を含む
+    : param req: HTTPリクエスト（ルートパラメータ job_id）
+    : return: HTTPレスポンス
+        - 200: ジョブが存在する場合
+        - 404: ジョブが存在しない場合
+    """
+
+    job_id = req.route_params.get("job_id")
+    logging.info(f'Processing get_analyze_job request: {job_id}')
+
+    try:
+        job = get_job_worker().store.get(job_id)
+        if job is None:
+            return func.HttpResponse(f"Job not found: {job_id}", status_code=404)
+
+        return func.HttpResponse(
+            body=json.dumps(job, ensure_ascii=False),
+            status_code=200,
+            mimetype="application/json"
+        )
+    except Exception as e:
+        logging.error(f"Error getting analyze job: {e}")
+        return func.HttpResponse(f"Error getting analyze job: {e}", status_code=500)
@@ -0,0 +1,36 @@
+import logging
+import json
+import azure.functions as func
+from domains.analyze_categories import ExtractionCategoryRequestData
+from routes.extraction_category import build_request_cache_key
+from services.cache.extraction_cache import invalidate_extraction_cache
+
+
+def invalidate_extraction_cache_route(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    抽出結果キャッシュを無効化する
+    - ボディなし: 全エントリを削除する
+    - extraction_category と同じリクエストボディ: その分類・ページ内容の抽出結果だけを削除する
+    : return: 削除したエントリ数（{"deleted": n}）
+    """
+
+    logging.info('Processing invalidate_extraction_cache request.')
+
+    try:
+        cache_key = None
+        if req.get_body():
+            request_data = ExtractionCategoryRequestData(**req.get_json())
+            cache_key = build_request_cache_key(request_data)
+        deleted = invalidate_extraction_cache(cache_key)
+        logging.info(f"Invalidated {deleted} extraction cache entries.")
+        return func.HttpResponse(
+            body=json.dumps({"deleted": deleted}),
+            status_code=200,
+            mimetype="application/json"
+        )
+    except ValueError as ve:
+        logging.error(f"Validation error: {ve}")
+        return func.HttpResponse(f"Validation error: {ve}", status_code=400)
+    except Exception as e:
+        logging.error(f"Error invalidating extraction cache: {e}")
+        return func.HttpResponse(f"Error invalidating extraction cache: {e}", status_code=500)
@@ -0,0 +1,271 @@
+import asyncio
+import contextvars
+import logging
+import json
+import os
+import openai
+import azure.functions as func
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import AsyncIterator, Iterator
+from services.azure.azure_openai import AzureOpenAIChatService, AsyncAzureOpenAIChatService
+from domains.analyze_categories import Category, ExtractionCategoriesRequestData, ExtractionCategoryRequestData
+from routes.extraction_category import extract_category, extract_category_async
+from services.telemetry.token_accounting import (
+    PromptBudgetExceededError, apply_token_headers, log_token_summary, start_token_account,
+)
+from services.telemetry.tracing import span, start_trace, traced_route
+from utils.http_compression import compress_body
+
+try:
+    # HTTPストリーミング拡張（azurefunctions-extensions-http-fastapi）がインストールされている場合は、
+    # 完了した分類の結果をその時点でクライアントへ送る（任意の依存関係）
+    from azurefunctions.extensions.http.fastapi import PlainTextResponse, Request, StreamingResponse
+except ImportError:  # pragma: no cover
+    PlainTextResponse = Request = StreamingResponse = None
+
+# 同時実行数の既定値と上限（リクエストで指定された値はこの上限で切り詰める）
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("EXTRACTION_MAX_CONCURRENCY", "8"))
+
+
+def build_category_request(
+    request_data: ExtractionCategoriesRequestData,
+    category: Category,
+) -> ExtractionCategoryRequestData:
+    """一括抽出のリクエストから、1分類分の抽出リクエストを組み立てる"""
+    return ExtractionCategoryRequestData(
+        target_category=category,
+        categories=request_data.categories,
+        content_markdown=request_data.content_markdown,
+        pages=request_data.pages.select(category.page_numbers),
+        context_token_budget=request_data.context_token_budget,
+        use_cache=request_data.use_cache,
+        document_hash=request_data.document_hash,
+        include_images=request_data.include_images,
+    )
+
+
+def build_error_result(category: Category, e: Exception) -> dict:
+    """失敗した分類の結果行を作成する"""
+    if isinstance(e, PromptBudgetExceededError):
+        logging.error(f"Prompt budget exceeded ({category.category}): {e}")
+        return {"category": category.category, "status": 413, "error": f"{e}"}
+    if isinstance(e, openai.RateLimitError):
+        logging.error(f"Rate limit error ({category.category}): {e}")
+        return {"category": category.category, "status": 429, "error": "Rate limit exceeded."}
+    logging.error(f"Error during OpenAI API call ({category.category}): {e}")
+    return {"category": category.category, "status": 500, "error": f"Error during OpenAI API call: {e}"}
+
+
+def resolve_max_concurrency(request_data: ExtractionCategoriesRequestData) -> int:
+    """リクエストの max_concurrency を環境変数の上限で切り詰める（0以下はそのまま返し、呼び出し側で400にする）"""
+    if request_data.max_concurrency is None:
+        return DEFAULT_MAX_CONCURRENCY
+    return min(request_data.max_concurrency, DEFAULT_MAX_CONCURRENCY)
+
+
+def iter_extraction_results(
+    azure_openai_service: AzureOpenAIChatService,
+    request_data: ExtractionCategoriesRequestData,
+    max_concurrency: int,
+) -> Iterator[dict]:
+    """
+    全分類の抽出を並列に実行し、完了した順に結果を返す
+    失敗した分類は、category・status・errorを含む辞書として返す
+    """
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {
+            # トークン数の集計をワーカースレッドに引き継ぐため、コンテキストをコピーして実行する
+            executor.submit(
+                contextvars.copy_context().run,
+                extract_category,
+                azure_openai_service,
+                build_category_request(request_data, category),
+            ): category
+            for category in request_data.categories
+        }
+        for future in as_completed(futures):
+            category = futures[future]
+            try:
+                yield future.result()
+            except Exception as e:
+                yield build_error_result(category, e)
+
+
+async def iter_extraction_results_async(
+    azure_openai_service: AsyncAzureOpenAIChatService,
+    request_data: ExtractionCategoriesRequestData,
+    max_concurrency: int,
+) -> AsyncIterator[dict]:
+    """iter_extraction_results の非同期版。セマフォで同時実行数を制限する"""
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(category: Category) -> dict:
+        async with semaphore:
+            try:
+                return await extract_category_async(
+                    azure_openai_service, build_category_request(request_data, category))
+            except Exception as e:
+                return build_error_result(category, e)
+
+    for task in asyncio.as_completed([run(category) for category in request_data.categories]):
+        yield await task
+
+
+@traced_route("extraction_categories")
+def extraction_categories_route(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    analyze_document_structure の結果を受け取り、全分類の内容をサーバ側で並列に抽出する
+    : param req: HTTPリクエスト（ExtractionCategoriesRequestData）
+    : return: HTTPレスポンス（NDJSON。1行に1分類の抽出結果を完了順に出力）
+    注意:
+    - 同時実行数はリクエストの max_concurrency で指定でき、環境変数 `EXTRACTION_MAX_CONCURRENCY` が上限となる。
+    """
+
+    logging.info('Processing extraction_categories_route request.')
+
+    try:
+        # リクエストBodyをJSONとして解析
+        with span("parse_request"):
+            req_body = req.get_json()
+            request_data = ExtractionCategoriesRequestData(**req_body)
+        token_account = start_token_account()
+
+        max_concurrency = resolve_max_concurrency(request_data)
+        if max_concurrency < 1:
+            return func.HttpResponse("max_concurrency must be greater than 0.", status_code=400)
+
+        # Azure OpenAIサービスを初期化
+        azure_openai_service = AzureOpenAIChatService(
+            endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version="2025-01-01-preview"
+        )
+
+        # 完了した分類から順にNDJSONの1行として書き出す
+        lines = []
+        for response_data in iter_extraction_results(azure_openai_service, request_data, max_concurrency):
+            logging.info(
+                f"Extract Data completed: {response_data.get('category')}")
+            lines.append(json.dumps(response_data, ensure_ascii=False))
+
+        log_token_summary("extraction_categories", token_account)
+        body, headers = compress_body(
+            ("\n".join(lines) + "\n").encode("utf-8"), req.headers.get("Accept-Encoding"))
+        return apply_token_headers(func.HttpResponse(
+            body=body,
+            status_code=200,
+            headers=headers,
+            mimetype="application/x-ndjson"
+        ), token_account)
+    except ValueError as ve:
+        logging.error(f"Validation error: {ve}")
+        return func.HttpResponse(f"Validation error: {ve}", status_code=400)
+    except Exception as e:
+        logging.error(f"Error extracting categories: {e}")
+        return func.HttpResponse(f"Error extracting categories: {e}", status_code=500)
+
+
+@traced_route("extraction_categories")
+async def extraction_categories_route_async(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    extraction_categories_route の非同期版
+    スレッドを使わずに、イベントループ上で全分類の抽出を並行して実行する。リクエスト・レスポンスの仕様は同期版と同じ。
+    """
+
+    logging.info('Processing extraction_categories_route request (async).')
+
+    try:
+        # リクエストBodyをJSONとして解析
+        with span("parse_request"):
+            req_body = req.get_json()
+            request_data = ExtractionCategoriesRequestData(**req_body)
+        token_account = start_token_account()
+
+        max_concurrency = resolve_max_concurrency(request_data)
+        if max_concurrency < 1:
+            return func.HttpResponse("max_concurrency must be greater than 0.", status_code=400)
+
+        azure_openai_service = AsyncAzureOpenAIChatService(
+            endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version="2025-01-01-preview"
+        )
+
+        # 完了した分類から順にNDJSONの1行として書き出す
+        lines = []
+        async for response_data in iter_extraction_results_async(azure_openai_service, request_data, max_concurrency):
+            logging.info(
+                f"Extract Data completed: {response_data.get('category')}")
+            lines.append(json.dumps(response_data, ensure_ascii=False))
+
+        log_token_summary("extraction_categories", token_account)
+        body, headers = compress_body(
+            ("\n".join(lines) + "\n").encode("utf-8"), req.headers.get("Accept-Encoding"))
+        return apply_token_headers(func.HttpResponse(
+            body=body,
+            status_code=200,
+            headers=headers,
+            mimetype="application/x-ndjson"
+        ), token_account)
+    except ValueError as ve:
+        logging.error(f"Validation error: {ve}")
+        return func.HttpResponse(f"Validation error: {ve}", status_code=400)
+    except Exception as e:
+        logging.error(f"Error extracting categories: {e}")
+        return func.HttpResponse(f"Error extracting categories: {e}", status_code=500)
+
+
+async def iter_extraction_lines(
+    azure_openai_service: AsyncAzureOpenAIChatService,
+    request_data: ExtractionCategoriesRequestData,
+    max_concurrency: int,
+) -> AsyncIterator[str]:
+    """
+    全分類の抽出結果を、完了した順にNDJSONの1行（改行付き）として返す（ストリーミング用）
+    分類ごとの失敗は結果行（category・status・error）として返し、それ以外の失敗は status・error の行で終える
+    """
+    trace = start_trace("extraction_categories_stream")
+    token_account = start_token_account()
+    status_code = 200
+    try:
+        async for response_data in iter_extraction_results_async(azure_openai_service, request_data, max_concurrency):
+            logging.info(
+                f"Extract Data completed: {response_data.get('category')}")
+            yield json.dumps(response_data, ensure_ascii=False) + "\n"
+    except Exception as e:
+        logging.error(f"Error extracting categories: {e}")
+        status_code = 500
+        yield json.dumps({"status": status_code, "error": f"Error extracting categories: {e}"}, ensure_ascii=False) + "\n"
+    finally:
+        log_token_summary("extraction_categories", token_account)
+        trace.log(status_code)
+
+
+async def extraction_categories_stream_route(req: "Request") -> "StreamingResponse":
+    """
+    extraction_categories のストリーミング版（HTTPストリーミング拡張を使用する）
+    リクエスト・レスポンスの形式は同じだが、各分類の結果を完了した時点で送る
+    ヘッダーは最初に送るため、レスポンスの圧縮とトークン数のヘッダーは付かない（トークン数はログに出力する）
+    """
+
+    logging.info('Processing extraction_categories_stream_route request.')
+
+    try:
+        request_data = ExtractionCategoriesRequestData(**(await req.json()))
+    except ValueError as ve:
+        logging.error(f"Validation error: {ve}")
+        return PlainTextResponse(f"Validation error: {ve}", status_code=400)
+
+    max_concurrency = resolve_max_concurrency(request_data)
+    if max_concurrency < 1:
+        return PlainTextResponse("max_concurrency must be greater than 0.", status_code=400)
+
+    azure_openai_service = AsyncAzureOpenAIChatService(
+        endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version="2025-01-01-preview"
+    )
+    return StreamingResponse(
+        iter_extraction_lines(azure_openai_service, request_data, max_concurrency),
+        media_type="application/x-ndjson",
+    )
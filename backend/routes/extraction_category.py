@@ -1,56 +1,329 @@
+import asyncio
 import logging
 import json
 import os
 import openai
 import azure.functions as func
-from services.azure.azure_openai import AzureOpenAIChatService
-from domains.analyze_categories import ExtractionCategoryRequestData
+from services.azure.azure_openai import AzureOpenAIChatService, AsyncAzureOpenAIChatService
+from services.cache.extraction_cache import build_extraction_cache_key, get_extraction_cache
+from services.cache.single_flight import run_single_flight, run_single_flight_async
+from services.figure_images import figure_images_available, get_figure_images, to_data_url
+from domains.analyze_categories import Category, ExtractionCategoryRequestData
 from utils.lines_to_context import lines_to_context
+from utils.retrieval import format_chunks, get_markdown_index
+from services.telemetry.token_accounting import (
+    PromptBudgetExceededError, apply_token_headers, count_prompt_sections, log_token_summary,
+    start_token_account, trim_budget_for,
+)
+from services.telemetry.tracing import span, traced, traced_route
+from utils.http_compression import compress_body
+from utils.token_estimator import estimate_text_tokens
+from typing import List, Optional, Tuple
 
+# システムプロンプトに含めるドキュメント内容のトークン予算（超える場合は関連部分だけを選ぶ。0で無効）
+CONTEXT_TOKEN_BUDGET = int(os.getenv("EXTRACTION_CONTEXT_TOKEN_BUDGET", "16000"))
+EXTRACTION_DEPLOYMENT = "gpt-4o-mini"
+# 抽出プロンプトのテンプレートのバージョン。プロンプトを変更した場合は上げて、古い抽出結果キャッシュを使わないようにする
+EXTRACTION_PROMPT_VERSION = "1"
 
-def extraction_category_route(req: func.HttpRequest) -> func.HttpResponse:
+
+def select_document_context(
+    request_data: ExtractionCategoryRequestData,
+    max_tokens: Optional[int] = None,
+) -> Tuple[str, bool]:
     """
-    分類ごとに、OCR結果からドキュメント内容を返す
-    : param req: HTTPリクエスト
-    : return: HTTPレスポンス
+    システムプロンプトに含めるドキュメント内容を選ぶ
+    Markdown全体がトークン予算に収まる場合はそのまま使い、収まらない場合は
+    語彙検索インデックスで抽出対象分類に関連するチャンクだけを予算内で選ぶ
+    : param max_tokens: プロンプト全体の上限から求めた、ドキュメント内容に使えるトークン数（Noneで制限なし）
+    : return: (ドキュメント内容, 抜粋かどうか)
     """
+    token_budget = request_data.context_token_budget
+    if token_budget is None:
+        token_budget = CONTEXT_TOKEN_BUDGET
+    if max_tokens is not None:
+        token_budget = min(token_budget, max_tokens) if token_budget > 0 else max_tokens
+    content_markdown = request_data.content_markdown
+    if token_budget <= 0 or estimate_text_tokens(content_markdown) <= token_budget:
+        return content_markdown, False
 
-    logging.info('Processing extraction_category_route request.')
+    index = get_markdown_index(content_markdown)
+    chunks = index.select_context(
+        query=request_data.target_category.category,
+        token_budget=token_budget,
+        required_pages=request_data.target_category.page_numbers,
+    )
+    logging.info(
+        f"Selected {len(chunks)}/{len(index.chunks)} chunks for {request_data.target_category.category}")
+    return format_chunks(chunks), True
 
-    try:
-        # リクエストBodyをJSONとして解析
-        req_body = req.get_json()
-        request_data = ExtractionCategoryRequestData(
-            **req_body)  # ExtractionCategoryでバリデーション
 
-        # 分類のpagesのcontentを取得
-        pages_content = lines_to_context(
-            pages=request_data.pages,
-        )
+def serialize_categories(categories: List[Category]) -> str:
+    """分類の並び順・表記を固定するため、JSONで直列化する"""
+    return json.dumps([category.dict() for category in categories], ensure_ascii=False)
+
 
-        prompt = f"{request_data.target_category}"
+def build_extraction_system_prompt(categories: List[Category], content_markdown: Optional[str]) -> str:
+    """
+    分類の抽出に使用するシステムプロンプトを生成する
+    ドキュメント単位の情報（全分類・Markdown）だけで構成し、同じドキュメントの全分類で
+    バイト列が一致するようにする（Azure OpenAIのプロンプトキャッシュが効く共通の先頭部分）
+    content_markdown=None の場合（分類ごとに関連部分の抜粋を送る場合）は全分類だけで構成し、
+    抜粋はユーザプロンプトに含める（抜粋は分類ごとに異なるため）
+    """
+    categories_json = serialize_categories(categories)
+    markdown_description = "- 「------ Markdown -------」は、ドキュメント全体の内容をMarkdownで表現したものです。" \
+        if content_markdown is not None else \
+        "- ユーザーメッセージの「------ Markdown（抜粋） -------」は、ドキュメントのうち抽出対象分類に関連する部分の抜粋をMarkdownで表現したものです。"
+    markdown_section = f"""
+
+
+------ Markdown -------
+{content_markdown}""" if content_markdown is not None else ""
 
-        system_prompt = f"""あなたは業務ドキュメントをから必要な情報を抽出する役割です。
-ユーザーメッセージで抽出するべき内容の題名（抽出対象分類名）が与えられます。
+    return f"""あなたは業務ドキュメントから必要な情報を抽出する役割です。
+ユーザーメッセージの末尾で抽出するべき内容の題名（抽出対象分類名）が与えられます。
 ドキュメントの内容から抽出対象分類名に該当する情報を漏れなく抽出してください。
 
 ◆ 補足情報の解説
 - 「------ 全分類 ------」は、ドキュメント全体の分類名です。
-- 「------ Markdown -------」は、ドキュメント全体の内容をMarkdownで表現したものです。
-- 「------ pages -------」は、ページごとの情報を表しています。
+{markdown_description}
+- ユーザーメッセージの「------ pages -------」は、抽出対象分類に紐づくページごとの情報を表しています。
+- ユーザーメッセージの「------ 抽出対象分類 -------」は、抽出対象の分類名とページ番号です。
 
 ◆ 実データ
 
 ------ 全分類 ------
-{request_data.categories}
+{categories_json}{markdown_section}"""
 
 
------- Markdown -------
-{request_data.content_markdown}
+def build_extraction_user_prompt(
+    request_data: ExtractionCategoryRequestData,
+    pages_text: str,
+    excerpt: Optional[str] = None,
+) -> str:
+    """
+    分類の抽出に使用するユーザプロンプトを生成する
+    excerpt（抽出対象分類に関連するMarkdownの抜粋）を指定した場合は、pages の前に含める
+    """
+    excerpt_section = f"""------ Markdown（抜粋） -------
+{excerpt}
+
+
+""" if excerpt is not None else ""
+    return f"""{excerpt_section}------ pages -------
+{pages_text}
+
+
+------ 抽出対象分類 -------
+{json.dumps(request_data.target_category.dict(), ensure_ascii=False)}"""
+
+
+@traced("extraction_prompt")
+def build_extraction_prompts(request_data: ExtractionCategoryRequestData) -> Tuple[str, str]:
+    """
+    分類の抽出に使用するシステムプロンプトとユーザプロンプトを生成する
+    分類ごとに変わる情報（Markdownの抜粋・ページ内容・抽出対象分類）はユーザプロンプトにまとめる
+    : param request_data: 抽出対象の分類とドキュメント情報
+    : return: (system_prompt, prompt)
+    """
+    # 分類のpagesのcontentを取得
+    pages_content = lines_to_context(
+        pages=request_data.pages,
+    )
+    pages_text = "\n\n".join(
+        f"# ページ番号: {page_content['page_number']}\n{page_content['context']}"
+        for page_content in pages_content
+    )
+
+    # プロンプトの上限を超える場合は、ドキュメント内容（Markdown）を削って収める
+    max_context_tokens = trim_budget_for(
+        estimate_text_tokens(build_extraction_system_prompt(request_data.categories, None)) +
+        estimate_text_tokens(build_extraction_user_prompt(request_data, pages_text)))
+    document_context, excerpt = select_document_context(
+        request_data, max_tokens=max_context_tokens)
+    if excerpt:
+        system_prompt = build_extraction_system_prompt(request_data.categories, None)
+        prompt = build_extraction_user_prompt(request_data, pages_text, excerpt=document_context)
+    else:
+        system_prompt = build_extraction_system_prompt(request_data.categories, document_context)
+        prompt = build_extraction_user_prompt(request_data, pages_text)
+
+    count_prompt_sections({
+        "categories": serialize_categories(request_data.categories),
+        "markdown": document_context,
+        "pages": pages_text,
+    })
+
+    return system_prompt, prompt
+
+
+def figure_image_page_numbers(request_data: ExtractionCategoryRequestData) -> List[int]:
+    """
+    図の画像をAzure OpenAIに送るページ番号を返す
+    include_images・document_hash が指定され、画像を作成できる環境で、抽出対象分類のページのうち図を含むもの
+    """
+    if not request_data.include_images or request_data.document_hash is None or not figure_images_available():
+        return []
+    target_page_numbers = set(request_data.target_category.page_numbers)
+    return [
+        page.page_number for page in request_data.pages
+        if page.page_number in target_page_numbers and any(figure.id for figure in page.figures)
+    ]
+
+
+@traced("figure_images")
+def load_figure_image_urls(request_data: ExtractionCategoryRequestData) -> List[str]:
+    """抽出対象分類のページの図の画像を、Azure OpenAIに渡すdata URLで返す（ページ番号順）"""
+    page_numbers = figure_image_page_numbers(request_data)
+    if not page_numbers:
+        return []
+    images = get_figure_images(request_data.document_hash, request_data.pages, page_numbers)
+    return [to_data_url(image) for page_number in sorted(images) for image in images[page_number]]
+
+
+def build_request_cache_key(request_data: ExtractionCategoryRequestData) -> str:
+    """抽出リクエストに対応する抽出結果キャッシュのキーを返す"""
+    return build_extraction_cache_key(
+        target_category=request_data.target_category,
+        pages=request_data.pages,
+        deployment_name=EXTRACTION_DEPLOYMENT,
+        prompt_version=EXTRACTION_PROMPT_VERSION,
+        image_document_hash=request_data.document_hash if figure_image_page_numbers(request_data) else None,
+    )
+
+
+def lookup_extraction_cache(request_data: ExtractionCategoryRequestData) -> Tuple[Optional[str], Optional[str]]:
+    """
+    抽出結果キャッシュを参照する
+    : return: (キャッシュキー, キャッシュされた抽出結果)。キャッシュが無効な場合はキーもNone
+    """
+    cache = get_extraction_cache()
+    if cache is None:
+        return None, None
+    cache_key = build_request_cache_key(request_data)
+    if not request_data.use_cache:
+        return cache_key, None
+    with span("extraction_cache_lookup") as attributes:
+        cached = cache.get(cache_key)
+        attributes["hit"] = cached is not None
+    if cached is not None:
+        logging.info(
+            f"Extraction cache hit: {request_data.target_category.category}")
+    return cache_key, cached
+
+
+def store_extraction_cache(cache_key: Optional[str], content: str) -> None:
+    """抽出結果をキャッシュに保存する"""
+    cache = get_extraction_cache()
+    if cache is not None and cache_key is not None:
+        cache.set(cache_key, content)
+
+
+def extract_category(
+    azure_openai_service: AzureOpenAIChatService,
+    request_data: ExtractionCategoryRequestData,
+) -> dict:
+    """
+    1つの分類について、ドキュメント内容から該当する情報を抽出し、レスポンス形式の辞書を返す
+    抽出対象分類・ページ内容・デプロイメント・プロンプトが同じ抽出結果はキャッシュから返す
+    同じ抽出が実行中の場合は、Azure OpenAIを呼び出さずにその結果を共有する
+    OpenAI APIのエラーはそのまま送出する
+    """
+    cache_key, cached = lookup_extraction_cache(request_data)
+    if cached is not None:
+        return build_extraction_response_data(request_data, cached)
+
+    def complete() -> str:
+        system_prompt, prompt = build_extraction_prompts(request_data)
+        # include_images が指定された場合は、ページ内の図の画像も送る（キャッシュにない図だけを描画する）
+        image_urls = load_figure_image_urls(request_data)
+
+        # Azure OpenAIサービスを使用して、ドキュメント内容から分類に該当する情報を抽出
+        content = azure_openai_service.completions_category_content(
+            system_prompt=system_prompt,
+            text=prompt,
+            image_urls=image_urls,
+            deployment_name=EXTRACTION_DEPLOYMENT
+        )
+        store_extraction_cache(cache_key, content)
+        return content
+
+    with span("extraction") as attributes:
+        aoai_response_content, attributes["coalesced"] = run_single_flight(
+            "extraction_category", cache_key or build_request_cache_key(request_data), complete)
+
+    return build_extraction_response_data(request_data, aoai_response_content)
+
+
+async def extract_category_async(
+    azure_openai_service: AsyncAzureOpenAIChatService,
+    request_data: ExtractionCategoryRequestData,
+) -> dict:
+    """extract_category の非同期版"""
+    cache_key, cached = lookup_extraction_cache(request_data)
+    if cached is not None:
+        return build_extraction_response_data(request_data, cached)
+
+    async def complete() -> str:
+        # プロンプトの組み立て（語彙検索インデックスの構築を含む）・ページの描画・ファイルの読み書きで
+        # イベントループをブロックしないよう、スレッドで実行する
+        system_prompt, prompt = await asyncio.to_thread(build_extraction_prompts, request_data)
+        image_urls = await asyncio.to_thread(load_figure_image_urls, request_data)
+
+        content = await azure_openai_service.completions_category_content(
+            system_prompt=system_prompt,
+            text=prompt,
+            image_urls=image_urls,
+            deployment_name=EXTRACTION_DEPLOYMENT
+        )
+        store_extraction_cache(cache_key, content)
+        return content
+
+    with span("extraction") as attributes:
+        aoai_response_content, attributes["coalesced"] = await run_single_flight_async(
+            "extraction_category", cache_key or build_request_cache_key(request_data), complete)
+
+    return build_extraction_response_data(request_data, aoai_response_content)
 
 
------- pages -------
-{pages_content}"""
+def build_extraction_response_data(request_data: ExtractionCategoryRequestData, content: str) -> dict:
+    """
+    抽出結果をレスポンス形式の辞書に変換する
+    saveAsImage は、図の画像をAzure OpenAIに送ったページでTrue
+    """
+    image_page_numbers = set(figure_image_page_numbers(request_data))
+    # レスポンスを新しい形式に変換
+    return {
+        "category": request_data.target_category.category,
+        "pages": [
+            {
+                "pageNumber": page_number,
+                "saveAsImage": page_number in image_page_numbers
+            }
+            for page_number in request_data.target_category.page_numbers
+        ],
+        "content": content
+    }
+
+
+@traced_route("extraction_category")
+def extraction_category_route(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    分類ごとに、OCR結果からドキュメント内容を返す
+    : param req: HTTPリクエスト
+    : return: HTTPレスポンス
+    """
+
+    logging.info('Processing extraction_category_route request.')
+
+    try:
+        # リクエストBodyをJSONとして解析
+        with span("parse_request"):
+            req_body = req.get_json()
+            request_data = ExtractionCategoryRequestData(
+                **req_body)  # ExtractionCategoryでバリデーション
+        token_account = start_token_account()
 
         # Azure OpenAIサービスを初期化
         azure_openai_service = AzureOpenAIChatService(
@@ -59,14 +332,79 @@ def extraction_category_route(req: func.HttpRequest) -> func.HttpResponse:
             api_version="2025-01-01-preview"
         )
 
-        # Azure OpenAIサービスを使用して、ドキュメント内容から分類に該当する情報を抽出
         try:
-            aoai_response_content = azure_openai_service.completions_category_content(
-                system_prompt=system_prompt,
-                text=prompt,
-                image_urls=[],
-                deployment_name="gpt-4o-mini"
-            )
+            response_data = extract_category(
+                azure_openai_service, request_data)
+        except PromptBudgetExceededError as e:
+            logging.error(f"Prompt budget exceeded: {e}")
+            return func.HttpResponse(f"{e}", status_code=413)
+        except openai.RateLimitError as e:
+            logging.error(f"Rate limit error: {e}")
+            return func.HttpResponse("Rate limit exceeded. Please try again later.", status_code=429)
+        except Exception as e:
+            logging.error(f"Error during OpenAI API call: {e}")
+            return func.HttpResponse(f"Error during OpenAI API call: {e}", status_code=500)
+
+        try:
+            # デバッグ用ログ
+            logging.info(f"Extract Data response_data: {response_data}")
+
+            log_token_summary("extraction_category", token_account)
+
+            # HTTPレスポンスを作成
+            with span("serialize"):
+                body = json.dumps(
+                    response_data,
+                    ensure_ascii=False
+                ).encode("utf-8")
+            body, headers = compress_body(
+                body, req.headers.get("Accept-Encoding"))
+            return apply_token_headers(func.HttpResponse(
+                body=body,
+                status_code=200,
+                headers=headers,
+                mimetype="application/json"
+            ), token_account)
+        except Exception as e:
+            logging.error(f"Error serializing JSON: {e}")
+            return func.HttpResponse(f"Error serializing JSON: {e}", status_code=500)
+    except ValueError as ve:
+        logging.error(f"Validation error: {ve}")
+        return func.HttpResponse(f"Validation error: {ve}", status_code=400)
+    except Exception as e:
+        logging.error(f"Error analyzing document structure: {e}")
+        return func.HttpResponse(f"Error analyzing document structure: {e}", status_code=500)
+
+
+@traced_route("extraction_category")
+async def extraction_category_route_async(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    extraction_category_route の非同期版
+    Azure OpenAIの応答待ちの間にワーカーをブロックしない。リクエスト・レスポンスの仕様は同期版と同じ。
+    """
+
+    logging.info('Processing extraction_category_route request (async).')
+
+    try:
+        # リクエストBodyをJSONとして解析
+        with span("parse_request"):
+            req_body = req.get_json()
+            request_data = ExtractionCategoryRequestData(
+                **req_body)  # ExtractionCategoryでバリデーション
+        token_account = start_token_account()
+
+        azure_openai_service = AsyncAzureOpenAIChatService(
+            endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version="2025-01-01-preview"
+        )
+
+        try:
+            response_data = await extract_category_async(
+                azure_openai_service, request_data)
+        except PromptBudgetExceededError as e:
+            logging.error(f"Prompt budget exceeded: {e}")
+            return func.HttpResponse(f"{e}", status_code=413)
         except openai.RateLimitError as e:
             logging.error(f"Rate limit error: {e}")
             return func.HttpResponse("Rate limit exceeded. Please try again later.", status_code=429)
@@ -75,30 +413,25 @@ def extraction_category_route(req: func.HttpRequest) -> func.HttpResponse:
             return func.HttpResponse(f"Error during OpenAI API call: {e}", status_code=500)
 
         try:
-            # レスポンスを新しい形式に変換
-            response_data = {
-                "category": request_data.target_category.category,
-                "pages": [
-                    {
-                        "pageNumber": page_number,
-                        "saveAsImage": False  # ページ内に複数の画像があるはずなので、実装修正必要
-                    }
-                    for page_number in request_data.target_category.page_numbers
-                ],
-                "content": aoai_response_content
-            }
             # デバッグ用ログ
             logging.info(f"Extract Data response_data: {response_data}")
 
+            log_token_summary("extraction_category", token_account)
+
             # HTTPレスポンスを作成
-            return func.HttpResponse(
-                body=json.dumps(
+            with span("serialize"):
+                body = json.dumps(
                     response_data,
                     ensure_ascii=False
-                ),
+                ).encode("utf-8")
+            body, headers = compress_body(
+                body, req.headers.get("Accept-Encoding"))
+            return apply_token_headers(func.HttpResponse(
+                body=body,
                 status_code=200,
+                headers=headers,
                 mimetype="application/json"
-            )
+            ), token_account)
         except Exception as e:
             logging.error(f"Error serializing JSON: {e}")
             return func.HttpResponse(f"Error serializing JSON: {e}", status_code=500)
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import json
+import os
+import azure.functions as func
+from typing import AsyncIterator
+from domains.analyze_categories import ExtractionCategoryRequestData
+from routes.extraction_categories import build_error_result
+from routes.extraction_category import (
+    EXTRACTION_DEPLOYMENT, build_extraction_prompts, build_extraction_response_data, load_figure_image_urls,
+    lookup_extraction_cache, store_extraction_cache,
+)
+from services.azure.azure_openai import AsyncAzureOpenAIChatService
+from services.telemetry.token_accounting import log_token_summary, start_token_account
+from services.telemetry.tracing import start_trace
+
+try:
+    # HTTPストリーミング拡張（azurefunctions-extensions-http-fastapi）がインストールされている場合は、
+    # 生成されたテキストを届いた順にクライアントへ送る（任意の依存関係）
+    from azurefunctions.extensions.http.fastapi import PlainTextResponse, Request, StreamingResponse
+except ImportError:  # pragma: no cover
+    PlainTextResponse = Request = StreamingResponse = None
+
+# Server-Sent Eventsのレスポンスヘッダー（途中のプロキシでバッファリングさせない）
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def format_sse_event(event: str, data: dict) -> str:
+    """Server-Sent Eventsの1イベントを作成する（dataは1行のJSON）"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def iter_extraction_events(
+    azure_openai_service: AsyncAzureOpenAIChatService,
+    request_data: ExtractionCategoryRequestData,
+) -> AsyncIterator[str]:
+    """
+    1つの分類の抽出結果を、Server-Sent Eventsとして生成された順に返す
+    - delta: 生成されたテキストの断片（{"content": "..."}）。キャッシュにヒットした場合は全体を1回で返す
+    - result: 最後に1回。extraction_category のレスポンスと同じ category・pages・content
+    - error: 失敗した場合に result の代わりに返す（category・status・error）
+    """
+    trace = start_trace("extraction_category_stream")
+    token_account = start_token_account()
+    status_code = 200
+    try:
+        cache_key, content = lookup_extraction_cache(request_data)
+        if content is not None:
+            yield format_sse_event("delta", {"content": content})
+        else:
+            # 語彙検索インデックスの構築などでイベントループをブロックしないよう、スレッドで実行する
+            system_prompt, prompt = await asyncio.to_thread(build_extraction_prompts, request_data)
+            image_urls = await asyncio.to_thread(load_figure_image_urls, request_data)
+            parts = []
+            async for delta in azure_openai_service.stream_category_content(
+                system_prompt=system_prompt,
+                text=prompt,
+                image_urls=image_urls,
+                deployment_name=EXTRACTION_DEPLOYMENT
+            ):
+                parts.append(delta)
+                yield format_sse_event("delta", {"content": delta})
+            content = "".join(parts)
+            store_extraction_cache(cache_key, content)
+        yield format_sse_event("result", build_extraction_response_data(request_data, content))
+    except Exception as e:
+        error = build_error_result(request_data.target_category, e)
+        status_code = error["status"]
+        yield format_sse_event("error", error)
+    finally:
+        log_token_summary("extraction_category_stream", token_account)
+        trace.log(status_code)
+
+
+def create_chat_service() -> AsyncAzureOpenAIChatService:
+    return AsyncAzureOpenAIChatService(
+        endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version="2025-01-01-preview"
+    )
+
+
+async def extraction_category_stream_route(req: "Request") -> "StreamingResponse":
+    """
+    extraction_category のストリーミング版（HTTPストリーミング拡張を使用する）
+    リクエストは extraction_category と同じ。レスポンスは text/event-stream（iter_extraction_events を参照）
+    """
+
+    logging.info('Processing extraction_category_stream request.')
+
+    try:
+        request_data = ExtractionCategoryRequestData(**(await req.json()))
+    except ValueError as ve:
+        logging.error(f"Validation error: {ve}")
+        return PlainTextResponse(f"Validation error: {ve}", status_code=400)
+
+    return StreamingResponse(
+        iter_extraction_events(create_chat_service(), request_data),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+async def extraction_category_stream_buffered_route(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    HTTPストリーミング拡張がない環境での extraction_category_stream
+    イベントの形式は同じだが、抽出が完了してからまとめて返す
+    """
+
+    logging.info('Processing extraction_category_stream request (buffered).')
+
+    try:
+        request_data = ExtractionCategoryRequestData(**req.get_json())
+    except ValueError as ve:
+        logging.error(f"Validation error: {ve}")
+        return func.HttpResponse(f"Validation error: {ve}", status_code=400)
+
+    events = [event async for event in iter_extraction_events(create_chat_service(), request_data)]
+    return func.HttpResponse(
+        body="".join(events).encode("utf-8"),
+        status_code=200,
+        headers=SSE_HEADERS,
+        mimetype="text/event-stream"
+    )
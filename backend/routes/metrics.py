@@ -0,0 +1,33 @@
+import logging
+import json
+import azure.functions as func
+from services.azure.rate_limiter import get_rate_limit_metrics
+from services.cache.analysis_cache import get_analysis_cache
+from services.cache.extraction_cache import get_extraction_cache
+from services.cache.single_flight import get_single_flight_metrics
+
+
+def metrics_route(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    インスタンス内の運用メトリクスを返す
+    - rate_limits: デプロイメントごとのキューの深さ・待機時間・再試行回数
+    - analysis_cache: OCR結果キャッシュのヒット数・ミス数
+    - extraction_cache: 抽出結果キャッシュのヒット数・ミス数
+    - single_flight: 同時に届いた同じ内容の処理（ocr・classification・extraction_category）の実行数と、結果を共有した数
+    """
+
+    logging.info('Processing metrics request.')
+
+    analysis_cache = get_analysis_cache()
+    extraction_cache = get_extraction_cache()
+    metrics = {
+        "rate_limits": get_rate_limit_metrics(),
+        "analysis_cache": analysis_cache.stats() if analysis_cache else None,
+        "extraction_cache": extraction_cache.stats() if extraction_cache else None,
+        "single_flight": get_single_flight_metrics(),
+    }
+    return func.HttpResponse(
+        body=json.dumps(metrics),
+        status_code=200,
+        mimetype="application/json"
+    )
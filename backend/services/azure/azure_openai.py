@@ -1,16 +1,52 @@
+import os
 import openai
 from openai.types import CreateEmbeddingResponse
 from domains.analyze_categories import Category, CategoryList
-from typing import List
+from services.azure.client_registry import get_openai_client, get_async_openai_client
+from services.azure.rate_limiter import (
+    get_rate_limit_scheduler, response_usage,
+    PRIORITY_CLASSIFICATION, PRIORITY_EXTRACTION, DEFAULT_ESTIMATED_COMPLETION_TOKENS,
+)
+from services.telemetry.token_accounting import check_prompt_budget, record_token_usage
+from services.telemetry.tracing import span
+from utils.token_estimator import count_message_tokens
+from typing import AsyncIterator, Iterator, List, Optional
 import logging
 
 
+# 抽出時に送る図の画像の解像度（low: 1枚あたり固定のトークン数 / high / auto）
+IMAGE_DETAIL = os.getenv("FIGURE_IMAGE_DETAIL", "low")
+
+
+def build_user_content(text: str, image_urls: Optional[List[str]] = None):
+    """ユーザーメッセージの内容を作成する。画像がある場合はテキストと画像（image_url）の配列にする"""
+    if not image_urls:
+        return text
+    return [{"type": "text", "text": text}] + [
+        {"type": "image_url", "image_url": {"url": url, "detail": IMAGE_DETAIL}}
+        for url in image_urls
+    ]
+
+
+def _chunk_content(chunk) -> str:
+    """ストリーミング応答のチャンクから、生成されたテキストの断片を取り出す（usageだけのチャンクは空文字）"""
+    choices = getattr(chunk, "choices", None) or []
+    if not choices:
+        return ""
+    return getattr(choices[0].delta, "content", None) or ""
+
+
 class AzureOpenAIChatService:
-    def __init__(self, endpoint: str, api_key: str, api_version: str) -> None:
-        self.openai = openai
-        self.openai.azure_endpoint = endpoint
-        self.openai.api_key = api_key
-        self.openai.api_version = api_version
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: str,
+        api_version: str,
+        client: Optional[openai.AzureOpenAI] = None,
+    ) -> None:
+        # openaiモジュールのグローバル設定は書き換えず、プロセス内で共有されるクライアントを使用する
+        self.client = client or get_openai_client(
+            endpoint=endpoint, api_key=api_key, api_version=api_version)
 
     # 本来は画像情報も含めるべきだが、未検証未実装
     def completions_format_categories(
@@ -23,12 +59,24 @@ class AzureOpenAIChatService:
         messages.append({"role": "system", "content": system_prompt})
         messages.append({"role": "user", "content": text})
 
+        # 送信前にトークン数を数え、上限を超える場合はネットワークに出さずにエラーにする
+        prompt_tokens = count_message_tokens(messages)
+        check_prompt_budget("classification", prompt_tokens)
+
         try:
-            response = self.openai.beta.chat.completions.parse(
-                model=deployment_name,
-                messages=messages,
-                response_format=CategoryList,
-            )
+            with span("openai", stage="classification", deployment=deployment_name):
+                # レート制限スケジューラで送信枠を確保し、RateLimitErrorは再試行する
+                response = get_rate_limit_scheduler(deployment_name).run(
+                    lambda: self.client.beta.chat.completions.parse(
+                        model=deployment_name,
+                        messages=messages,
+                        response_format=CategoryList,
+                    ),
+                    estimated_tokens=prompt_tokens + DEFAULT_ESTIMATED_COMPLETION_TOKENS,
+                    priority=PRIORITY_CLASSIFICATION,
+                )
+            record_token_usage("classification", deployment_name,
+                               prompt_tokens, response_usage(response))
             return response.choices[0].message.parsed.categories
         except openai.RateLimitError as e:
             logging.error(f"Rate limit error: {e}")
@@ -43,16 +91,164 @@ class AzureOpenAIChatService:
         text: str,
         image_urls: list[str],
         deployment_name: str,
+    ) -> List[Category]:
+        messages: list = []
+        messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": build_user_content(text, image_urls)})
+
+        # 送信前にトークン数を数え、上限を超える場合はネットワークに出さずにエラーにする
+        prompt_tokens = count_message_tokens(messages)
+        check_prompt_budget("extraction", prompt_tokens)
+
+        try:
+            with span("openai", stage="extraction", deployment=deployment_name):
+                response = get_rate_limit_scheduler(deployment_name).run(
+                    lambda: self.client.chat.completions.create(
+                        model=deployment_name,
+                        messages=messages,
+                    ),
+                    estimated_tokens=prompt_tokens + DEFAULT_ESTIMATED_COMPLETION_TOKENS,
+                    priority=PRIORITY_EXTRACTION,
+                )
+            record_token_usage("extraction", deployment_name,
+                               prompt_tokens, response_usage(response))
+            return response.choices[0].message.content
+        except openai.RateLimitError as e:
+            logging.error(f"Rate limit error: {e}")
+            raise
+        except Exception as e:
+            logging.error(f"Error during OpenAI API call: {e}")
+            raise
+
+    def stream_category_content(
+        self,
+        system_prompt: str,
+        text: str,
+        image_urls: list[str],
+        deployment_name: str,
+    ) -> Iterator[str]:
+        """
+        completions_category_content のストリーミング版。生成されたテキストの断片を届いた順に返す
+        応答の開始までをレート制限スケジューラで再試行し、使用トークン数は最後のチャンクのusageで集計する
+        """
+        messages: list = []
+        messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": build_user_content(text, image_urls)})
+
+        # 送信前にトークン数を数え、上限を超える場合はネットワークに出さずにエラーにする
+        prompt_tokens = count_message_tokens(messages)
+        check_prompt_budget("extraction", prompt_tokens)
+        estimated_tokens = prompt_tokens + DEFAULT_ESTIMATED_COMPLETION_TOKENS
+        scheduler = get_rate_limit_scheduler(deployment_name)
+
+        try:
+            with span("openai", stage="extraction", deployment=deployment_name, stream=True):
+                stream = scheduler.run(
+                    lambda: self.client.chat.completions.create(
+                        model=deployment_name,
+                        messages=messages,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                    ),
+                    estimated_tokens=estimated_tokens,
+                    priority=PRIORITY_EXTRACTION,
+                )
+            usage = None
+            for chunk in stream:
+                usage = response_usage(chunk) or usage
+                content = _chunk_content(chunk)
+                if content:
+                    yield content
+            scheduler.record_usage(estimated_tokens, usage)
+            record_token_usage("extraction", deployment_name,
+                               prompt_tokens, usage)
+        except openai.RateLimitError as e:
+            logging.error(f"Rate limit error: {e}")
+            raise
+        except Exception as e:
+            logging.error(f"Error during OpenAI API call: {e}")
+            raise
+
+
+class AsyncAzureOpenAIChatService:
+    """
+    AsyncAzureOpenAIクライアントを使用するチャットサービス
+    応答待ちの間もイベントループをブロックしない
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: str,
+        api_version: str,
+        client: Optional[openai.AsyncAzureOpenAI] = None,
+    ) -> None:
+        self.client = client or get_async_openai_client(
+            endpoint=endpoint, api_key=api_key, api_version=api_version)
+
+    async def completions_format_categories(
+        self,
+        system_prompt: str,
+        text: str,
+        deployment_name: str,
     ) -> List[Category]:
         messages: list = []
         messages.append({"role": "system", "content": system_prompt})
         messages.append({"role": "user", "content": text})
 
+        # 送信前にトークン数を数え、上限を超える場合はネットワークに出さずにエラーにする
+        prompt_tokens = count_message_tokens(messages)
+        check_prompt_budget("classification", prompt_tokens)
+
         try:
-            response = self.openai.chat.completions.create(
-                model=deployment_name,
-                messages=messages,
-            )
+            with span("openai", stage="classification", deployment=deployment_name):
+                # レート制限スケジューラで送信枠を確保し、RateLimitErrorは再試行する
+                response = await get_rate_limit_scheduler(deployment_name).run_async(
+                    lambda: self.client.beta.chat.completions.parse(
+                        model=deployment_name,
+                        messages=messages,
+                        response_format=CategoryList,
+                    ),
+                    estimated_tokens=prompt_tokens + DEFAULT_ESTIMATED_COMPLETION_TOKENS,
+                    priority=PRIORITY_CLASSIFICATION,
+                )
+            record_token_usage("classification", deployment_name,
+                               prompt_tokens, response_usage(response))
+            return response.choices[0].message.parsed.categories
+        except openai.RateLimitError as e:
+            logging.error(f"Rate limit error: {e}")
+            raise
+        except Exception as e:
+            logging.error(f"Error during OpenAI API call: {e}")
+            raise
+
+    async def completions_category_content(
+        self,
+        system_prompt: str,
+        text: str,
+        image_urls: list[str],
+        deployment_name: str,
+    ) -> str:
+        messages: list = []
+        messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": build_user_content(text, image_urls)})
+
+        # 送信前にトークン数を数え、上限を超える場合はネットワークに出さずにエラーにする
+        prompt_tokens = count_message_tokens(messages)
+        check_prompt_budget("extraction", prompt_tokens)
+
+        try:
+            with span("openai", stage="extraction", deployment=deployment_name):
+                response = await get_rate_limit_scheduler(deployment_name).run_async(
+                    lambda: self.client.chat.completions.create(
+                        model=deployment_name,
+                        messages=messages,
+                    ),
+                    estimated_tokens=prompt_tokens + DEFAULT_ESTIMATED_COMPLETION_TOKENS,
+                    priority=PRIORITY_EXTRACTION,
+                )
+            record_token_usage("extraction", deployment_name,
+                               prompt_tokens, response_usage(response))
             return response.choices[0].message.content
         except openai.RateLimitError as e:
             logging.error(f"Rate limit error: {e}")
@@ -60,3 +256,52 @@ class AzureOpenAIChatService:
         except Exception as e:
             logging.error(f"Error during OpenAI API call: {e}")
             raise
+
+    async def stream_category_content(
+        self,
+        system_prompt: str,
+        text: str,
+        image_urls: list[str],
+        deployment_name: str,
+    ) -> AsyncIterator[str]:
+        """
+        completions_category_content のストリーミング版。生成されたテキストの断片を届いた順に返す
+        応答の開始までをレート制限スケジューラで再試行し、使用トークン数は最後のチャンクのusageで集計する
+        """
+        messages: list = []
+        messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": build_user_content(text, image_urls)})
+
+        # 送信前にトークン数を数え、上限を超える場合はネットワークに出さずにエラーにする
+        prompt_tokens = count_message_tokens(messages)
+        check_prompt_budget("extraction", prompt_tokens)
+        estimated_tokens = prompt_tokens + DEFAULT_ESTIMATED_COMPLETION_TOKENS
+        scheduler = get_rate_limit_scheduler(deployment_name)
+
+        try:
+            with span("openai", stage="extraction", deployment=deployment_name, stream=True):
+                stream = await scheduler.run_async(
+                    lambda: self.client.chat.completions.create(
+                        model=deployment_name,
+                        messages=messages,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                    ),
+                    estimated_tokens=estimated_tokens,
+                    priority=PRIORITY_EXTRACTION,
+                )
+            usage = None
+            async for chunk in stream:
+                usage = response_usage(chunk) or usage
+                content = _chunk_content(chunk)
+                if content:
+                    yield content
+            scheduler.record_usage(estimated_tokens, usage)
+            record_token_usage("extraction", deployment_name,
+                               prompt_tokens, usage)
+        except openai.RateLimitError as e:
+            logging.error(f"Rate limit error: {e}")
+            raise
+        except Exception as e:
+            logging.error(f"Error during OpenAI API call: {e}")
+            raise
@@ -0,0 +1,158 @@
+"""
+プロセス全体で共有するAzureクライアントのレジストリ
+
+エンドポイント・認証情報ごとに1つのクライアントを生成し、ウォームなインスタンス上の全呼び出しで再利用する。
+各クライアントはKeep-Aliveを有効にしたHTTPコネクションプールを持つため、呼び出しごとのTLSハンドシェイクや
+クライアント生成のコストがかからない。
+非同期クライアントはイベントループに紐づくため、イベントループごとに保持する。
+
+コネクションプールは環境変数で調整する:
+- HTTP_POOL_MAX_CONNECTIONS: 1クライアントあたりの最大同時接続数（既定: 100。同期版のDocument Intelligenceクライアント（requests）には上限はない）
+- HTTP_POOL_MAX_KEEPALIVE: Keep-Aliveで保持する接続数（既定: 20。requestsではホストごとのプールのサイズ）
+- HTTP_POOL_KEEPALIVE_EXPIRY: アイドル接続を保持する秒数（既定: 60）
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import weakref
+import aiohttp
+import httpx
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import AioHttpTransport, RequestsTransport
+from azure.ai.documentintelligence import DocumentIntelligenceClient
+from azure.ai.documentintelligence.aio import DocumentIntelligenceClient as AsyncDocumentIntelligenceClient
+
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+HTTP_POOL_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "60"))
+# requestsのセッションが保持するホストごとのプールの数
+# Document Intelligenceクライアントはエンドポイントごとに生成し、解析・ポーリングとも同じホストに接続する
+DOCUMENT_INTELLIGENCE_POOL_HOSTS = 1
+
+_clients: dict = {}
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _client_key(kind: str, endpoint: str, api_key: str, *extra: str) -> tuple:
+    # APIキーそのものはキーに保持せず、ハッシュ値で区別する
+    key_hash = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    return (kind, endpoint, key_hash) + extra
+
+
+def _get_or_create(registry: dict, key: tuple, factory):
+    client = registry.get(key)
+    if client is None:
+        with _lock:
+            client = registry.get(key)
+            if client is None:
+                client = factory()
+                registry[key] = client
+    return client
+
+
+def _async_registry() -> dict:
+    loop = asyncio.get_running_loop()
+    with _lock:
+        registry = _async_clients.get(loop)
+        if registry is None:
+            registry = {}
+            _async_clients[loop] = registry
+    return registry
+
+
+def get_openai_client(endpoint: str, api_key: str, api_version: str) -> openai.AzureOpenAI:
+    """エンドポイント・APIキー・APIバージョンごとに共有されるAzureOpenAIクライアントを返す"""
+    def factory() -> openai.AzureOpenAI:
+        http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY,
+            ),
+        )
+        return openai.AzureOpenAI(
+            azure_endpoint=endpoint,
+            api_key=api_key,
+            api_version=api_version,
+            http_client=http_client,
+            # 再試行はレート制限スケジューラ（rate_limiter）が行う
+            max_retries=0,
+        )
+
+    return _get_or_create(_clients, _client_key("openai", endpoint, api_key, api_version), factory)
+
+
+def get_async_openai_client(endpoint: str, api_key: str, api_version: str) -> openai.AsyncAzureOpenAI:
+    """実行中のイベントループで共有されるAsyncAzureOpenAIクライアントを返す"""
+    def factory() -> openai.AsyncAzureOpenAI:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY,
+            ),
+        )
+        return openai.AsyncAzureOpenAI(
+            azure_endpoint=endpoint,
+            api_key=api_key,
+            api_version=api_version,
+            http_client=http_client,
+            # 再試行はレート制限スケジューラ（rate_limiter）が行う
+            max_retries=0,
+        )
+
+    return _get_or_create(_async_registry(), _client_key("openai", endpoint, api_key, api_version), factory)
+
+
+def get_document_intelligence_client(endpoint: str, api_key: str) -> DocumentIntelligenceClient:
+    """エンドポイント・APIキーごとに共有されるDocumentIntelligenceClientを返す"""
+    def factory() -> DocumentIntelligenceClient:
+        session = requests.Session()
+        # pool_connections はホストごとのプールの数、pool_maxsize は1つのプールで再利用のために保持する接続数
+        adapter = HTTPAdapter(
+            pool_connections=DOCUMENT_INTELLIGENCE_POOL_HOSTS,
+            pool_maxsize=HTTP_POOL_MAX_KEEPALIVE,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return DocumentIntelligenceClient(
+            endpoint=endpoint,
+            credential=AzureKeyCredential(api_key),
+            transport=RequestsTransport(session=session, session_owner=False),
+        )
+
+    return _get_or_create(_clients, _client_key("document_intelligence", endpoint, api_key), factory)
+
+
+def get_async_document_intelligence_client(endpoint: str, api_key: str) -> AsyncDocumentIntelligenceClient:
+    """実行中のイベントループで共有される非同期版DocumentIntelligenceClientを返す"""
+    def factory() -> AsyncDocumentIntelligenceClient:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=HTTP_POOL_MAX_CONNECTIONS,
+                keepalive_timeout=HTTP_POOL_KEEPALIVE_EXPIRY,
+            ),
+        )
+        return AsyncDocumentIntelligenceClient(
+            endpoint=endpoint,
+            credential=AzureKeyCredential(api_key),
+            transport=AioHttpTransport(session=session, session_owner=False),
+        )
+
+    return _get_or_create(_async_registry(), _client_key("document_intelligence", endpoint, api_key), factory)
+
+
+def clear_clients() -> None:
+    """
+    同期クライアントのレジストリを破棄する（主にテスト用）
+    非同期クライアントはイベントループの終了とともに破棄される
+    """
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
@@ -1,84 +1,288 @@
 import os
-from azure.core.credentials import AzureKeyCredential
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 from azure.ai.documentintelligence import DocumentIntelligenceClient
-from azure.ai.documentintelligence.models import AnalyzeResult, DocumentAnalysisFeature, DocumentContentFormat, AnalyzeOutputOption
+from azure.ai.documentintelligence.aio import DocumentIntelligenceClient as AsyncDocumentIntelligenceClient
+from azure.ai.documentintelligence.models import AnalyzeResult, DocumentAnalysisFeature, DocumentContentFormat, AnalyzeOutputOption, StringIndexType
+from services.azure.client_registry import get_document_intelligence_client, get_async_document_intelligence_client
+from services.cache.analysis_cache import build_analysis_cache_key
+from services.cache.cache_backend import CacheBackend
+from services.telemetry.tracing import span
+from utils.analyze_result_merge import STRING_INDEX_TYPE, merge_analyze_results
 from utils.document_utils import get_words
+from utils.page_assembly import assemble_pages
+from utils.pdf_utils import build_page_ranges, count_pdf_pages
 
 
-class AzureAIDocumentIntelligenceService:
-    def __init__(self, endpoint: str, api_key: str) -> None:
-        self.client = DocumentIntelligenceClient(
-            endpoint=endpoint, credential=AzureKeyCredential(api_key)
+def _default_polling_interval() -> Optional[float]:
+    """環境変数 DI_POLLING_INTERVAL（秒）からポーリング間隔を取得する。未設定の場合はSDKの既定値"""
+    polling_interval = os.getenv("DI_POLLING_INTERVAL")
+    return float(polling_interval) if polling_interval else None
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+class BaseDocumentIntelligenceService:
+    """
+    同期版・非同期版のDocument Intelligenceサービスで共通の処理
+    - 解析オプション
+    - 解析結果キャッシュのキー生成
+    - ページ範囲への分割（シャーディング）
+    - 解析結果からレスポンスデータへの変換
+    """
+    MODEL_ID = "prebuilt-layout"
+    OUTPUT_CONTENT_FORMAT = DocumentContentFormat.MARKDOWN
+    OUTPUT = [AnalyzeOutputOption.FIGURES]
+    FEATURES: list = []
+    STRING_INDEX_TYPE = StringIndexType(STRING_INDEX_TYPE)
+
+    def __init__(
+        self,
+        cache: Optional[CacheBackend] = None,
+        polling_interval: Optional[float] = None,
+        shard_size: Optional[int] = None,
+        max_parallel_shards: Optional[int] = None,
+    ) -> None:
+        """
+        :param cache: 解析結果のキャッシュ。Noneの場合はキャッシュしない
+        :param polling_interval: 解析完了のポーリング間隔（秒）。既定は環境変数 DI_POLLING_INTERVAL
+        :param shard_size: 1シャードあたりのページ数。0の場合は分割しない。既定は環境変数 DI_SHARD_SIZE
+        :param max_parallel_shards: 同時に解析するシャード数。既定は環境変数 DI_MAX_PARALLEL_SHARDS（4）
+        """
+        self.cache = cache
+        self.polling_interval = polling_interval if polling_interval is not None else _default_polling_interval()
+        self.shard_size = shard_size if shard_size is not None else _env_int(
+            "DI_SHARD_SIZE", 0)
+        self.max_parallel_shards = max_parallel_shards if max_parallel_shards is not None else _env_int(
+            "DI_MAX_PARALLEL_SHARDS", 4)
+
+    def _analyze_kwargs(self, pdf_binary: bytes, pages: Optional[str] = None) -> dict:
+        kwargs = {
+            "body": pdf_binary,
+            "features": self.FEATURES,
+            "output_content_format": self.OUTPUT_CONTENT_FORMAT,
+            "output": self.OUTPUT,
+            # シャード・改訂版の結合でoffsetの単位が混ざらないよう、ページ指定の有無にかかわらず同じ単位にする
+            "string_index_type": self.STRING_INDEX_TYPE,
+        }
+        if pages is not None:
+            kwargs["pages"] = pages
+        if self.polling_interval is not None:
+            kwargs["polling_interval"] = self.polling_interval
+        return kwargs
+
+    def _page_ranges(self, pdf_binary: bytes) -> Optional[List[str]]:
+        """シャーディングする場合はページ範囲のリストを、しない場合はNoneを返す"""
+        if not self.shard_size:
+            return None
+        page_count = count_pdf_pages(pdf_binary)
+        if page_count <= self.shard_size:
+            return None
+        return build_page_ranges(page_count, self.shard_size)
+
+    @staticmethod
+    def _merge_shards(shards: List[Tuple[dict, dict]]) -> Tuple[AnalyzeResult, List[dict]]:
+        shard_timings = [timing for _, timing in shards]
+        for timing in shard_timings:
+            logging.info(
+                f"Document Intelligence shard analyzed: pages={timing['pages']} seconds={timing['seconds']}")
+        with span("di_merge_shards", shards=len(shards)):
+            merged = merge_analyze_results([result for result, _ in shards])
+        return AnalyzeResult(merged), shard_timings
+
+    def _cache_key(self, pdf_binary: bytes, pages: Optional[str] = None) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return build_analysis_cache_key(
+            pdf_binary,
+            model_id=self.MODEL_ID,
+            output_content_format=self.OUTPUT_CONTENT_FORMAT,
+            output=self.OUTPUT,
+            features=self.FEATURES,
+            pages=pages,
+            string_index_type=self.STRING_INDEX_TYPE,
         )
 
-    def analyze_document(self, pdf_binary: bytes) -> dict:
+    def _cache_lookup(self, cache_key: Optional[str], use_cache: bool) -> Optional[AnalyzeResult]:
+        if cache_key is None:
+            return None
+        if use_cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logging.info(
+                    f"Document Intelligence cache hit: {cache_key} {self.cache.stats()}")
+                return AnalyzeResult(cached)
+        logging.info(
+            f"Document Intelligence cache miss: {cache_key} {self.cache.stats()}")
+        return None
+
+    def _cache_store(self, cache_key: Optional[str], result: AnalyzeResult) -> None:
+        if cache_key is not None:
+            self.cache.set(cache_key, result.as_dict())
+
+    def _build_response_data(self, result: AnalyzeResult) -> dict:
+        with span("page_assembly"):
+            response_data = {
+                # "content_markdown": result.content.replace("\r\n", "\\n").replace("\n", "\\n").replace('"', '\\"'),
+                "content_markdown": result.content,
+                "pages": assemble_pages(result),
+            }
+        return response_data
+
+
+class AzureAIDocumentIntelligenceService(BaseDocumentIntelligenceService):
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: str,
+        cache: Optional[CacheBackend] = None,
+        polling_interval: Optional[float] = None,
+        shard_size: Optional[int] = None,
+        max_parallel_shards: Optional[int] = None,
+        client: Optional[DocumentIntelligenceClient] = None,
+    ) -> None:
+        super().__init__(cache=cache, polling_interval=polling_interval,
+                         shard_size=shard_size, max_parallel_shards=max_parallel_shards)
+        # プロセス内で共有されるクライアントを使用する
+        self.client = client or get_document_intelligence_client(
+            endpoint=endpoint, api_key=api_key)
+
+    def analyze_document(self, pdf_binary: bytes, use_cache: bool = True, pages: Optional[str] = None) -> dict:
+        """
+        PDFを解析し、Markdownとページごとの情報を返す
+        シャーディングした場合は、シャードごとの所要時間を shard_timings に含める
+        :param pdf_binary: デコード済みのPDFバイナリ
+        :param use_cache: Falseの場合はキャッシュを参照せずに解析する（結果でキャッシュは更新する）
+        :param pages: 解析するページの指定（例: "3,7-8"）。指定した場合はそのページだけを分割せずに解析する
+        """
+        result, shard_timings = self._analyze(pdf_binary, use_cache=use_cache, pages=pages)
+        response_data = self._build_response_data(result)
+        if shard_timings:
+            response_data["shard_timings"] = shard_timings
+        return response_data
+
+    def _analyze(self, pdf_binary: bytes, use_cache: bool = True, pages: Optional[str] = None) -> Tuple[AnalyzeResult, List[dict]]:
+        with span("di_cache_lookup"):
+            cache_key = self._cache_key(pdf_binary, pages)
+            cached = self._cache_lookup(cache_key, use_cache)
+        if cached is not None:
+            return cached, []
+
+        page_ranges = self._page_ranges(pdf_binary) if pages is None else None
         try:
-            # PDFバイナリを直接渡して分析
-            poller = self.client.begin_analyze_document(
-                "prebuilt-layout",
-                body=pdf_binary,
-                features=[],
-                output_content_format=DocumentContentFormat.MARKDOWN,
-                output=[AnalyzeOutputOption.FIGURES],
-            )
-            result: AnalyzeResult = poller.result()
+            if page_ranges:
+                # ページ範囲ごとに並列で解析し、1つの結果に結合する
+                with ThreadPoolExecutor(max_workers=self.max_parallel_shards) as executor:
+                    # トレースをワーカースレッドに引き継ぐため、コンテキストをコピーして実行する
+                    futures = [
+                        executor.submit(contextvars.copy_context().run,
+                                        self._analyze_shard, pdf_binary, pages)
+                        for pages in page_ranges
+                    ]
+                    shards = [future.result() for future in futures]
+                result, shard_timings = self._merge_shards(shards)
+            else:
+                # PDFバイナリを直接渡して分析
+                with span("di_analyze"):
+                    poller = self.client.begin_analyze_document(
+                        self.MODEL_ID, **self._analyze_kwargs(pdf_binary, pages=pages))
+                    result: AnalyzeResult = poller.result()
+                shard_timings = []
         except Exception as e:
             raise ValueError(f"Failed to analyze document: {e}")
 
-        response_data = {
-            # "content_markdown": result.content.replace("\r\n", "\\n").replace("\n", "\\n").replace('"', '\\"'),
-            "content_markdown": result.content,
-            "pages": [],
-        }
-        for page in result.pages:
-            page_data = {
-                "page_number": page.page_number,
-                "width": page.width,
-                "height": page.height,
-                "lines": [],
-                "tables": [],
-                "figures": [],
-            }
+        with span("di_cache_store"):
+            self._cache_store(cache_key, result)
+        return result, shard_timings
+
+    def _analyze_shard(self, pdf_binary: bytes, pages: str) -> Tuple[dict, dict]:
+        started = time.perf_counter()
+        with span("di_analyze", pages=pages):
+            poller = self.client.begin_analyze_document(
+                self.MODEL_ID, **self._analyze_kwargs(pdf_binary, pages=pages))
+            result: AnalyzeResult = poller.result()
+        return result.as_dict(), {"pages": pages, "seconds": round(time.perf_counter() - started, 3)}
+
+
+class AsyncAzureAIDocumentIntelligenceService(BaseDocumentIntelligenceService):
+    """
+    非同期クライアントを使用するDocument Intelligenceサービス
+    ポーリング中もイベントループをブロックしないため、1ワーカーで複数ドキュメントを並行して解析できる
+    """
 
-            if page.lines:
-                for line in page.lines:
-                    page_data["lines"].append({
-                        "content": line.content,
-                        "polygon": getattr(line, "polygon", []),
-                        "spans": getattr(line, "spans", []),
-                    })
-
-            # ページ内のテーブルデータを追加
-            for table in result.tables:
-                for region in table.bounding_regions:
-                    if region.page_number == page.page_number:
-                        table_data = {
-                            "row_count": table.row_count,
-                            "column_count": table.column_count,
-                            "cells": [
-                                {
-                                    "row_index": cell.row_index,
-                                    "column_index": cell.column_index,
-                                    "content": cell.content,
-                                    "bounding_regions": cell.bounding_regions,
-                                }
-                                for cell in table.cells
-                            ],
-                        }
-                        page_data["tables"].append(table_data)
-
-            # ページ内の図データを追加
-            for figure in result.figures:
-                for region in figure.bounding_regions:
-                    if region.page_number == page.page_number:
-                        figure_data = {
-                            "id": figure.id,
-                            "bounding_regions": figure.bounding_regions,
-                            "spans": figure.spans,
-                            "elements": figure.elements,
-                        }
-                        page_data["figures"].append(figure_data)
-
-            response_data["pages"].append(page_data)
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: str,
+        cache: Optional[CacheBackend] = None,
+        polling_interval: Optional[float] = None,
+        shard_size: Optional[int] = None,
+        max_parallel_shards: Optional[int] = None,
+        client: Optional[AsyncDocumentIntelligenceClient] = None,
+    ) -> None:
+        super().__init__(cache=cache, polling_interval=polling_interval,
+                         shard_size=shard_size, max_parallel_shards=max_parallel_shards)
+        self.client = client or get_async_document_intelligence_client(
+            endpoint=endpoint, api_key=api_key)
 
+    async def analyze_document(self, pdf_binary: bytes, use_cache: bool = True, pages: Optional[str] = None) -> dict:
+        """
+        PDFを解析し、Markdownとページごとの情報を返す（非同期版）
+        シャーディングした場合は、シャードごとの所要時間を shard_timings に含める
+        :param pdf_binary: デコード済みのPDFバイナリ
+        :param use_cache: Falseの場合はキャッシュを参照せずに解析する（結果でキャッシュは更新する）
+        :param pages: 解析するページの指定（例: "3,7-8"）。指定した場合はそのページだけを分割せずに解析する
+        """
+        result, shard_timings = await self._analyze(pdf_binary, use_cache=use_cache, pages=pages)
+        response_data = self._build_response_data(result)
+        if shard_timings:
+            response_data["shard_timings"] = shard_timings
         return response_data
+
+    async def _analyze(self, pdf_binary: bytes, use_cache: bool = True, pages: Optional[str] = None) -> Tuple[AnalyzeResult, List[dict]]:
+        with span("di_cache_lookup"):
+            cache_key = self._cache_key(pdf_binary, pages)
+            # ディスクキャッシュの読み書きでイベントループを止めないようにスレッドで実行
+            cached = await asyncio.to_thread(self._cache_lookup, cache_key, use_cache)
+        if cached is not None:
+            return cached, []
+
+        page_ranges = self._page_ranges(pdf_binary) if pages is None else None
+        try:
+            if page_ranges:
+                # ページ範囲ごとに並列で解析し、1つの結果に結合する
+                semaphore = asyncio.Semaphore(self.max_parallel_shards)
+
+                async def analyze_shard(pages: str) -> Tuple[dict, dict]:
+                    async with semaphore:
+                        return await self._analyze_shard(pdf_binary, pages)
+
+                shards = await asyncio.gather(*(analyze_shard(pages) for pages in page_ranges))
+                result, shard_timings = self._merge_shards(list(shards))
+            else:
+                with span("di_analyze"):
+                    poller = await self.client.begin_analyze_document(
+                        self.MODEL_ID, **self._analyze_kwargs(pdf_binary, pages=pages))
+                    result: AnalyzeResult = await poller.result()
+                shard_timings = []
+        except Exception as e:
+            raise ValueError(f"Failed to analyze document: {e}")
+
+        with span("di_cache_store"):
+            await asyncio.to_thread(self._cache_store, cache_key, result)
+        return result, shard_timings
+
+    async def _analyze_shard(self, pdf_binary: bytes, pages: str) -> Tuple[dict, dict]:
+        started = time.perf_counter()
+        with span("di_analyze", pages=pages):
+            poller = await self.client.begin_analyze_document(
+                self.MODEL_ID, **self._analyze_kwargs(pdf_binary, pages=pages))
+            result: AnalyzeResult = await poller.result()
+        return result.as_dict(), {"pages": pages, "seconds": round(time.perf_counter() - started, 3)}
@@ -0,0 +1,401 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+import openai
+
+# 優先度（値が小さいほど優先）
+# 同じスケジューラ（デプロイメント、またはクォータグループ）で待機しているリクエストの間でだけ比べる
+PRIORITY_CLASSIFICATION = 0
+PRIORITY_EXTRACTION = 1
+
+# 再試行するエラー（SDK側の再試行は無効にし、ここで一元的に再試行する）
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+# 応答トークン数の見積もり（max_tokensを指定しない呼び出し向け）
+DEFAULT_ESTIMATED_COMPLETION_TOKENS = 1024
+
+
+class TokenBucket:
+    """
+    1分あたりの上限を表すトークンバケット
+    capacity が None の場合は無制限として扱う
+    """
+
+    def __init__(self, capacity_per_minute: Optional[float]) -> None:
+        self.capacity = capacity_per_minute
+        self.tokens = capacity_per_minute or 0.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.capacity is None:
+            return
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self.updated_at) * self.capacity / 60.0)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """amount を消費できるまでの待ち時間（秒）を返す"""
+        if self.capacity is None:
+            return 0.0
+        self._refill(now)
+        # 上限を超える要求は、バケットが満タンになれば通す
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.capacity
+
+    def consume(self, amount: float, now: float) -> None:
+        if self.capacity is None:
+            return
+        self._refill(now)
+        self.tokens -= amount
+
+    def adjust(self, delta: float) -> None:
+        """見積もりと実際の使用量の差を反映する（正: 追加消費、負: 返却）"""
+        if self.capacity is None:
+            return
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class RateLimitScheduler:
+    """
+    Azure OpenAIのデプロイメント（またはクォータを共有するデプロイメントのグループ）単位のレート制限スケジューラ
+    - TPM/RPMのトークンバケットで、送信前に見積もりトークン数分の枠を確保する
+    - 待機中のリクエストは優先度順（同じ優先度は到着順）に送信する
+    - RateLimitError は retry-after を尊重しつつ、ジッター付き指数バックオフで再試行する
+    """
+
+    def __init__(
+        self,
+        name: str,
+        tpm: Optional[int] = None,
+        rpm: Optional[int] = None,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ) -> None:
+        self.name = name
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._tokens = TokenBucket(tpm)
+        self._requests = TokenBucket(rpm)
+        self._blocked_until = 0.0
+        self._waiters: list = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        # acquire_async で待機中のリクエスト（イベントループ, asyncio.Event）
+        self._async_waiters: set = set()
+        self._metrics = {
+            "requests": 0,
+            "retries": 0,
+            "rate_limit_errors": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cached_tokens": 0,
+        }
+
+    def _notify_all(self) -> None:
+        """
+        待機中のリクエストを起こす（スレッドは Condition、コルーチンは asyncio.Event）
+        呼び出し側で self._condition を取得していること
+        """
+        self._condition.notify_all()
+        for loop, event in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # イベントループが終了している
+                pass
+
+    def _poll(self, ticket: tuple, estimated_tokens: int) -> Optional[float]:
+        """
+        ticket の順番が来ていて枠があれば消費して0を返し、そうでなければ待ち時間を返す
+        順番が来ていない場合は None（先頭のリクエストが枠を確保するか中断したときに _notify_all で起こされる）
+        呼び出し側で self._condition を取得していること
+        """
+        now = time.monotonic()
+        if self._waiters[0] != ticket:
+            return None
+        wait = max(
+            self._blocked_until - now,
+            self._tokens.wait_time(estimated_tokens, now),
+            self._requests.wait_time(1, now),
+        )
+        if wait > 0:
+            return wait
+        heapq.heappop(self._waiters)
+        self._tokens.consume(estimated_tokens, now)
+        self._requests.consume(1, now)
+        self._notify_all()
+        return 0.0
+
+    def _enqueue(self, priority: int) -> tuple:
+        ticket = (priority, next(self._sequence))
+        heapq.heappush(self._waiters, ticket)
+        return ticket
+
+    def _cancel(self, ticket: tuple) -> None:
+        """枠を確保する前に中断したリクエストをキューから取り除く"""
+        with self._condition:
+            if ticket in self._waiters:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._notify_all()
+
+    def _record_wait(self, waited: float) -> None:
+        self._metrics["requests"] += 1
+        self._metrics["total_wait_seconds"] += waited
+        self._metrics["max_wait_seconds"] = max(
+            self._metrics["max_wait_seconds"], waited)
+
+    def acquire(self, estimated_tokens: int, priority: int = PRIORITY_EXTRACTION) -> float:
+        """送信枠を確保するまでブロックし、待機時間（秒）を返す"""
+        started = time.monotonic()
+        with self._condition:
+            ticket = self._enqueue(priority)
+            try:
+                while True:
+                    wait = self._poll(ticket, estimated_tokens)
+                    if wait == 0:
+                        break
+                    self._condition.wait(timeout=wait)
+            except BaseException:
+                self._cancel(ticket)
+                raise
+            waited = time.monotonic() - started
+            self._record_wait(waited)
+        return waited
+
+    async def acquire_async(self, estimated_tokens: int, priority: int = PRIORITY_EXTRACTION) -> float:
+        """
+        acquire の非同期版。イベントループをブロックせずに待機する
+        順番・枠の状態が変わったときは _notify_all で asyncio.Event が設定されるため、ポーリングはしない
+        """
+        started = time.monotonic()
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._condition:
+            ticket = self._enqueue(priority)
+            self._async_waiters.add(waiter)
+        try:
+            while True:
+                with self._condition:
+                    wait = self._poll(ticket, estimated_tokens)
+                    if wait == 0:
+                        waited = time.monotonic() - started
+                        self._record_wait(waited)
+                        return waited
+                    # ロックを持ったままクリアするため、この後の _notify_all による設定は失われない
+                    waiter[1].clear()
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            # キャンセルされた場合に後続のリクエストが詰まらないようにする
+            self._cancel(ticket)
+            raise
+        finally:
+            with self._condition:
+                self._async_waiters.discard(waiter)
+
+    def record_usage(self, estimated_tokens: int, usage: Optional[dict]) -> None:
+        """
+        レスポンスの実際の使用トークン数で見積もりとの差を補正し、使用量を集計する
+        cached_tokens はプロンプトキャッシュにヒットした入力トークン数
+        """
+        if not usage:
+            return
+        logging.info(f"OpenAI usage ({self.name}): {usage}")
+        with self._condition:
+            self._tokens.adjust(usage["total_tokens"] - estimated_tokens)
+            for key in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                self._metrics[key] += usage[key]
+            self._notify_all()
+
+    def _refund(self, estimated_tokens: int) -> None:
+        """
+        再試行可能なエラー（レート制限・タイムアウトなど）で失敗した送信の見積もりトークン数とリクエスト数の枠をバケットに戻す
+        拒否されたリクエストはサーバー側の枠を消費しないため、返却しないと再試行のたびにバケットが実際より早く減る
+        """
+        with self._condition:
+            self._tokens.adjust(-estimated_tokens)
+            self._requests.adjust(-1)
+            self._notify_all()
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """retry-after（ミリ秒・秒）があればそれを、なければジッター付き指数バックオフの待ち時間を返す"""
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        retry_after = None
+        try:
+            if headers.get("retry-after-ms"):
+                retry_after = float(headers["retry-after-ms"]) / 1000.0
+            elif headers.get("retry-after"):
+                retry_after = float(headers["retry-after"])
+        except (TypeError, ValueError):
+            retry_after = None
+        backoff = min(self.max_delay, self.base_delay * (2 ** attempt))
+        jitter = random.uniform(0, backoff / 2)
+        if retry_after is not None:
+            return retry_after + jitter / 4
+        return backoff / 2 + jitter
+
+    def _on_retryable_error(self, error: Exception, attempt: int) -> float:
+        """
+        再試行可能なエラーを記録し、呼び出し側が追加で待機する秒数を返す
+        RateLimitErrorの場合はデプロイメント全体を一時停止するため、待機は acquire に任せる
+        """
+        delay = self._retry_delay(error, attempt)
+        rate_limited = isinstance(error, openai.RateLimitError)
+        with self._condition:
+            self._metrics["retries"] += 1
+            if rate_limited:
+                self._metrics["rate_limit_errors"] += 1
+                # 同じデプロイメントへの他のリクエストも待機させる
+                self._blocked_until = max(
+                    self._blocked_until, time.monotonic() + delay)
+                self._notify_all()
+        logging.warning(
+            f"{type(error).__name__} on {self.name}; retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+        return 0.0 if rate_limited else delay
+
+    def run(self, call: Callable[[], Any], estimated_tokens: int, priority: int = PRIORITY_EXTRACTION) -> Any:
+        """送信枠を確保してから call を実行し、レート制限や一時的なエラーの場合は再試行する"""
+        for attempt in range(self.max_retries + 1):
+            self.acquire(estimated_tokens, priority)
+            try:
+                response = call()
+            except RETRYABLE_ERRORS as e:
+                self._refund(estimated_tokens)
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._on_retryable_error(e, attempt))
+                continue
+            self.record_usage(estimated_tokens, response_usage(response))
+            return response
+
+    async def run_async(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        estimated_tokens: int,
+        priority: int = PRIORITY_EXTRACTION,
+    ) -> Any:
+        """run の非同期版"""
+        for attempt in range(self.max_retries + 1):
+            await self.acquire_async(estimated_tokens, priority)
+            try:
+                response = await call()
+            except RETRYABLE_ERRORS as e:
+                self._refund(estimated_tokens)
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self._on_retryable_error(e, attempt))
+                continue
+            self.record_usage(estimated_tokens, response_usage(response))
+            return response
+
+    def metrics(self) -> dict:
+        """キューの深さ・待機時間・再試行回数などのメトリクスを返す"""
+        with self._condition:
+            metrics = dict(self._metrics)
+            metrics["queue_depth"] = len(self._waiters)
+            metrics["average_wait_seconds"] = (
+                metrics["total_wait_seconds"] / metrics["requests"] if metrics["requests"] else 0.0)
+            return metrics
+
+
+def response_usage(response) -> Optional[dict]:
+    """
+    チャット応答のusageから、プロンプト・応答・キャッシュヒットのトークン数を取り出す
+    usageが含まれない場合はNoneを返す
+    """
+    usage = getattr(response, "usage", None)
+
+    def as_int(value) -> int:
+        return value if isinstance(value, int) else 0
+
+    total_tokens = getattr(usage, "total_tokens", None)
+    if not isinstance(total_tokens, int):
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": as_int(getattr(usage, "prompt_tokens", 0)),
+        "completion_tokens": as_int(getattr(usage, "completion_tokens", 0)),
+        "total_tokens": total_tokens,
+        "cached_tokens": as_int(getattr(details, "cached_tokens", 0)),
+    }
+
+
+_schedulers: dict = {}
+_schedulers_lock = threading.Lock()
+
+
+def _load_rate_limits() -> dict:
+    """
+    環境変数 AOAI_RATE_LIMITS からデプロイメントごとの上限を読み込む
+    例: {"gpt-4o": {"tpm": 30000, "rpm": 180}, "gpt-4o-mini": {"tpm": 200000, "rpm": 1200}}
+    """
+    rate_limits = os.getenv("AOAI_RATE_LIMITS")
+    return json.loads(rate_limits) if rate_limits else {}
+
+
+def _load_quota_groups() -> dict:
+    """
+    環境変数 AOAI_QUOTA_GROUPS から、クォータ（TPM/RPM）を共有するデプロイメントのグループを読み込む
+    例: {"shared": {"deployments": ["gpt-4o", "gpt-4o-mini"], "tpm": 230000, "rpm": 1380}}
+    同じグループのデプロイメントは1つのスケジューラを共有するため、分類（PRIORITY_CLASSIFICATION）が
+    抽出（PRIORITY_EXTRACTION）より先に送信される
+    :return: デプロイメント名 → (グループ名, 上限)
+    """
+    quota_groups = os.getenv("AOAI_QUOTA_GROUPS")
+    groups = json.loads(quota_groups) if quota_groups else {}
+    return {
+        deployment_name: (group_name, limits)
+        for group_name, limits in groups.items()
+        for deployment_name in limits.get("deployments", [])
+    }
+
+
+def get_rate_limit_scheduler(deployment_name: str) -> RateLimitScheduler:
+    """
+    デプロイメントごとにプロセス全体で共有されるスケジューラを返す
+    AOAI_QUOTA_GROUPS でグループに含めたデプロイメントは、グループのスケジューラを返す
+    """
+    scheduler = _schedulers.get(deployment_name)
+    if scheduler is None:
+        with _schedulers_lock:
+            scheduler = _schedulers.get(deployment_name)
+            if scheduler is None:
+                name, limits = _load_quota_groups().get(
+                    deployment_name, (deployment_name, _load_rate_limits().get(deployment_name, {})))
+                scheduler = _schedulers.get(name)
+                if scheduler is None:
+                    scheduler = RateLimitScheduler(
+                        name=name,
+                        tpm=limits.get("tpm"),
+                        rpm=limits.get("rpm"),
+                        max_retries=int(os.getenv("AOAI_MAX_RETRIES", "5")),
+                    )
+                    _schedulers[name] = scheduler
+                _schedulers[deployment_name] = scheduler
+    return scheduler
+
+
+def get_rate_limit_metrics() -> dict:
+    """全デプロイメント（グループ）のスケジューラのメトリクスを返す"""
+    with _schedulers_lock:
+        schedulers = {scheduler.name: scheduler for scheduler in _schedulers.values()}
+    return {name: scheduler.metrics() for name, scheduler in schedulers.items()}
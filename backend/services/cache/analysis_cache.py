@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+import threading
+import tempfile
+from typing import List, Optional
+from services.cache.cache_backend import CacheBackend, create_cache_backend
+
+_analysis_cache: Optional[CacheBackend] = None
+_analysis_cache_initialized = False
+_analysis_cache_lock = threading.Lock()
+
+
+def build_analysis_cache_key(
+    pdf_binary: bytes,
+    model_id: str,
+    output_content_format: str,
+    output: List[str],
+    features: List[str],
+    pages: Optional[str] = None,
+    string_index_type: Optional[str] = None,
+) -> str:
+    """
+    Document Intelligenceの解析結果キャッシュのキーを生成する
+    デコード済みPDFバイトのハッシュと、モデルID・出力オプションを組み合わせる
+    pages（解析するページの指定）・string_index_type（spansのoffsetの単位）は指定した場合だけキーに含める
+    """
+    options = json.dumps(
+        {
+            "model_id": model_id,
+            "output_content_format": str(output_content_format),
+            "output": sorted(str(o) for o in output),
+            "features": sorted(str(f) for f in features),
+            **({"pages": pages} if pages is not None else {}),
+            **({"string_index_type": str(string_index_type)} if string_index_type is not None else {}),
+        },
+        sort_keys=True,
+    )
+    pdf_hash = hashlib.sha256(pdf_binary).hexdigest()
+    options_hash = hashlib.sha256(options.encode("utf-8")).hexdigest()[:16]
+    return f"di:{pdf_hash}:{options_hash}"
+
+
+def get_analysis_cache() -> Optional[CacheBackend]:
+    """
+    プロセス全体で共有する解析結果キャッシュを返す
+    環境変数で設定する:
+    - DI_CACHE_BACKEND: "memory"（既定） / "disk" / "none"
+    - DI_CACHE_DIR: diskバックエンドの保存先（既定: 一時ディレクトリ配下）
+    - DI_CACHE_MAX_ENTRIES: 最大エントリ数（既定: 16）
+    - DI_CACHE_TTL_SECONDS: 有効期間（秒、既定: 86400）
+    - DI_CACHE_MAX_BYTES: 合計サイズの上限（バイト、既定: 268435456 = 256MB。空の場合は無制限）
+    """
+    global _analysis_cache, _analysis_cache_initialized
+    if _analysis_cache_initialized:
+        return _analysis_cache
+    with _analysis_cache_lock:
+        if not _analysis_cache_initialized:
+            max_bytes = os.getenv("DI_CACHE_MAX_BYTES", "268435456")
+            ttl = os.getenv("DI_CACHE_TTL_SECONDS", "86400")
+            _analysis_cache = create_cache_backend(
+                backend=os.getenv("DI_CACHE_BACKEND", "memory"),
+                directory=os.getenv("DI_CACHE_DIR", os.path.join(
+                    tempfile.gettempdir(), "di-analysis-cache")),
+                max_entries=int(os.getenv("DI_CACHE_MAX_ENTRIES", "16")),
+                ttl_seconds=float(ttl) if ttl else None,
+                max_bytes=int(max_bytes) if max_bytes else None,
+            )
+            _analysis_cache_initialized = True
+    return _analysis_cache
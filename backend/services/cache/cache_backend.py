@@ -0,0 +1,336 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+from utils.json_stream import dumps
+
+# DiskCache: 上限を超えた場合に、上限のこの割合まで削除する（削除のためのディレクトリの走査を毎回行わないため）
+DISK_CACHE_EVICTION_RATIO = 0.9
+# DiskCache: 他のプロセスによる書き込みを反映するため、この秒数ごとにディレクトリを走査して件数・合計サイズを数え直す
+DISK_CACHE_RESCAN_SECONDS = float(os.getenv("DISK_CACHE_RESCAN_SECONDS", "60"))
+
+
+class CacheBackend:
+    """
+    キャッシュバックエンドの共通インターフェース
+    値はJSONシリアライズ可能なオブジェクトを前提とする
+    """
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def touch(self, key: str) -> bool:
+        """
+        エントリがあれば参照時刻を更新して True を返す
+        値の読み込みは行わず、ヒット数・ミス数にも数えない（存在の確認だけに使う）
+        """
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def _record(self, hit: bool) -> None:
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> dict:
+        """ヒット数・ミス数・エントリ数を返す"""
+        with self._stats_lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self),
+            }
+
+
+def estimate_value_size(value: Any) -> int:
+    """キャッシュする値のサイズ（JSONにシリアライズした場合のバイト数）を見積もる"""
+    try:
+        return len(dumps(value))
+    except (TypeError, ValueError):
+        return len(str(value).encode("utf-8"))
+
+
+class MemoryLRUCache(CacheBackend):
+    """
+    プロセス内のLRUキャッシュ
+    - max_entries: 保持する最大エントリ数（超えた場合は最も古く参照されたものから削除）
+    - ttl_seconds: エントリの有効期間（秒）。Noneの場合は無期限
+    - max_bytes: 保持するエントリの合計サイズの上限（JSONにシリアライズした場合のバイト数）。Noneの場合は無制限
+      上限を超える場合は最も古く参照されたものから削除する。1件で上限を超える値は保持しない
+    """
+
+    def __init__(self, max_entries: int = 16, ttl_seconds: Optional[float] = None,
+                 max_bytes: Optional[int] = None) -> None:
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        # key -> (保存時刻, 値, サイズ)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        value = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, cached_value, size = entry
+                if self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds:
+                    del self._entries[key]
+                    self._bytes -= size
+                else:
+                    self._entries.move_to_end(key)
+                    value = cached_value
+        self._record(value is not None)
+        return value
+
+    def touch(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            if self.ttl_seconds is not None and time.time() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                self._bytes -= entry[2]
+                return False
+            self._entries.move_to_end(key)
+            return True
+
+    def set(self, key: str, value: Any) -> None:
+        # サイズの見積もり（シリアライズ）はロックの外で行う。上限がない場合は見積もらない
+        size = estimate_value_size(value) if self.max_bytes is not None else 0
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            if self.max_bytes is not None and size > self.max_bytes:
+                logging.warning(f"Cache entry too large to keep ({size} bytes): {key}")
+                return
+            self._entries[key] = (time.time(), value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache(CacheBackend):
+    """
+    ローカルディスク上のキャッシュ（1エントリ = 1 JSONファイル）
+    - directory: キャッシュファイルの保存先
+    - max_entries: 保持する最大エントリ数（超えた場合は最終参照時刻の古いものから削除）
+    - ttl_seconds: エントリの有効期間（秒）。Noneの場合は無期限
+    - max_bytes: キャッシュファイルの合計サイズの上限（バイト）。Noneの場合は無制限
+      上限を超える場合は最終参照時刻の古いものから削除する
+    件数・合計サイズはプロセス内で数え、上限を超えたとき（上限の DISK_CACHE_EVICTION_RATIO まで削除する）と
+    DISK_CACHE_RESCAN_SECONDS ごとにだけディレクトリを走査する
+    """
+
+    def __init__(self, directory: str, max_entries: int = 256, ttl_seconds: Optional[float] = None,
+                 max_bytes: Optional[int] = None) -> None:
+        super().__init__()
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._count = 0
+        self._bytes = 0
+        self._scanned_at = 0.0
+        self._scan()
+
+    def _path(self, key: str) -> str:
+        # キーにファイル名として使えない文字が含まれていても良いようにハッシュ化する
+        file_name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{file_name}.json")
+
+    def _entry_paths(self) -> list:
+        return [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".json")
+        ]
+
+    def _scan(self) -> list:
+        """キャッシュファイルの (最終参照時刻, サイズ, パス) を返し、件数・合計サイズを数え直す"""
+        entries = []
+        for path in self._entry_paths():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        self._count = len(entries)
+        self._bytes = sum(size for _, size, _ in entries)
+        self._scanned_at = time.monotonic()
+        return entries
+
+    def _over_limit(self, count: int, total_bytes: int, ratio: float = 1.0) -> bool:
+        return count > max(1, int(self.max_entries * ratio)) or \
+            (self.max_bytes is not None and total_bytes > self.max_bytes * ratio)
+
+    def _remove(self, path: str) -> None:
+        """キャッシュファイルを削除し、件数・合計サイズから除く"""
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self._count -= 1
+        self._bytes -= size
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        value = None
+        with self._lock:
+            try:
+                if self.ttl_seconds is not None and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                    self._remove(path)
+                else:
+                    with open(path, "r", encoding="utf-8") as f:
+                        value = json.load(f)
+                    # 最終参照時刻を更新（LRU順の判定に使用）
+                    os.utime(path, None)
+            except FileNotFoundError:
+                value = None
+            except (OSError, ValueError) as e:
+                logging.warning(f"Failed to read cache entry {path}: {e}")
+                value = None
+        self._record(value is not None)
+        return value
+
+    def touch(self, key: str) -> bool:
+        path = self._path(key)
+        with self._lock:
+            try:
+                if self.ttl_seconds is not None and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                    self._remove(path)
+                    return False
+                os.utime(path, None)
+                return True
+            except FileNotFoundError:
+                return False
+
+    def set(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with self._lock:
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(value, f, ensure_ascii=False)
+                size = os.path.getsize(tmp_path)
+                if self.max_bytes is not None and size > self.max_bytes:
+                    # 1件で上限を超える値は保持しない（他のエントリを全て削除させない）
+                    logging.warning(f"Cache entry too large to keep ({size} bytes): {key}")
+                    os.remove(tmp_path)
+                    return
+                try:
+                    previous_size = os.path.getsize(path)
+                except FileNotFoundError:
+                    previous_size = None
+                os.replace(tmp_path, path)
+            except (OSError, TypeError, ValueError) as e:
+                logging.warning(f"Failed to write cache entry {path}: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+            if previous_size is None:
+                self._count += 1
+            else:
+                self._bytes -= previous_size
+            self._bytes += size
+            if self._over_limit(self._count, self._bytes) or \
+                    time.monotonic() - self._scanned_at > DISK_CACHE_RESCAN_SECONDS:
+                self._evict()
+
+    def _evict(self) -> None:
+        """ディレクトリを走査し、上限を超えている場合は最終参照時刻の古いものから上限の一定割合まで削除する"""
+        entries = self._scan()
+        if not self._over_limit(self._count, self._bytes):
+            return
+        entries.sort()
+        for _, _, path in entries:
+            if not self._over_limit(self._count, self._bytes, DISK_CACHE_EVICTION_RATIO):
+                break
+            self._remove(path)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._remove(self._path(key))
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in self._entry_paths():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._count = 0
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        # プロセス内で数えた件数（他のプロセスによる書き込みは次の走査まで反映されない）
+        return self._count
+
+
+def create_cache_backend(
+    backend: Optional[str],
+    directory: Optional[str] = None,
+    max_entries: int = 16,
+    ttl_seconds: Optional[float] = None,
+    max_bytes: Optional[int] = None,
+) -> Optional[CacheBackend]:
+    """
+    設定値からキャッシュバックエンドを生成する
+    :param backend: "memory" / "disk" / "none"
+    :param max_bytes: エントリの合計サイズの上限（バイト）。Noneの場合は件数だけで制限する
+    :return: キャッシュバックエンド。"none"の場合はNone
+    """
+    backend = (backend or "none").lower()
+    if backend == "memory":
+        return MemoryLRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds, max_bytes=max_bytes)
+    if backend == "disk":
+        if not directory:
+            raise ValueError("directory is required for disk cache backend.")
+        return DiskCache(directory=directory, max_entries=max_entries, ttl_seconds=ttl_seconds, max_bytes=max_bytes)
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown cache backend: {backend}")
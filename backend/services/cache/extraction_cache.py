@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import threading
+import tempfile
+from typing import List, Optional
+from domains.analyze_categories import Category, Page
+from services.cache.cache_backend import CacheBackend, create_cache_backend
+from utils.lines_to_context import lines_to_context
+
+_extraction_cache: Optional[CacheBackend] = None
+_extraction_cache_initialized = False
+_extraction_cache_lock = threading.Lock()
+
+
+def build_page_content_hashes(pages: List[Page]) -> List[str]:
+    """
+    ページごとの内容のハッシュを返す
+    プロンプトに含めるのは行のテキストだけのため、座標などは含めない
+    （全体・コンパクト形式・フィールド指定のどのページ情報からも同じハッシュになる）
+    """
+    return [
+        hashlib.sha256(
+            f"{page_content['page_number']}\n{page_content['context']}".encode("utf-8")).hexdigest()
+        for page_content in lines_to_context(pages=pages)
+    ]
+
+
+def build_extraction_cache_key(
+    target_category: Category,
+    pages: List[Page],
+    deployment_name: str,
+    prompt_version: str,
+    image_document_hash: Optional[str] = None,
+) -> str:
+    """
+    分類ごとの抽出結果キャッシュのキーを生成する
+    抽出対象分類・参照するページ内容のハッシュ・デプロイメント名・プロンプトテンプレートのバージョンを組み合わせる
+    他の分類の変更で全分類のキャッシュが無効にならないよう、全分類・Markdownはキーに含めない
+    図の画像を送る場合は image_document_hash（画像の元のPDF）もキーに含める（画像なしの抽出結果とは区別する）
+    """
+    key = {
+        "category": target_category.category,
+        "page_numbers": target_category.page_numbers,
+        "pages": build_page_content_hashes(pages),
+        "deployment_name": deployment_name,
+        "prompt_version": prompt_version,
+    }
+    if image_document_hash is not None:
+        key["image_document_hash"] = image_document_hash
+    key_source = json.dumps(
+        key,
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return f"extraction:{hashlib.sha256(key_source.encode('utf-8')).hexdigest()}"
+
+
+def get_extraction_cache() -> Optional[CacheBackend]:
+    """
+    プロセス全体で共有する抽出結果キャッシュを返す
+    環境変数で設定する:
+    - EXTRACTION_CACHE_BACKEND: "memory"（既定） / "disk" / "none"
+    - EXTRACTION_CACHE_DIR: diskバックエンドの保存先（既定: 一時ディレクトリ配下）
+    - EXTRACTION_CACHE_MAX_ENTRIES: 最大エントリ数（既定: 512）
+    - EXTRACTION_CACHE_TTL_SECONDS: 有効期間（秒、既定: 86400）
+    - EXTRACTION_CACHE_MAX_BYTES: 合計サイズの上限（バイト、既定: 67108864 = 64MB。空の場合は無制限）
+    """
+    global _extraction_cache, _extraction_cache_initialized
+    if _extraction_cache_initialized:
+        return _extraction_cache
+    with _extraction_cache_lock:
+        if not _extraction_cache_initialized:
+            max_bytes = os.getenv("EXTRACTION_CACHE_MAX_BYTES", "67108864")
+            ttl = os.getenv("EXTRACTION_CACHE_TTL_SECONDS", "86400")
+            _extraction_cache = create_cache_backend(
+                backend=os.getenv("EXTRACTION_CACHE_BACKEND", "memory"),
+                directory=os.getenv("EXTRACTION_CACHE_DIR", os.path.join(
+                    tempfile.gettempdir(), "extraction-cache")),
+                max_entries=int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "512")),
+                ttl_seconds=float(ttl) if ttl else None,
+                max_bytes=int(max_bytes) if max_bytes else None,
+            )
+            _extraction_cache_initialized = True
+    return _extraction_cache
+
+
+def invalidate_extraction_cache(cache_key: Optional[str] = None) -> int:
+    """
+    抽出結果キャッシュを無効化する
+    :param cache_key: 削除するエントリのキー。Noneの場合は全エントリを削除する
+    :return: 削除したエントリ数（キャッシュが無効な場合は0）
+    """
+    cache = get_extraction_cache()
+    if cache is None:
+        return 0
+    if cache_key is None:
+        count = len(cache)
+        cache.clear()
+        return count
+    # 統計（ヒット数・ミス数）に影響しないよう、getを使わずに件数の差で判定する
+    count = len(cache)
+    cache.delete(cache_key)
+    return count - len(cache)
@@ -0,0 +1,43 @@
+import os
+import threading
+import tempfile
+from typing import Optional
+from services.cache.cache_backend import CacheBackend, create_cache_backend
+
+_revision_store: Optional[CacheBackend] = None
+_revision_store_initialized = False
+_revision_store_lock = threading.Lock()
+
+
+def build_revision_key(document_id: str) -> str:
+    """文書ID（改訂をまたいで同じ文書を表すID）ごとの、最新の解析結果のキーを生成する"""
+    return f"revision:{document_id}"
+
+
+def get_revision_store() -> Optional[CacheBackend]:
+    """
+    プロセス全体で共有する、改訂版の差分解析用の解析結果ストアを返す
+    環境変数で設定する:
+    - REVISION_STORE_BACKEND: "memory"（既定） / "disk" / "none"
+    - REVISION_STORE_DIR: diskバックエンドの保存先（既定: 一時ディレクトリ配下）
+    - REVISION_STORE_MAX_ENTRIES: 最大文書数（既定: 32）
+    - REVISION_STORE_TTL_SECONDS: 有効期間（秒、既定: 2592000 = 30日）
+    - REVISION_STORE_MAX_BYTES: 合計サイズの上限（バイト、既定: 268435456 = 256MB。空の場合は無制限）
+    """
+    global _revision_store, _revision_store_initialized
+    if _revision_store_initialized:
+        return _revision_store
+    with _revision_store_lock:
+        if not _revision_store_initialized:
+            max_bytes = os.getenv("REVISION_STORE_MAX_BYTES", "268435456")
+            ttl = os.getenv("REVISION_STORE_TTL_SECONDS", "2592000")
+            _revision_store = create_cache_backend(
+                backend=os.getenv("REVISION_STORE_BACKEND", "memory"),
+                directory=os.getenv("REVISION_STORE_DIR", os.path.join(
+                    tempfile.gettempdir(), "revision-store")),
+                max_entries=int(os.getenv("REVISION_STORE_MAX_ENTRIES", "32")),
+                ttl_seconds=float(ttl) if ttl else None,
+                max_bytes=int(max_bytes) if max_bytes else None,
+            )
+            _revision_store_initialized = True
+    return _revision_store
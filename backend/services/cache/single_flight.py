@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# 同じ内容のリクエストが同時に届いた場合（二重送信・共有PDFを複数人が同時に開くなど）に、
+# 最初の1件だけがOCR・Azure OpenAIを呼び出し、処理中に届いた残りはその結果を待って共有する
+# 完了した結果は保持しない（完了後の再利用は analysis_cache・extraction_cache の役割）
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+
+def build_single_flight_key(*parts: Any) -> str:
+    """リクエストの内容（バイト列・文字列など）からキーを生成する"""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else str(part).encode("utf-8")
+        # 区切りの位置で別の組み合わせと衝突しないよう、長さを前に付ける
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class _Call:
+    """実行中の1件（同期版）。完了するまで待機中のスレッドは event で待つ"""
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    キーごとに実行中の処理を1つにまとめる
+    - do: スレッド間で共有する（同期ルート）
+    - do_async: 同じイベントループのタスク間で共有する（非同期ルート）
+    例外も共有する（実行した1件が失敗した場合は、待っていた全員に同じ例外を送出する）
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._tasks: Dict[Tuple[int, str], asyncio.Future] = {}
+        self._metrics = {
+            "calls": 0,
+            "executions": 0,
+            "coalesced": 0,
+        }
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        key の処理が実行中であればその結果を待ち、なければ fn を実行する
+        :return: (結果, 他の呼び出しの結果を共有したかどうか)
+        """
+        with self._lock:
+            self._metrics["calls"] += 1
+            call = self._calls.get(key)
+            coalesced = call is not None
+            if coalesced:
+                self._metrics["coalesced"] += 1
+            else:
+                call = self._calls[key] = _Call()
+                self._metrics["executions"] += 1
+        if coalesced:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        do の非同期版
+        処理は独立したタスクとして実行するため、待っているリクエストの1つがキャンセルされても他には影響しない
+        """
+        loop = asyncio.get_running_loop()
+        task_key = (id(loop), key)
+        with self._lock:
+            self._metrics["calls"] += 1
+            task = self._tasks.get(task_key)
+            coalesced = task is not None
+            if coalesced:
+                self._metrics["coalesced"] += 1
+            else:
+                task = self._tasks[task_key] = asyncio.ensure_future(fn())
+                self._metrics["executions"] += 1
+                task.add_done_callback(lambda _: self._forget(task_key, task))
+        return await asyncio.shield(task), coalesced
+
+    def _forget(self, task_key: Tuple[int, str], task: asyncio.Future) -> None:
+        with self._lock:
+            if self._tasks.get(task_key) is task:
+                del self._tasks[task_key]
+        if not task.cancelled():
+            # 待っていたリクエストが全てキャンセルされた場合に「未取得の例外」の警告を出さない
+            task.exception()
+
+    def metrics(self) -> dict:
+        """呼び出し数・実際の実行数・結果を共有した数・実行中の数を返す"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["in_flight"] = len(self._calls) + len(self._tasks)
+        return metrics
+
+
+_single_flights: Dict[str, SingleFlight] = {}
+_single_flights_lock = threading.Lock()
+
+
+def get_single_flight(name: str) -> Optional[SingleFlight]:
+    """
+    用途（analyze_document_structure・extraction_category など）ごとにプロセス全体で共有される SingleFlight を返す
+    SINGLE_FLIGHT_ENABLED=false の場合はNone
+    """
+    if not SINGLE_FLIGHT_ENABLED:
+        return None
+    single_flight = _single_flights.get(name)
+    if single_flight is None:
+        with _single_flights_lock:
+            single_flight = _single_flights.setdefault(name, SingleFlight(name))
+    return single_flight
+
+
+def get_single_flight_metrics() -> dict:
+    """全ての SingleFlight のメトリクスを返す"""
+    with _single_flights_lock:
+        single_flights = dict(_single_flights)
+    return {name: single_flight.metrics() for name, single_flight in single_flights.items()}
+
+
+def run_single_flight(name: str, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+    """
+    get_single_flight(name).do(key, fn) を実行する。SINGLE_FLIGHT_ENABLED=false の場合は fn をそのまま実行する
+    結果は同時に届いた他のリクエストと共有されるため、呼び出し側で変更しないこと
+    :return: (結果, 他の呼び出しの結果を共有したかどうか)
+    """
+    single_flight = get_single_flight(name)
+    if single_flight is None:
+        return fn(), False
+    return single_flight.do(key, fn)
+
+
+async def run_single_flight_async(name: str, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+    """run_single_flight の非同期版"""
+    single_flight = get_single_flight(name)
+    if single_flight is None:
+        return await fn(), False
+    return await single_flight.do_async(key, fn)
@@ -0,0 +1,370 @@
+import asyncio
+import contextvars
+import os
+import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from domains.analyze_categories import Category
+from services.telemetry.token_accounting import PROMPT_TOKEN_BUDGET, count_prompt_sections, trim_budget_for
+from services.telemetry.tracing import span, traced
+from utils.token_estimator import estimate_text_tokens
+
+# ドキュメントの分類（目次の生成）
+# プロンプトがトークン予算を超える大きなドキュメントは、ページのまとまり（ウィンドウ）ごとに
+# 並列で分類し、結果を統合する（map-reduce）
+# - CLASSIFICATION_MODE: "auto"（予算を超える場合だけ分割） / "single" / "chunked"
+CLASSIFICATION_MODE = os.getenv("CLASSIFICATION_MODE", "auto").lower()
+CLASSIFICATION_TOKEN_BUDGET = int(
+    os.getenv("CLASSIFICATION_TOKEN_BUDGET", "60000"))
+CLASSIFICATION_WINDOW_TOKENS = int(
+    os.getenv("CLASSIFICATION_WINDOW_TOKENS", "20000"))
+CLASSIFICATION_MAX_PARALLEL = int(
+    os.getenv("CLASSIFICATION_MAX_PARALLEL", "4"))
+CLASSIFICATION_DEPLOYMENT = "gpt-4o"
+
+# Markdown出力でページの境界に挿入される区切り
+_PAGE_BREAK_PATTERN = re.compile(r"\s*<!-- PageBreak -->\s*")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def build_classification_system_prompt(classification_prompt: str) -> str:
+    """分類用のシステムプロンプトを生成する"""
+    # システムメッセージに、システム上固定の推論の指示を追加
+    # TOOD: 本来はDBなどに外だし
+    return f"""あなたは与えられた業務ドキュメントを分析し、ドキュメントの内容を考慮して構造的な文書にする役割です。
+
+# 指示
+ドキュメント内容を情報のまとまりで分類分けしてください。
+分類に紐づくドキュメントのページ番号を出力してください。
+
+# ユーザメッセージで与えられるデータの説明
+- 「-------------------- Markdown --------------------」は、ドキュメント全体をMarkdownで表現したものです。
+- 「-------------------- pages --------------------」は、ページごとの情報を表しています。
+
+# ルール
+- 「-------------------- Markdown --------------------」の内容を元に、ドキュメント全体の構造を理解して分類名を生成してください。
+- 「-------------------- pages --------------------」のJson情報を元に、page_numberを提示してください。
+    - 「# ページ番号」と「## ページ内容」が与えられます。
+    - 与えられた「# ページ番号」以外のページ番号は出力してはいけません。
+    - page_numberは分類ごとに被っても構いません。
+- 「ユーザから指示された分類」は必ず含むようにしてください。
+- 分類の追加は自由です。
+
+# ユーザから指示された分類
+{classification_prompt}
+
+# 出力形式
+- category: 分類の各項目名
+- page_number: 分類に紐づくページ番号
+
+# 出力形式例
+{{
+    [
+        {{
+            "category": "目次の各項目名",
+            "page_numbers": [
+                1, 2
+            ]
+        }}
+    ]
+}}"""
+
+
+def build_classification_pages_text(di_response: dict) -> str:
+    """Document Intelligenceの解析結果から、ページ番号とページ内容の一覧を生成する"""
+    # pagesをMarkdown形式に変換
+    return "\n".join(
+        f"# ページ番号: {page['page_number']}\n"
+        f"## ページ内容:\n" +
+        "\n".join(line["content"] for line in page["lines"])
+        for page in di_response["pages"]
+    )
+
+
+def build_classification_prompt(di_response: dict) -> str:
+    """Document Intelligenceの解析結果から、分類用のユーザプロンプトを生成する"""
+    pages_markdown = build_classification_pages_text(di_response)
+
+    return f"""-------------------- Markdown --------------------
+{di_response["content_markdown"]}
+
+-------------------- pages --------------------
+{pages_markdown}"""
+
+
+def build_window_classification_system_prompt(classification_prompt: str) -> str:
+    """ページのまとまり（ウィンドウ）ごとの分類用のシステムプロンプトを生成する"""
+    return f"""あなたは与えられた業務ドキュメントの一部を分析し、ドキュメントの内容を考慮して構造的な文書にする役割です。
+
+# 指示
+与えられたページの内容を情報のまとまりで分類分けしてください。
+分類に紐づくドキュメントのページ番号を出力してください。
+
+# ユーザメッセージで与えられるデータの説明
+- ドキュメント全体のうち、連続する一部のページだけが与えられます。
+- 「# ページ番号」と「## ページ内容」が、ページごとに与えられます。
+
+# ルール
+- 与えられた「# ページ番号」以外のページ番号は出力してはいけません。
+- page_numberは分類ごとに被っても構いません。
+- 他の部分の分類結果と統合されるため、前後のページから続く内容には一般的な分類名を付けてください。
+- 「ユーザから指示された分類」に該当する内容がある場合は、その分類名をそのまま使用してください。
+- 分類の追加は自由です。
+
+# ユーザから指示された分類
+{classification_prompt}
+
+# 出力形式
+- category: 分類の各項目名
+- page_number: 分類に紐づくページ番号"""
+
+
+def build_page_texts(di_response: dict) -> List[Tuple[int, str]]:
+    """
+    ページ番号とページ内容の組を返す
+    Markdownのページ区切りの数がページ数と一致する場合はページごとのMarkdown（見出しや表を含む）を、
+    一致しない場合は行のテキストを使用する
+    """
+    pages = di_response["pages"]
+    markdown_pages = _PAGE_BREAK_PATTERN.split(di_response["content_markdown"])
+    if len(markdown_pages) == len(pages):
+        return [(page["page_number"], markdown) for page, markdown in zip(pages, markdown_pages)]
+    return [
+        (page["page_number"], "\n".join(line["content"] for line in page["lines"]))
+        for page in pages
+    ]
+
+
+def build_page_windows(page_texts: List[Tuple[int, str]], window_tokens: int) -> List[List[Tuple[int, str]]]:
+    """ページを先頭から順に詰め、1ウィンドウの推定トークン数が window_tokens 以下になるように分割する"""
+    windows: List[List[Tuple[int, str]]] = []
+    current: List[Tuple[int, str]] = []
+    current_tokens = 0
+    for page_number, text in page_texts:
+        tokens = estimate_text_tokens(text)
+        if current and current_tokens + tokens > window_tokens:
+            windows.append(current)
+            current, current_tokens = [], 0
+        current.append((page_number, text))
+        current_tokens += tokens
+    if current:
+        windows.append(current)
+    return windows
+
+
+def build_window_prompt(window: List[Tuple[int, str]]) -> str:
+    """ウィンドウ内のページから、分類用のユーザプロンプトを生成する"""
+    return "\n".join(
+        f"# ページ番号: {page_number}\n## ページ内容:\n{text}" for page_number, text in window
+    )
+
+
+def normalize_category_name(name: str) -> str:
+    return _WHITESPACE_PATTERN.sub("", unicodedata.normalize("NFKC", name)).lower()
+
+
+def merge_categories(partials: List[List[Category]], valid_page_numbers: Optional[set] = None) -> List[Category]:
+    """
+    ウィンドウごとの分類結果を統合する
+    正規化した分類名が同じものは1つにまとめてpage_numbersを結合する（順序と表記は初出のものを使用）
+    valid_page_numbers を指定した場合、存在しないページ番号は除外する
+    """
+    names: dict = {}
+    merged_page_numbers: dict = {}
+    for categories in partials:
+        for category in categories:
+            key = normalize_category_name(category.category)
+            names.setdefault(key, category.category)
+            merged_page_numbers.setdefault(key, set()).update(
+                page_number for page_number in category.page_numbers
+                if valid_page_numbers is None or page_number in valid_page_numbers
+            )
+    return [
+        Category(category=name, page_numbers=sorted(merged_page_numbers[key]))
+        for key, name in names.items()
+    ]
+
+
+def _window_token_budget(classification_prompt: str) -> Tuple[Optional[int], int]:
+    """
+    :return: (PROMPT_TOKEN_BUDGETから求めたページ内容の上限（制限なしはNone）, 1ウィンドウのトークン数)
+    """
+    system_prompt_tokens = estimate_text_tokens(
+        build_window_classification_system_prompt(classification_prompt))
+    max_window_tokens = trim_budget_for(system_prompt_tokens)
+    window_tokens = CLASSIFICATION_WINDOW_TOKENS if max_window_tokens is None \
+        else max(min(CLASSIFICATION_WINDOW_TOKENS, max_window_tokens), 1)
+    return max_window_tokens, window_tokens
+
+
+@traced("classification_prompt")
+def plan_classification(classification_prompt: str, di_response: dict) -> Optional[List[List[Tuple[int, str]]]]:
+    """
+    分割して分類する場合はウィンドウのリストを、1回で分類する場合はNoneを返す
+    PROMPT_TOKEN_BUDGET（PROMPT_BUDGET_ACTION=trim）が設定されている場合は、その上限にも収まるように分割する
+    """
+    max_window_tokens, window_tokens = _window_token_budget(classification_prompt)
+
+    if CLASSIFICATION_MODE != "chunked":
+        pages_text = build_classification_pages_text(di_response)
+        prompt_tokens = estimate_text_tokens(build_classification_system_prompt(classification_prompt)) + \
+            estimate_text_tokens(di_response["content_markdown"]) + \
+            estimate_text_tokens(pages_text)
+        token_budget = None if CLASSIFICATION_MODE == "single" else CLASSIFICATION_TOKEN_BUDGET
+        if max_window_tokens is not None:
+            token_budget = PROMPT_TOKEN_BUDGET if token_budget is None \
+                else min(token_budget, PROMPT_TOKEN_BUDGET)
+        if token_budget is None or prompt_tokens <= token_budget:
+            count_prompt_sections(
+                {"markdown": di_response["content_markdown"], "pages": pages_text})
+            return None
+
+    windows = build_page_windows(build_page_texts(di_response), window_tokens)
+    count_prompt_sections(
+        {"pages": "".join(build_window_prompt(window) for window in windows)})
+    return windows
+
+
+@traced("classification_prompt")
+def plan_page_classification(classification_prompt: str, di_response: dict, page_numbers: List[int]) -> List[List[Tuple[int, str]]]:
+    """指定したページだけを分類するウィンドウのリストを返す（改訂版の差分解析用）"""
+    _, window_tokens = _window_token_budget(classification_prompt)
+    selected = set(page_numbers)
+    page_texts = [(page_number, text) for page_number, text in build_page_texts(di_response)
+                  if page_number in selected]
+    windows = build_page_windows(page_texts, window_tokens)
+    count_prompt_sections(
+        {"pages": "".join(build_window_prompt(window) for window in windows)})
+    return windows
+
+
+def merge_page_categories(previous_categories: List[Category], partials: List[List[Category]], valid_page_numbers: set) -> List[Category]:
+    """
+    変更されていないページの分類結果に、変更されたページの分類結果を統合する
+    ページがなくなった分類は除外する
+    """
+    return [
+        category for category in merge_categories([previous_categories, *partials], valid_page_numbers)
+        if category.page_numbers
+    ]
+
+
+def _classify_windows(azure_openai_service, classification_prompt: str, windows: List[List[Tuple[int, str]]]) -> List[List[Category]]:
+    """ウィンドウごとに並列で分類する"""
+    system_prompt = build_window_classification_system_prompt(
+        classification_prompt)
+
+    def classify_window(window: List[Tuple[int, str]]) -> List[Category]:
+        return azure_openai_service.completions_format_categories(
+            system_prompt=system_prompt,
+            text=build_window_prompt(window),
+            deployment_name=CLASSIFICATION_DEPLOYMENT
+        )
+
+    with ThreadPoolExecutor(max_workers=CLASSIFICATION_MAX_PARALLEL) as executor:
+        # トークン数の集計をワーカースレッドに引き継ぐため、コンテキストをコピーして実行する
+        futures = [
+            executor.submit(contextvars.copy_context().run, classify_window, window)
+            for window in windows
+        ]
+        return [future.result() for future in futures]
+
+
+async def _classify_windows_async(azure_openai_service, classification_prompt: str, windows: List[List[Tuple[int, str]]]) -> List[List[Category]]:
+    """_classify_windows の非同期版"""
+    system_prompt = build_window_classification_system_prompt(
+        classification_prompt)
+    semaphore = asyncio.Semaphore(CLASSIFICATION_MAX_PARALLEL)
+
+    async def classify_window(window: List[Tuple[int, str]]) -> List[Category]:
+        async with semaphore:
+            return await azure_openai_service.completions_format_categories(
+                system_prompt=system_prompt,
+                text=build_window_prompt(window),
+                deployment_name=CLASSIFICATION_DEPLOYMENT
+            )
+
+    return list(await asyncio.gather(*(classify_window(window) for window in windows)))
+
+
+def classify_document(azure_openai_service, classification_prompt: str, di_response: dict) -> List[Category]:
+    """
+    ドキュメントを分類する
+    プロンプトが予算を超える場合は、ウィンドウごとに並列で分類して結果を統合する
+    :param azure_openai_service: AzureOpenAIChatService
+    """
+    windows = plan_classification(classification_prompt, di_response)
+    if windows is None:
+        return azure_openai_service.completions_format_categories(
+            system_prompt=build_classification_system_prompt(
+                classification_prompt),
+            text=build_classification_prompt(di_response),
+            deployment_name=CLASSIFICATION_DEPLOYMENT
+        )
+
+    partials = _classify_windows(
+        azure_openai_service, classification_prompt, windows)
+    with span("classification_merge", windows=len(windows)):
+        return merge_categories(partials, {page["page_number"] for page in di_response["pages"]})
+
+
+async def classify_document_async(azure_openai_service, classification_prompt: str, di_response: dict) -> List[Category]:
+    """
+    classify_document の非同期版
+    :param azure_openai_service: AsyncAzureOpenAIChatService
+    """
+    windows = plan_classification(classification_prompt, di_response)
+    if windows is None:
+        return await azure_openai_service.completions_format_categories(
+            system_prompt=build_classification_system_prompt(
+                classification_prompt),
+            text=build_classification_prompt(di_response),
+            deployment_name=CLASSIFICATION_DEPLOYMENT
+        )
+
+    partials = await _classify_windows_async(
+        azure_openai_service, classification_prompt, windows)
+    with span("classification_merge", windows=len(windows)):
+        return merge_categories(partials, {page["page_number"] for page in di_response["pages"]})
+
+
+def classify_pages(
+    azure_openai_service,
+    classification_prompt: str,
+    di_response: dict,
+    page_numbers: List[int],
+    previous_categories: List[Category],
+) -> List[Category]:
+    """
+    指定したページ（改訂で変更されたページ）だけを分類し、以前の分類結果に統合する
+    :param azure_openai_service: AzureOpenAIChatService
+    :param previous_categories: 以前の分類結果。変更されていないページだけを、新しいページ番号で指すこと
+    """
+    windows = plan_page_classification(
+        classification_prompt, di_response, page_numbers)
+    partials = _classify_windows(
+        azure_openai_service, classification_prompt, windows) if windows else []
+    with span("classification_merge", windows=len(windows)):
+        return merge_page_categories(
+            previous_categories, partials, {page["page_number"] for page in di_response["pages"]})
+
+
+async def classify_pages_async(
+    azure_openai_service,
+    classification_prompt: str,
+    di_response: dict,
+    page_numbers: List[int],
+    previous_categories: List[Category],
+) -> List[Category]:
+    """
+    classify_pages の非同期版
+    :param azure_openai_service: AsyncAzureOpenAIChatService
+    """
+    windows = plan_page_classification(
+        classification_prompt, di_response, page_numbers)
+    partials = await _classify_windows_async(
+        azure_openai_service, classification_prompt, windows) if windows else []
+    with span("classification_merge", windows=len(windows)):
+        return merge_page_categories(
+            previous_categories, partials, {page["page_number"] for page in di_response["pages"]})
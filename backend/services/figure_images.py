@@ -0,0 +1,209 @@
+import base64
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from domains.document_model import DocumentPages, PageView
+from services.cache.cache_backend import CacheBackend, create_cache_backend
+
+try:
+    # PDFのページの描画（任意の依存関係）
+    import pypdfium2 as pdfium
+except ImportError:  # pragma: no cover
+    pdfium = None
+
+try:
+    # 図の切り出し・縮小（任意の依存関係）
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+# 図の画像（FIGURE_IMAGES_ENABLED=true の場合）
+# analyze_document_structure で図を含むPDFを解析した場合は、PDFを文書のハッシュ（document_hash）をキーにキャッシュし、
+# extraction_category で include_images が指定されたときに、抽出対象分類のページの図だけを描画・切り出す
+# 元のPDF・切り出した画像は、件数・合計サイズ・有効期間を制限したディスクキャッシュ（DiskCache）に保存する
+FIGURE_IMAGES_ENABLED = os.getenv("FIGURE_IMAGES_ENABLED", "false").lower() == "true"
+FIGURE_IMAGE_DIR = os.getenv("FIGURE_IMAGE_DIR") or os.path.join(
+    tempfile.gettempdir(), "data-viewer-tool", "figure_images")
+# 画像の長辺の最大ピクセル数（これより大きい図は縮小する）
+FIGURE_IMAGE_MAX_SIZE = int(os.getenv("FIGURE_IMAGE_MAX_SIZE", "1024"))
+# 1回の抽出で送る画像の最大枚数
+FIGURE_IMAGE_MAX_COUNT = int(os.getenv("FIGURE_IMAGE_MAX_COUNT", "8"))
+# ページを描画する解像度（DPI）
+FIGURE_RENDER_DPI = int(os.getenv("FIGURE_RENDER_DPI", "150"))
+
+_source_cache: Optional[CacheBackend] = None
+_image_cache: Optional[CacheBackend] = None
+_caches_initialized = False
+_caches_lock = threading.Lock()
+
+
+def figure_images_available() -> bool:
+    """図の画像を作成できるか（有効かつ pypdfium2・Pillow がインストールされているか）"""
+    return FIGURE_IMAGES_ENABLED and pdfium is not None and Image is not None
+
+
+def build_document_hash(pdf_binary: bytes) -> str:
+    return hashlib.sha256(pdf_binary).hexdigest()
+
+
+def _create_cache(name: str, max_entries: str, max_bytes: str) -> CacheBackend:
+    prefix = f"FIGURE_{name.upper()}_CACHE"
+    ttl = os.getenv("FIGURE_CACHE_TTL_SECONDS", "86400")
+    max_bytes = os.getenv(f"{prefix}_MAX_BYTES", max_bytes)
+    return create_cache_backend(
+        backend="disk",
+        directory=os.path.join(FIGURE_IMAGE_DIR, name),
+        max_entries=int(os.getenv(f"{prefix}_MAX_ENTRIES", max_entries)),
+        ttl_seconds=float(ttl) if ttl else None,
+        max_bytes=int(max_bytes) if max_bytes else None,
+    )
+
+
+def get_figure_caches() -> Tuple[CacheBackend, CacheBackend]:
+    """
+    図の画像の元のPDF・切り出した画像のキャッシュを返す（プロセス全体で共有する）
+    値はJSONに保存するため、バイト列はBase64の文字列にする
+    環境変数で設定する:
+    - FIGURE_SOURCE_CACHE_MAX_ENTRIES / FIGURE_SOURCE_CACHE_MAX_BYTES: 元のPDF（既定: 32件 / 268435456 = 256MB）
+    - FIGURE_IMAGE_CACHE_MAX_ENTRIES / FIGURE_IMAGE_CACHE_MAX_BYTES: 切り出した画像（既定: 2048件 / 134217728 = 128MB）
+    - FIGURE_CACHE_TTL_SECONDS: 有効期間（秒、既定: 86400）
+    """
+    global _source_cache, _image_cache, _caches_initialized
+    if _caches_initialized:
+        return _source_cache, _image_cache
+    with _caches_lock:
+        if not _caches_initialized:
+            _source_cache = _create_cache("source", "32", "268435456")
+            _image_cache = _create_cache("image", "2048", "134217728")
+            _caches_initialized = True
+    return _source_cache, _image_cache
+
+
+def _image_cache_key(document_hash: str, page_number: int, figure_id: str, max_size: int) -> str:
+    return f"figure_image:{document_hash}:{page_number}:{figure_id}:{max_size}"
+
+
+def register_figure_source(pdf_binary: bytes, di_response: dict) -> Optional[str]:
+    """
+    図を含むPDFを、後から図の画像を作成できるようにキャッシュする
+    ここではページの描画は行わない（抽出時に必要なページだけを描画する）
+    :return: 文書のハッシュ（図がない場合・無効な場合・画像を作成できない環境ではNone）
+    """
+    if not figure_images_available():
+        return None
+    if not any(page.get("figures") for page in di_response["pages"]):
+        return None
+    document_hash = build_document_hash(pdf_binary)
+    source_cache, _ = get_figure_caches()
+    key = f"figure_source:{document_hash}"
+    # 同じPDFを再度解析した場合は保存し直さない（値は読み込まず、参照時刻だけ更新する）
+    if not source_cache.touch(key):
+        source_cache.set(key, base64.b64encode(pdf_binary).decode("ascii"))
+    return document_hash
+
+
+def _crop_box(page: PageView, polygon, image_size) -> Optional[tuple]:
+    """
+    図の領域（ページの単位。PDFではインチ）を、描画した画像のピクセル座標にする
+    ページの幅・高さがない場合（fields で絞り込んだページ情報など）は、インチとして FIGURE_RENDER_DPI で換算する
+    """
+    if len(polygon) < 4:
+        return None
+    xs, ys = polygon[0::2], polygon[1::2]
+    image_width, image_height = image_size
+    scale_x = image_width / page.width if page.width else FIGURE_RENDER_DPI
+    scale_y = image_height / page.height if page.height else FIGURE_RENDER_DPI
+    box = (
+        max(0, int(min(xs) * scale_x)),
+        max(0, int(min(ys) * scale_y)),
+        min(image_width, int(max(xs) * scale_x + 1)),
+        min(image_height, int(max(ys) * scale_y + 1)),
+    )
+    return box if box[0] < box[2] and box[1] < box[3] else None
+
+
+def _render_page_figures(pdf_binary: bytes, page: PageView, figures: list, max_size: int) -> Dict[str, bytes]:
+    """ページを1回だけ描画し、図ごとに切り出して縮小したPNGを返す"""
+    document = pdfium.PdfDocument(pdf_binary)
+    try:
+        rendered = document[page.page_number - 1].render(scale=FIGURE_RENDER_DPI / 72).to_pil()
+    finally:
+        document.close()
+
+    images = {}
+    for figure in figures:
+        regions = [region for region in figure.bounding_regions if region.page_number == page.page_number]
+        box = _crop_box(page, regions[0].polygon, rendered.size) if regions else None
+        if box is None:
+            continue
+        image = rendered.crop(box)
+        image.thumbnail((max_size, max_size))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", optimize=True)
+        images[figure.id] = buffer.getvalue()
+    return images
+
+
+def get_figure_images(
+    document_hash: str,
+    pages: DocumentPages,
+    page_numbers: Iterable[int],
+    max_size: Optional[int] = None,
+    max_count: Optional[int] = None,
+) -> Dict[int, List[bytes]]:
+    """
+    指定したページの図の画像（PNG）を、ページ番号ごとに返す
+    キャッシュにない図があるページだけを描画する。画像を作成できない場合・元のPDFがキャッシュにない場合は空の辞書
+    :param pages: 抽出リクエストのページ情報（図のIDと領域を使用する）
+    """
+    max_size = max_size or FIGURE_IMAGE_MAX_SIZE
+    max_count = max_count if max_count is not None else FIGURE_IMAGE_MAX_COUNT
+    if not figure_images_available():
+        return {}
+    source_cache, image_cache = get_figure_caches()
+
+    selected = set(page_numbers)
+    pdf_binary: Optional[bytes] = None
+    images: Dict[int, List[bytes]] = {}
+    count = 0
+    for page in pages:
+        if page.page_number not in selected or not page.figures or count >= max_count:
+            continue
+        # IDのない図はキャッシュのキーにできないため対象外
+        figures = [figure for figure in page.figures if figure.id][:max_count - count]
+        cached = {}
+        for figure in figures:
+            value = image_cache.get(_image_cache_key(document_hash, page.page_number, figure.id, max_size))
+            if value is not None:
+                cached[figure.id] = base64.b64decode(value)
+        missing = [figure for figure in figures if figure.id not in cached]
+        if missing:
+            if pdf_binary is None:
+                source = source_cache.get(f"figure_source:{document_hash}")
+                if source is None:
+                    logging.warning(f"Figure source not found: {document_hash}")
+                    return images
+                pdf_binary = base64.b64decode(source)
+            try:
+                rendered = _render_page_figures(pdf_binary, page, missing, max_size)
+            except Exception as e:
+                logging.warning(f"Failed to render figures on page {page.page_number}: {e}")
+                rendered = {}
+            for figure_id, data in rendered.items():
+                image_cache.set(_image_cache_key(document_hash, page.page_number, figure_id, max_size),
+                                base64.b64encode(data).decode("ascii"))
+            cached.update(rendered)
+        page_images = [cached[figure.id] for figure in figures if figure.id in cached]
+        if page_images:
+            images[page.page_number] = page_images
+            count += len(page_images)
+    return images
+
+
+def to_data_url(png: bytes) -> str:
+    """PNGをAzure OpenAIの image_url に渡せるdata URLにする"""
+    return "data:image/png;base64," + base64.b64encode(png).decode("ascii")
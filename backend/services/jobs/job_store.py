@@ -0,0 +1,198 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Optional
+
+# ジョブの状態
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_SUCCEEDED = "succeeded"
+JOB_STATUS_FAILED = "failed"
+
+# ストアを開いた時点で queued・running のまま残っているジョブのエラー
+# （ジョブのキューはプロセス内にあるため、ホストの再起動などで失われたジョブ）
+INTERRUPTED_JOB_ERROR = "Job was interrupted before completion (worker restarted)."
+
+
+def _new_job(job_type: str) -> dict:
+    now = time.time()
+    return {
+        "job_id": uuid.uuid4().hex,
+        "job_type": job_type,
+        "status": JOB_STATUS_QUEUED,
+        "stages": [],
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def _apply_stage(job: dict, stage: str, status: str) -> None:
+    """ステージの進捗を記録する（同名ステージがあれば更新、なければ追加）"""
+    now = time.time()
+    for entry in job["stages"]:
+        if entry["stage"] == stage:
+            entry["status"] = status
+            if status != JOB_STATUS_RUNNING:
+                entry["finished_at"] = now
+            break
+    else:
+        job["stages"].append({
+            "stage": stage,
+            "status": status,
+            "started_at": now,
+            "finished_at": None if status == JOB_STATUS_RUNNING else now,
+        })
+
+
+class JobStore:
+    """
+    ジョブストアの共通インターフェース
+    ジョブは辞書で表す:
+    - job_id / job_type / status（queued, running, succeeded, failed）
+    - stages: ステージごとの進捗（stage, status, started_at, finished_at）
+    - result: 成功時の結果（JSONシリアライズ可能な値）
+    - error: 失敗時のエラーメッセージ
+    retention_seconds を指定した場合、最後の更新からその秒数が経過したジョブは、ジョブの登録時に削除する
+    """
+
+    def create(self, job_type: str) -> dict:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def set_status(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    def set_stage(self, job_id: str, stage: str, status: str) -> None:
+        raise NotImplementedError
+
+
+class MemoryJobStore(JobStore):
+    """プロセス内の辞書にジョブを保持するストア（テスト・ローカル実行用）"""
+
+    def __init__(self, retention_seconds: Optional[float] = None) -> None:
+        self.retention_seconds = retention_seconds
+        self._jobs: dict = {}
+        self._lock = threading.Lock()
+
+    def _purge_expired(self) -> None:
+        if self.retention_seconds is None:
+            return
+        expires_before = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items() if job["updated_at"] < expires_before]:
+            del self._jobs[job_id]
+
+    def create(self, job_type: str) -> dict:
+        job = _new_job(job_type)
+        with self._lock:
+            self._purge_expired()
+            self._jobs[job["job_id"]] = job
+        return json.loads(json.dumps(job))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    def set_status(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = status
+            job["result"] = result
+            job["error"] = error
+            job["updated_at"] = time.time()
+
+    def set_stage(self, job_id: str, stage: str, status: str) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            _apply_stage(job, stage, status)
+            job["updated_at"] = time.time()
+
+
+class SQLiteJobStore(JobStore):
+    """
+    SQLiteファイルにジョブを保持するストア
+    同一インスタンス内のワーカーとHTTPルートでジョブを共有する。複数インスタンス間で共有する場合は
+    同じインターフェースで外部ストア（Table Storageなど）を実装する。
+    ジョブのキューはワーカーのプロセス内にあるため、開いた時点で queued・running のジョブは失敗として記録する
+    （1つのファイルを同時に開くプロセスは1つであること）
+    """
+
+    def __init__(self, path: str, retention_seconds: Optional[float] = None) -> None:
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, body TEXT NOT NULL, updated_at REAL NOT NULL)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at)")
+            self._purge_expired()
+            self._fail_interrupted()
+
+    def _purge_expired(self) -> None:
+        if self.retention_seconds is None:
+            return
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM jobs WHERE updated_at < ?", (time.time() - self.retention_seconds,))
+
+    def _fail_interrupted(self) -> None:
+        rows = self._connection.execute(
+            "SELECT body FROM jobs WHERE json_extract(body, '$.status') IN (?, ?)",
+            (JOB_STATUS_QUEUED, JOB_STATUS_RUNNING)).fetchall()
+        for (body,) in rows:
+            job = json.loads(body)
+            for entry in job["stages"]:
+                if entry["status"] == JOB_STATUS_RUNNING:
+                    _apply_stage(job, entry["stage"], JOB_STATUS_FAILED)
+            job["status"] = JOB_STATUS_FAILED
+            job["error"] = INTERRUPTED_JOB_ERROR
+            self._save(job)
+        if rows:
+            logging.warning(f"Marked {len(rows)} interrupted jobs as failed: {self.path}")
+
+    def _save(self, job: dict) -> None:
+        job["updated_at"] = time.time()
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, body, updated_at) VALUES (?, ?, ?)",
+                (job["job_id"], json.dumps(job, ensure_ascii=False), job["updated_at"]),
+            )
+
+    def _load(self, job_id: str) -> Optional[dict]:
+        row = self._connection.execute(
+            "SELECT body FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def create(self, job_type: str) -> dict:
+        job = _new_job(job_type)
+        with self._lock:
+            self._purge_expired()
+            self._save(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._load(job_id)
+
+    def set_status(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            job = self._load(job_id)
+            job["status"] = status
+            job["result"] = result
+            job["error"] = error
+            self._save(job)
+
+    def set_stage(self, job_id: str, stage: str, status: str) -> None:
+        with self._lock:
+            job = self._load(job_id)
+            _apply_stage(job, stage, status)
+            self._save(job)
@@ -0,0 +1,91 @@
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from services.jobs.job_store import (
+    JobStore, MemoryJobStore, SQLiteJobStore,
+    JOB_STATUS_RUNNING, JOB_STATUS_SUCCEEDED, JOB_STATUS_FAILED,
+)
+
+# ジョブ関数にはステージの進捗を記録するコールバックが渡される
+# 例: report_stage("ocr", "running") / report_stage("ocr", "succeeded")
+StageReporter = Callable[[str, str], None]
+
+
+class JobWorker:
+    """
+    ジョブをバックグラウンドで実行するワーカー
+    同時実行数を超えたジョブはキューで待機する
+    """
+
+    def __init__(self, store: JobStore, max_concurrency: int = 2) -> None:
+        self.store = store
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="job-worker")
+
+    def submit(self, job_type: str, job_func: Callable[[StageReporter], Any]) -> dict:
+        """
+        ジョブを登録してキューに積み、すぐにジョブ情報を返す
+        :param job_func: ステージ報告用のコールバックを受け取り、JSONシリアライズ可能な結果を返す関数
+        """
+        job = self.store.create(job_type)
+        self._executor.submit(self._run, job["job_id"], job_func)
+        return job
+
+    def _run(self, job_id: str, job_func: Callable[[StageReporter], Any]) -> None:
+        running_stages: list = []
+
+        def report_stage(stage: str, status: str) -> None:
+            logging.info(f"Job {job_id} stage {stage}: {status}")
+            if status == JOB_STATUS_RUNNING:
+                running_stages.append(stage)
+            elif stage in running_stages:
+                running_stages.remove(stage)
+            self.store.set_stage(job_id, stage, status)
+
+        self.store.set_status(job_id, JOB_STATUS_RUNNING)
+        try:
+            result = job_func(report_stage)
+        except Exception as e:
+            logging.error(f"Job {job_id} failed: {e}")
+            # 実行中だったステージを失敗として記録する
+            for stage in running_stages:
+                self.store.set_stage(job_id, stage, JOB_STATUS_FAILED)
+            self.store.set_status(job_id, JOB_STATUS_FAILED, error=str(e))
+            return
+        self.store.set_status(job_id, JOB_STATUS_SUCCEEDED, result=result)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+_job_worker: Optional[JobWorker] = None
+_job_worker_lock = threading.Lock()
+
+
+def get_job_worker() -> JobWorker:
+    """
+    プロセス全体で共有するジョブワーカーを返す
+    環境変数で設定する:
+    - JOB_STORE: "sqlite"（既定） / "memory"
+    - JOB_STORE_PATH: SQLiteファイルのパス（既定: 一時ディレクトリ配下）
+    - JOB_MAX_CONCURRENCY: 同時に実行するジョブ数（既定: 2）
+    - JOB_RETENTION_SECONDS: ジョブと結果を保持する秒数（既定: 86400。空の場合は削除しない）
+    """
+    global _job_worker
+    if _job_worker is None:
+        with _job_worker_lock:
+            if _job_worker is None:
+                retention = os.getenv("JOB_RETENTION_SECONDS", "86400")
+                retention_seconds = float(retention) if retention else None
+                if os.getenv("JOB_STORE", "sqlite").lower() == "memory":
+                    store: JobStore = MemoryJobStore(retention_seconds=retention_seconds)
+                else:
+                    store = SQLiteJobStore(os.getenv("JOB_STORE_PATH", os.path.join(
+                        tempfile.gettempdir(), "analyze_jobs.sqlite3")), retention_seconds=retention_seconds)
+                _job_worker = JobWorker(
+                    store, max_concurrency=int(os.getenv("JOB_MAX_CONCURRENCY", "2")))
+    return _job_worker
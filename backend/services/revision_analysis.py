@@ -0,0 +1,347 @@
+import copy
+import hashlib
+import json
+import logging
+import re
+from collections.abc import Mapping
+from typing import Dict, List, Optional, Tuple
+from domains.analyze_categories import Category
+from services.cache.revision_store import build_revision_key, get_revision_store
+from services.classification import (
+    classify_document, classify_document_async, classify_pages, classify_pages_async, normalize_category_name,
+)
+from utils.analyze_result_merge import PAGE_BREAK, STRING_INDEX_TYPE
+from utils.json_stream import dumps
+from utils.pdf_utils import build_pdf_page_hashes, format_page_numbers
+
+# 改訂版の差分解析
+# 同じ文書ID（document_id）の以前の解析結果とページごとの内容のハッシュを比べ、
+# 内容が変わったページだけをDocument Intelligenceで解析・分類し直して、以前の結果に統合する
+# - PDFのページのハッシュ（pypdfが必要）で一致するページはOCRも省く
+# - pypdfが使えない場合は、OCR後のページのテキストのハッシュで一致するページの分類だけを省く
+
+_PAGE_BREAK_PATTERN = re.compile(r"\s*<!-- PageBreak -->\s*")
+
+
+class RevisionPlan:
+    """
+    1回の改訂版の差分解析の状態
+    - previous: 以前の解析結果（get_revision_store の値）。ない場合はNone
+    - pdf_page_hashes: PDFのページごとのハッシュ（pypdfが使えない場合はNone）
+    - page_map: 新しいページ番号 -> 内容が同じ以前のページ番号。以前の結果と比べられない場合はNone
+    - changed_pages: 以前の結果に同じ内容のページがない（解析し直す）ページ番号
+    - ocr_pages: Document Intelligenceで解析したページ数
+    """
+
+    def __init__(self, document_id: str, previous: Optional[dict], pdf_page_hashes: Optional[List[str]]) -> None:
+        self.document_id = document_id
+        self.previous = previous
+        self.pdf_page_hashes = pdf_page_hashes
+        self.page_map: Optional[Dict[int, int]] = None
+        self.changed_pages: List[int] = []
+        self.ocr_pages = 0
+
+    def match(self, new_hashes: List[str], old_hashes: Optional[List[str]]) -> None:
+        """ページごとのハッシュを以前の結果と比べ、page_map・changed_pages を求める"""
+        if self.previous is None or old_hashes is None:
+            self.page_map = None
+            self.changed_pages = list(range(1, len(new_hashes) + 1))
+            return
+        self.page_map, self.changed_pages = match_pages(new_hashes, old_hashes)
+
+    def previous_categories(self, classification_prompt: str) -> Optional[List[Category]]:
+        """
+        以前の分類結果を、変更されていないページの新しいページ番号で返す
+        以前の結果がない・ページを対応付けられない・分類の指示が異なる場合はNone
+        """
+        if self.previous is None or self.page_map is None or \
+                self.previous.get("classification_prompt") != classification_prompt:
+            return None
+        return remap_categories(
+            [Category(**category) for category in self.previous["categories"]], self.page_map)
+
+
+def to_json_compatible(value):
+    """SDKのモデルを含む解析結果を、レスポンスと同じ規則でJSONにできる値に変換する"""
+    return json.loads(dumps(value))
+
+
+def build_text_page_hashes(pages: List[dict]) -> List[str]:
+    """OCR結果のページごとの行のテキストのハッシュを返す（ページ番号は含めない）"""
+    return [
+        hashlib.sha256("\n".join(line["content"] for line in page["lines"]).encode("utf-8")).hexdigest()
+        for page in pages
+    ]
+
+
+def match_pages(new_hashes: List[str], old_hashes: List[str]) -> Tuple[Dict[int, int], List[int]]:
+    """
+    新しいページと内容が同じ以前のページを対応付ける（ページの挿入・削除・移動にも対応する）
+    :return: (新しいページ番号 -> 以前のページ番号, 対応するページがない新しいページ番号)
+    """
+    old_pages: Dict[str, List[int]] = {}
+    for page_number, page_hash in enumerate(old_hashes, start=1):
+        old_pages.setdefault(page_hash, []).append(page_number)
+
+    page_map: Dict[int, int] = {}
+    changed_pages: List[int] = []
+    for page_number, page_hash in enumerate(new_hashes, start=1):
+        candidates = old_pages.get(page_hash)
+        if not candidates:
+            changed_pages.append(page_number)
+        elif page_number in candidates:
+            page_map[page_number] = page_number
+        else:
+            page_map[page_number] = candidates[0]
+    return page_map, changed_pages
+
+
+def remap_categories(categories: List[Category], page_map: Dict[int, int]) -> List[Category]:
+    """分類のページ番号を以前のページ番号から新しいページ番号に付け替える（変更・削除されたページは除く）"""
+    new_page_numbers: Dict[int, List[int]] = {}
+    for new_page_number, old_page_number in page_map.items():
+        new_page_numbers.setdefault(old_page_number, []).append(new_page_number)
+    return [
+        Category(
+            category=category.category,
+            page_numbers=sorted({
+                page_number
+                for old_page_number in category.page_numbers
+                for page_number in new_page_numbers.get(old_page_number, [])
+            }),
+        )
+        for category in categories
+    ]
+
+
+def _renumber(node, page_number: int):
+    if isinstance(node, dict):
+        return {
+            key: page_number if key in ("pageNumber", "page_number") and isinstance(value, int)
+            else _renumber(value, page_number)
+            for key, value in node.items()
+        }
+    if isinstance(node, list):
+        return [_renumber(item, page_number) for item in node]
+    return node
+
+
+def renumber_page(page: dict, page_number: int) -> dict:
+    """以前のページ情報を新しいページ番号に付け替える（tables・figuresの bounding_regions を含む）"""
+    if page["page_number"] == page_number:
+        return copy.deepcopy(page)
+    return _renumber(page, page_number)
+
+
+def _shift_span(span: dict, offset_delta: int) -> dict:
+    return {**span, "offset": span["offset"] + offset_delta}
+
+
+def shift_page_spans(node, offset_delta: int):
+    """
+    ページ情報（lines・figuresなど）の spans の offset を offset_delta だけずらしたコピーを返す
+    統合後のMarkdownでページの開始位置が変わるため、spans が統合後の content_markdown を指すように付け替える
+    """
+    if isinstance(node, Mapping):
+        return {
+            key: [_shift_span(span, offset_delta) for span in value] if key == "spans" and isinstance(value, list)
+            else shift_page_spans(value, offset_delta)
+            for key, value in node.items()
+        }
+    if isinstance(node, list):
+        return [shift_page_spans(item, offset_delta) for item in node]
+    return node
+
+
+def _markdown_page_starts(content_markdown: str) -> List[int]:
+    """Markdownのページごとの開始位置（split_markdown_pages で分割した各ページの先頭）を返す"""
+    return [0] + [match.end() for match in _PAGE_BREAK_PATTERN.finditer(content_markdown)]
+
+
+def split_markdown_pages(content_markdown: str, page_count: int) -> Optional[List[str]]:
+    """Markdownをページ区切りで分割する。区切りの数がページ数と一致しない場合はNone"""
+    if page_count == 0:
+        return [] if not content_markdown.strip() else None
+    markdown_pages = _PAGE_BREAK_PATTERN.split(content_markdown)
+    return markdown_pages if len(markdown_pages) == page_count else None
+
+
+def merge_revision_response(plan: RevisionPlan, partial_response: dict) -> Optional[dict]:
+    """
+    変更されたページだけの解析結果を、以前の解析結果に統合する
+    ページごとのMarkdownに分割できない場合は統合せずにNoneを返す（全ページを解析し直す）
+    """
+    previous_markdown = split_markdown_pages(
+        plan.previous["content_markdown"], len(plan.previous["pages"]))
+    partial_markdown = split_markdown_pages(
+        partial_response["content_markdown"], len(partial_response["pages"]))
+    partial_page_numbers = [page["page_number"] for page in partial_response["pages"]]
+    if previous_markdown is None or partial_markdown is None or partial_page_numbers != plan.changed_pages:
+        logging.warning(
+            f"Revision {plan.document_id}: cannot split markdown by page, analyzing all pages.")
+        return None
+
+    previous_pages = {page["page_number"]: page for page in plan.previous["pages"]}
+    previous_starts = _markdown_page_starts(plan.previous["content_markdown"])
+    partial_pages = dict(zip(partial_page_numbers, zip(
+        partial_response["pages"], partial_markdown, _markdown_page_starts(partial_response["content_markdown"]))))
+    pages, markdown_pages = [], []
+    offset = 0
+    for page_number in range(1, len(plan.pdf_page_hashes) + 1):
+        if page_number in partial_pages:
+            page, markdown, source_start = partial_pages[page_number]
+        else:
+            old_page_number = plan.page_map[page_number]
+            page = renumber_page(previous_pages[old_page_number], page_number)
+            markdown = previous_markdown[old_page_number - 1]
+            source_start = previous_starts[old_page_number - 1]
+        # spans は元の解析結果のMarkdownの位置なので、統合後のMarkdownでのページの開始位置に合わせる
+        pages.append(shift_page_spans(page, offset - source_start))
+        markdown_pages.append(markdown)
+        offset += len(markdown) + len(PAGE_BREAK)
+    return {"content_markdown": PAGE_BREAK.join(markdown_pages), "pages": pages}
+
+
+def plan_revision(document_id: str, pdf_binary: bytes, use_cache: bool = True) -> RevisionPlan:
+    """
+    以前の解析結果を読み込み、PDFのページごとのハッシュと比べる
+    use_cache=False の場合は以前の解析結果を使わない（解析結果の保存はする）
+    """
+    store = get_revision_store()
+    previous = store.get(build_revision_key(document_id)) if store is not None and use_cache else None
+    if previous is not None and previous.get("string_index_type") != STRING_INDEX_TYPE:
+        # spansのoffsetの単位が異なる解析結果とは統合できない
+        logging.info(f"Revision {document_id}: previous result uses a different string index type, ignoring it.")
+        previous = None
+    plan = RevisionPlan(document_id, previous, build_pdf_page_hashes(pdf_binary))
+    if previous is not None and plan.pdf_page_hashes is not None:
+        plan.match(plan.pdf_page_hashes, previous.get("pdf_page_hashes"))
+    logging.info(
+        f"Revision {document_id}: previous={previous is not None} changed_pages={plan.changed_pages if plan.page_map is not None else 'all'}")
+    return plan
+
+
+def _changed_pages_option(plan: RevisionPlan) -> Optional[str]:
+    """PDFのハッシュで変更されたページを特定できた場合に、Document Intelligenceの pages の指定を返す"""
+    if plan.previous is None or plan.page_map is None or plan.pdf_page_hashes is None:
+        return None
+    return format_page_numbers(plan.changed_pages)
+
+
+def _finish_ocr(plan: RevisionPlan, di_response: dict) -> dict:
+    """全ページを解析した場合は、ページのテキストのハッシュで以前の結果と対応付ける"""
+    plan.ocr_pages = len(di_response["pages"])
+    plan.match(build_text_page_hashes(di_response["pages"]),
+               plan.previous.get("text_page_hashes") if plan.previous else None)
+    return di_response
+
+
+def analyze_revision_ocr(document_intelligence_service, plan: RevisionPlan, pdf_binary: bytes, use_cache: bool = True) -> dict:
+    """
+    変更されたページだけをDocument Intelligenceで解析し、以前の解析結果に統合する
+    :param document_intelligence_service: AzureAIDocumentIntelligenceService
+    :return: analyze_document と同じ形式の解析結果
+    """
+    pages = _changed_pages_option(plan)
+    if pages is not None:
+        partial_response = document_intelligence_service.analyze_document(
+            pdf_binary, use_cache=use_cache, pages=pages) if pages else {"content_markdown": "", "pages": []}
+        di_response = merge_revision_response(plan, partial_response)
+        if di_response is not None:
+            plan.ocr_pages = len(plan.changed_pages)
+            return di_response
+    return _finish_ocr(plan, document_intelligence_service.analyze_document(pdf_binary, use_cache=use_cache))
+
+
+async def analyze_revision_ocr_async(document_intelligence_service, plan: RevisionPlan, pdf_binary: bytes, use_cache: bool = True) -> dict:
+    """
+    analyze_revision_ocr の非同期版
+    :param document_intelligence_service: AsyncAzureAIDocumentIntelligenceService
+    """
+    pages = _changed_pages_option(plan)
+    if pages is not None:
+        partial_response = await document_intelligence_service.analyze_document(
+            pdf_binary, use_cache=use_cache, pages=pages) if pages else {"content_markdown": "", "pages": []}
+        di_response = merge_revision_response(plan, partial_response)
+        if di_response is not None:
+            plan.ocr_pages = len(plan.changed_pages)
+            return di_response
+    return _finish_ocr(plan, await document_intelligence_service.analyze_document(pdf_binary, use_cache=use_cache))
+
+
+def classify_revision(azure_openai_service, classification_prompt: str, di_response: dict, plan: RevisionPlan) -> List[Category]:
+    """
+    変更されたページだけを分類し、以前の分類結果に統合する
+    以前の分類結果を使えない場合は、ドキュメント全体を分類する
+    :param azure_openai_service: AzureOpenAIChatService
+    """
+    previous_categories = plan.previous_categories(classification_prompt)
+    if previous_categories is None:
+        return classify_document(azure_openai_service, classification_prompt, di_response)
+    return classify_pages(
+        azure_openai_service, classification_prompt, di_response, plan.changed_pages, previous_categories)
+
+
+async def classify_revision_async(azure_openai_service, classification_prompt: str, di_response: dict, plan: RevisionPlan) -> List[Category]:
+    """
+    classify_revision の非同期版
+    :param azure_openai_service: AsyncAzureOpenAIChatService
+    """
+    previous_categories = plan.previous_categories(classification_prompt)
+    if previous_categories is None:
+        return await classify_document_async(azure_openai_service, classification_prompt, di_response)
+    return await classify_pages_async(
+        azure_openai_service, classification_prompt, di_response, plan.changed_pages, previous_categories)
+
+
+def summarize_revision(plan: RevisionPlan, classification_prompt: str, categories: List[Category]) -> dict:
+    """
+    レスポンスに含める差分解析の結果を返す
+    - changed_pages: 解析し直したページ番号（以前の結果と比べられない場合は全ページ）
+    - affected_categories: 変更されたページを含む、またはページ番号が変わった分類（抽出し直しが必要な分類）
+    - removed_categories: 以前の結果にあって、新しい結果にない分類
+    """
+    previous_categories = plan.previous_categories(classification_prompt)
+    if previous_categories is None and plan.previous is not None and plan.page_map is not None:
+        # 分類の指示が変わった場合も、ページ番号の変化で影響を判定する
+        previous_categories = remap_categories(
+            [Category(**category) for category in plan.previous["categories"]], plan.page_map)
+    previous_pages = {
+        normalize_category_name(category.category): set(category.page_numbers)
+        for category in previous_categories or []
+    }
+    changed_pages = set(plan.changed_pages)
+    current_names = {normalize_category_name(category.category) for category in categories}
+    return {
+        "document_id": plan.document_id,
+        "mode": "incremental" if plan.page_map is not None else "full",
+        "page_count": len(plan.changed_pages) + len(plan.page_map or {}),
+        "changed_pages": plan.changed_pages,
+        "reused_pages": len(plan.page_map or {}),
+        "ocr_pages": plan.ocr_pages,
+        "affected_categories": [
+            category.category for category in categories
+            if changed_pages & set(category.page_numbers)
+            or previous_pages.get(normalize_category_name(category.category)) != set(category.page_numbers)
+        ],
+        "removed_categories": [
+            category["category"] for category in (plan.previous or {}).get("categories", [])
+            if normalize_category_name(category["category"]) not in current_names
+        ],
+    }
+
+
+def save_revision(plan: RevisionPlan, classification_prompt: str, categories: List[Category], di_response: dict) -> None:
+    """次の改訂版と比べるため、解析結果を文書IDごとに保存する"""
+    store = get_revision_store()
+    if store is None:
+        return
+    store.set(build_revision_key(plan.document_id), {
+        "classification_prompt": classification_prompt,
+        "string_index_type": STRING_INDEX_TYPE,
+        "pdf_page_hashes": plan.pdf_page_hashes,
+        "text_page_hashes": build_text_page_hashes(di_response["pages"]),
+        "categories": [category.dict() for category in categories],
+        "content_markdown": di_response["content_markdown"],
+        "pages": to_json_compatible(di_response["pages"]),
+    })
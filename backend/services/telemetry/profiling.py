@@ -0,0 +1,98 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Dict, Optional
+
+# プロファイリングを許可するかどうか（本番では無効のままにする）
+PROFILING_ENABLED = os.getenv(
+    "PROFILING_ENABLED", "false").lower() in ("true", "1", "yes")
+# cProfileの結果（.prof）を保存するディレクトリ。未設定の場合はログにだけ出力する
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+# プロファイリングを要求するリクエストヘッダー。値は cpu / memory / cpu,memory
+PROFILE_HEADER = "X-Profile"
+PROFILE_TOP_N = 30
+
+# cProfile・tracemallocはプロセス全体で1つしか動かせないため、同時に1リクエストだけ計測する
+_profiling_lock = threading.Lock()
+
+
+class RequestProfiler:
+    """
+    1リクエスト分のcProfile（CPU）・tracemalloc（メモリ）の計測
+    非同期のルートでは、同じイベントループ上で並行して処理された他のリクエストの処理も含まれる
+    """
+
+    def __init__(self, name: str, cpu: bool, memory: bool) -> None:
+        self.name = name
+        self.profile = cProfile.Profile() if cpu else None
+        self.memory = memory
+        self.started = time.strftime("%Y%m%d-%H%M%S")
+
+    def start(self) -> None:
+        if self.memory:
+            tracemalloc.start()
+        if self.profile is not None:
+            self.profile.enable()
+
+    def stop(self) -> Dict[str, str]:
+        """計測を終了して結果をログに出力し、レスポンスヘッダーに含める値を返す"""
+        headers: Dict[str, str] = {}
+        try:
+            if self.profile is not None:
+                self.profile.disable()
+                stream = io.StringIO()
+                pstats.Stats(self.profile, stream=stream).sort_stats(
+                    "cumulative").print_stats(PROFILE_TOP_N)
+                logging.info(f"cProfile ({self.name}):\n{stream.getvalue()}")
+                if PROFILE_DIR:
+                    os.makedirs(PROFILE_DIR, exist_ok=True)
+                    path = os.path.join(
+                        PROFILE_DIR, f"{self.name}-{self.started}-{os.getpid()}.prof")
+                    self.profile.dump_stats(path)
+                    headers["X-Profile-Path"] = path
+            if self.memory:
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                top = "\n".join(
+                    str(stat) for stat in snapshot.statistics("lineno")[:PROFILE_TOP_N])
+                logging.info(
+                    f"tracemalloc ({self.name}): current={current} peak={peak}\n{top}")
+                headers["X-Profile-Peak-Memory"] = str(peak)
+        finally:
+            _profiling_lock.release()
+        return headers
+
+
+def start_request_profiler(name: str, headers) -> Optional[RequestProfiler]:
+    """
+    PROFILING_ENABLED が有効で、リクエストに X-Profile ヘッダーがある場合に計測を開始する
+    他のリクエストを計測中の場合は計測しない
+    """
+    if not PROFILING_ENABLED:
+        return None
+    modes = {mode.strip().lower()
+             for mode in (headers.get(PROFILE_HEADER) or "").split(",") if mode.strip()}
+    if not modes & {"cpu", "memory"}:
+        return None
+    if not _profiling_lock.acquire(blocking=False):
+        logging.warning(
+            f"Profiling for {name} skipped: another request is being profiled.")
+        return None
+    profiler = RequestProfiler(
+        name, cpu="cpu" in modes, memory="memory" in modes)
+    try:
+        profiler.start()
+    except Exception as e:
+        # 他のプロファイラが動いている場合など
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        _profiling_lock.release()
+        logging.warning(f"Profiling for {name} could not be started: {e}")
+        return None
+    return profiler
@@ -0,0 +1,171 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+from typing import Dict, Optional
+from utils.token_estimator import count_text_tokens
+
+# 1回のAzure OpenAI呼び出しで送るプロンプトのトークン上限（0で無効）
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "0"))
+# 上限を超えた場合の動作。trim: ドキュメント内容を減らして送る / reject: 送信せずにエラーにする
+PROMPT_BUDGET_ACTION = os.getenv("PROMPT_BUDGET_ACTION", "trim").lower()
+# レスポンスヘッダーにトークン数を含めるかどうか
+TOKEN_USAGE_HEADERS = os.getenv(
+    "TOKEN_USAGE_HEADERS", "false").lower() in ("true", "1", "yes")
+
+_USAGE_KEYS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+class PromptBudgetExceededError(ValueError):
+    """プロンプトがトークン上限を超えたため、送信せずに中断したことを表す"""
+
+    def __init__(self, stage: str, prompt_tokens: int, budget: int) -> None:
+        super().__init__(
+            f"Prompt for {stage} has {prompt_tokens} tokens, exceeding the budget of {budget} tokens.")
+        self.stage = stage
+        self.prompt_tokens = prompt_tokens
+        self.budget = budget
+
+
+class TokenAccount:
+    """
+    1リクエスト分のトークン数を集計する
+    - sections: プロンプトの構成要素（markdown・pages・categoriesなど）ごとのトークン数
+    - estimated_prompt_tokens: 送信前に数えたプロンプトのトークン数
+    - prompt_tokens / completion_tokens / cached_tokens: レスポンスのusageの値
+    並列に実行される呼び出しから記録されるため、スレッドセーフにする
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.estimated_prompt_tokens = 0
+        self.sections: Dict[str, int] = {}
+        self.usage: Dict[str, int] = {key: 0 for key in _USAGE_KEYS}
+        self.stages: Dict[str, dict] = {}
+
+    def _stage(self, stage: str) -> dict:
+        return self.stages.setdefault(stage, {
+            "calls": 0, "estimated_prompt_tokens": 0, **{key: 0 for key in _USAGE_KEYS}})
+
+    def record_sections(self, sections: Dict[str, int]) -> None:
+        """プロンプトの構成要素ごとのトークン数を加算する"""
+        with self._lock:
+            for name, tokens in sections.items():
+                self.sections[name] = self.sections.get(name, 0) + tokens
+
+    def record_call(self, stage: str, estimated_prompt_tokens: int, usage: Optional[dict]) -> None:
+        """1回の呼び出しの、送信前のトークン数とレスポンスのusageを加算する"""
+        with self._lock:
+            stage_totals = self._stage(stage)
+            self.calls += 1
+            stage_totals["calls"] += 1
+            self.estimated_prompt_tokens += estimated_prompt_tokens
+            stage_totals["estimated_prompt_tokens"] += estimated_prompt_tokens
+            for key in _USAGE_KEYS:
+                value = (usage or {}).get(key, 0)
+                self.usage[key] += value
+                stage_totals[key] += value
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "estimated_prompt_tokens": self.estimated_prompt_tokens,
+                **self.usage,
+                "sections": dict(self.sections),
+                "stages": {stage: dict(totals) for stage, totals in self.stages.items()},
+            }
+
+    def response_headers(self) -> Dict[str, str]:
+        """レスポンスヘッダーに含めるトークン数"""
+        summary = self.summary()
+        return {
+            "X-Token-Estimated-Prompt": str(summary["estimated_prompt_tokens"]),
+            "X-Token-Prompt": str(summary["prompt_tokens"]),
+            "X-Token-Completion": str(summary["completion_tokens"]),
+            "X-Token-Cached": str(summary["cached_tokens"]),
+            "X-Token-Sections": ", ".join(
+                f"{name}={tokens}" for name, tokens in summary["sections"].items()),
+        }
+
+
+_current_account: contextvars.ContextVar[Optional[TokenAccount]] = contextvars.ContextVar(
+    "token_account", default=None)
+
+
+def start_token_account() -> TokenAccount:
+    """
+    現在のリクエストのトークン集計を開始する
+    asyncioのタスクには自動で引き継がれる。スレッドプールで実行する場合は contextvars.copy_context() を使うこと
+    """
+    account = TokenAccount()
+    _current_account.set(account)
+    return account
+
+
+def current_token_account() -> Optional[TokenAccount]:
+    return _current_account.get()
+
+
+def count_prompt_sections(sections: Dict[str, str]) -> Dict[str, int]:
+    """プロンプトの構成要素ごとのトークン数を数え、現在のリクエストの集計に加算する"""
+    counts = {name: count_text_tokens(text) for name, text in sections.items()}
+    account = current_token_account()
+    if account is not None:
+        account.record_sections(counts)
+    return counts
+
+
+def trim_budget_for(fixed_tokens: int) -> Optional[int]:
+    """
+    上限を超えた場合に削るドキュメント内容に使えるトークン数を返す
+    上限が無効、または PROMPT_BUDGET_ACTION が trim でない場合はNoneを返す
+    :param fixed_tokens: 削れない部分（指示・ページ内容など）のトークン数
+    """
+    if PROMPT_TOKEN_BUDGET <= 0 or PROMPT_BUDGET_ACTION != "trim":
+        return None
+    return max(PROMPT_TOKEN_BUDGET - fixed_tokens, 0)
+
+
+def check_prompt_budget(stage: str, prompt_tokens: int) -> None:
+    """
+    送信前のプロンプトのトークン数が上限を超えていれば PromptBudgetExceededError を送出する
+    """
+    if PROMPT_TOKEN_BUDGET > 0 and prompt_tokens > PROMPT_TOKEN_BUDGET:
+        logging.warning(json.dumps({
+            "event": "prompt_budget_exceeded",
+            "stage": stage,
+            "prompt_tokens": prompt_tokens,
+            "budget": PROMPT_TOKEN_BUDGET,
+        }))
+        raise PromptBudgetExceededError(stage, prompt_tokens, PROMPT_TOKEN_BUDGET)
+
+
+def record_token_usage(stage: str, deployment_name: str, estimated_prompt_tokens: int, usage: Optional[dict]) -> None:
+    """1回の呼び出しのトークン数を構造化ログに出力し、現在のリクエストの集計に加算する"""
+    logging.info(json.dumps({
+        "event": "token_usage",
+        "stage": stage,
+        "deployment": deployment_name,
+        "estimated_prompt_tokens": estimated_prompt_tokens,
+        **(usage or {}),
+    }))
+    account = current_token_account()
+    if account is not None:
+        account.record_call(stage, estimated_prompt_tokens, usage)
+
+
+def log_token_summary(route: str, account: TokenAccount) -> None:
+    """リクエスト全体のトークン数を構造化ログに出力する"""
+    logging.info(json.dumps(
+        {"event": "token_summary", "route": route, **account.summary()}, ensure_ascii=False))
+
+
+def apply_token_headers(response, account: TokenAccount):
+    """TOKEN_USAGE_HEADERS が有効な場合、トークン数をレスポンスヘッダーに追加する"""
+    if TOKEN_USAGE_HEADERS:
+        for name, value in account.response_headers().items():
+            response.headers[name] = value
+    return response
@@ -0,0 +1,229 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+from services.telemetry.profiling import start_request_profiler
+
+try:
+    # OpenTelemetryがインストールされている場合は、同じスパンをOTLPでも出力できる（任意の依存）
+    from opentelemetry import trace as otel_trace
+except ImportError:  # pragma: no cover
+    otel_trace = None
+
+# OTLP/HTTPのエクスポート先（例: http://localhost:4318/v1/traces）。未設定の場合はOpenTelemetryに出力しない
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "data-viewer-tool")
+
+_SERVER_TIMING_NAME_PATTERN = re.compile(r"[^A-Za-z0-9_.\-]")
+
+
+class Trace:
+    """
+    1リクエスト分のスパン（ステージごとの所要時間）を記録する
+    並列に実行されるステージ（シャード・分類ごとの抽出など）から記録されるため、スレッドセーフにする
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans: List[dict] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, span: dict) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def stage_durations(self) -> Dict[str, dict]:
+        """スパン名ごとの合計時間（ミリ秒）と回数。並列に実行されたスパンは合計が経過時間を超えることがある"""
+        with self._lock:
+            spans = list(self.spans)
+        durations: Dict[str, dict] = {}
+        for span in spans:
+            stage = durations.setdefault(
+                span["name"], {"duration_ms": 0.0, "count": 0})
+            stage["duration_ms"] += span["duration_ms"]
+            stage["count"] += 1
+        return durations
+
+    def server_timing(self) -> str:
+        """Server-Timingヘッダーの値を返す"""
+        entries = []
+        for name, stage in self.stage_durations().items():
+            entry = f"{_SERVER_TIMING_NAME_PATTERN.sub('_', name)};dur={stage['duration_ms']:.1f}"
+            if stage["count"] > 1:
+                entry += f';desc="{stage["count"]} calls"'
+            entries.append(entry)
+        entries.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(entries)
+
+    def log(self, status_code: Optional[int] = None) -> None:
+        """スパンを構造化ログに出力する"""
+        with self._lock:
+            spans = list(self.spans)
+        logging.info(json.dumps({
+            "event": "trace",
+            "route": self.name,
+            "status_code": status_code,
+            "duration_ms": round(self.elapsed_ms(), 1),
+            "spans": spans,
+        }, ensure_ascii=False, default=str))
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar(
+    "trace", default=None)
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "trace_span", default=None)
+
+_otel_tracer = None
+_otel_tracer_lock = threading.Lock()
+
+
+def _get_otel_tracer():
+    """TRACING_OTLP_ENDPOINT が設定されていて、OpenTelemetryのSDKが使える場合にトレーサーを返す"""
+    global _otel_tracer
+    if otel_trace is None or not TRACING_OTLP_ENDPOINT:
+        return None
+    if _otel_tracer is None:
+        with _otel_tracer_lock:
+            if _otel_tracer is None:
+                try:
+                    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+                    from opentelemetry.sdk.resources import Resource
+                    from opentelemetry.sdk.trace import TracerProvider
+                    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+                except ImportError as e:
+                    logging.warning(
+                        f"OpenTelemetry exporter is not available: {e}")
+                    return None
+                provider = TracerProvider(resource=Resource.create(
+                    {"service.name": TRACING_SERVICE_NAME}))
+                provider.add_span_processor(BatchSpanProcessor(
+                    OTLPSpanExporter(endpoint=TRACING_OTLP_ENDPOINT)))
+                _otel_tracer = provider.get_tracer(__name__)
+    return _otel_tracer
+
+
+def start_trace(name: str) -> Trace:
+    """現在のリクエストのトレースを開始する"""
+    trace = Trace(name)
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes) -> Iterator[dict]:
+    """
+    ステージの所要時間を計測する
+    with span("ocr"): ... のように使い、トレースが開始されていない場合は何もしない
+    yieldした辞書に値を入れると、スパンの属性として記録される
+    """
+    trace = current_trace()
+    if trace is None:
+        yield attributes
+        return
+
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    tracer = _get_otel_tracer()
+    otel_span = tracer.start_as_current_span(
+        name, attributes={key: str(value) for key, value in attributes.items()}) if tracer else contextlib.nullcontext()
+    started = time.perf_counter()
+    error = None
+    try:
+        with otel_span:
+            yield attributes
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        record = {
+            "name": name,
+            "parent": parent,
+            "start_ms": round((started - trace.started) * 1000, 1),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        if attributes:
+            record["attributes"] = attributes
+        if error:
+            record["error"] = error
+        trace.add_span(record)
+
+
+def traced(name: str):
+    """関数全体を1つのスパンとして計測するデコレータ（同期・非同期の両方に対応）"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _finish_route_trace(trace: Trace, response, profile_headers: Optional[Dict[str, str]]):
+    """トレースをログに出力し、Server-Timingヘッダーとプロファイルの結果をレスポンスに追加する"""
+    trace.log(getattr(response, "status_code", None))
+    if response is not None:
+        response.headers["Server-Timing"] = trace.server_timing()
+        for header, value in (profile_headers or {}).items():
+            response.headers[header] = value
+    return response
+
+
+def traced_route(name: str):
+    """
+    HTTPルートのデコレータ
+    リクエストごとにトレースを開始し、ステージごとの所要時間をServer-Timingヘッダーと構造化ログに出力する
+    PROFILING_ENABLED が有効な場合は、X-Profile ヘッダーでそのリクエストだけcProfile・tracemallocで計測する
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(req, *args, **kwargs):
+                trace = start_trace(name)
+                profiler = start_request_profiler(name, req.headers)
+                response = None
+                try:
+                    response = await func(req, *args, **kwargs)
+                finally:
+                    profile_headers = profiler.stop() if profiler else None
+                    _finish_route_trace(trace, response, profile_headers)
+                return response
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(req, *args, **kwargs):
+            trace = start_trace(name)
+            profiler = start_request_profiler(name, req.headers)
+            response = None
+            try:
+                response = func(req, *args, **kwargs)
+            finally:
+                profile_headers = profiler.stop() if profiler else None
+                _finish_route_trace(trace, response, profile_headers)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,109 @@
+"""
+インスタンスのウォームアップ
+
+function_app はルートモジュールを最初の呼び出し時に読み込むため、そのままでは最初のリクエストが
+SDKの読み込みとクライアントの生成を待つことになる。常時起動・事前に追加されるインスタンスでは、
+リクエストを受ける前にここで済ませておく。
+- warmup トリガー（Premium・専用プラン）: warm_up_async
+- 環境変数 WARMUP_ON_LOAD=true: 読み込み直後にバックグラウンドのスレッドで warm_up
+このモジュール自体は、起動時に読み込まれても重い依存関係を読み込まない。
+"""
+import asyncio
+import importlib
+import json
+import logging
+import os
+import time
+
+# 先に読み込んでおくルートモジュール
+ROUTE_MODULES = [
+    "routes.analyze_document",
+    "routes.analyze_batch",
+    "routes.extraction_category",
+    "routes.extraction_category_stream",
+    "routes.extraction_categories",
+    "routes.extraction_cache",
+    "routes.analyze_jobs",
+    "routes.metrics",
+]
+# ルートが使用するAzure OpenAIのAPIバージョン（クライアントはAPIバージョンごとに共有される）
+AZURE_OPENAI_API_VERSION = "2025-01-01-preview"
+
+
+def import_route_modules() -> None:
+    for module in ROUTE_MODULES:
+        importlib.import_module(module)
+
+
+def build_clients() -> list:
+    """環境変数にエンドポイントが設定されているサービスの、共有クライアントを生成する"""
+    from services.azure.client_registry import get_document_intelligence_client, get_openai_client
+    built = []
+    if os.getenv("AZURE_OPENAI_ENDPOINT") and os.getenv("AZURE_OPENAI_API_KEY"):
+        get_openai_client(
+            endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version=AZURE_OPENAI_API_VERSION,
+        )
+        built.append("openai")
+    if os.getenv("DI_ENDPOINT") and os.getenv("DI_KEY"):
+        get_document_intelligence_client(
+            endpoint=os.getenv("DI_ENDPOINT"), api_key=os.getenv("DI_KEY"))
+        built.append("document_intelligence")
+    return built
+
+
+def build_async_clients() -> list:
+    """
+    build_clients の非同期クライアント版
+    非同期クライアントはイベントループごとに共有されるため、ルートと同じイベントループ上で呼び出すこと
+    """
+    from services.azure.client_registry import get_async_document_intelligence_client, get_async_openai_client
+    built = []
+    if os.getenv("AZURE_OPENAI_ENDPOINT") and os.getenv("AZURE_OPENAI_API_KEY"):
+        get_async_openai_client(
+            endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version=AZURE_OPENAI_API_VERSION,
+        )
+        built.append("async_openai")
+    if os.getenv("DI_ENDPOINT") and os.getenv("DI_KEY"):
+        get_async_document_intelligence_client(
+            endpoint=os.getenv("DI_ENDPOINT"), api_key=os.getenv("DI_KEY"))
+        built.append("async_document_intelligence")
+    return built
+
+
+def _log_warm_up(started: float, clients: list) -> dict:
+    summary = {
+        "event": "warmup",
+        "modules": len(ROUTE_MODULES),
+        "clients": clients,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    logging.info(json.dumps(summary))
+    return summary
+
+
+def warm_up() -> dict:
+    """ルートモジュールを読み込み、同期クライアントを生成する。失敗してもリクエストの処理には影響させない"""
+    started = time.perf_counter()
+    clients = []
+    try:
+        import_route_modules()
+        clients = build_clients()
+    except Exception as e:
+        logging.warning(f"Warm-up failed: {e}")
+    return _log_warm_up(started, clients)
+
+
+async def warm_up_async() -> dict:
+    """warm_up の非同期版。モジュールの読み込みはスレッドで行い、非同期クライアントはこのイベントループ上で生成する"""
+    started = time.perf_counter()
+    clients = []
+    try:
+        await asyncio.to_thread(import_route_modules)
+        clients = await asyncio.to_thread(build_clients) + build_async_clients()
+    except Exception as e:
+        logging.warning(f"Warm-up failed: {e}")
+    return _log_warm_up(started, clients)
@@ -0,0 +1,105 @@
+"""
+extraction_category(ies) のリクエストの pages の検証・保持のベンチマーク
+
+1,000ページ（1ページ40行・ポリゴン8点・spans付き、テーブル・図あり）の合成ドキュメントで、
+旧実装（pydanticの List[Page]。行は List[Dict[str, Any]]）と現在の実装（domains.document_model.DocumentPages）の
+検証時間・保持するメモリ（tracemalloc。入力のJSONを解放した後の使用量）・全ページのテキスト取得時間を比較する。
+
+実行方法（backendディレクトリで）:
+    python test/benchmark/bench_document_model.py [--pages 1000] [--repeat 3]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from domains.analyze_categories import Page  # noqa: E402
+from domains.document_model import DocumentPages  # noqa: E402
+from utils.lines_to_context import lines_to_context  # noqa: E402
+
+LINES_PER_PAGE = 40
+
+
+def build_pages_json(page_count: int) -> str:
+    """analyze_document_structure のレスポンスと同じ形式の pages をJSON文字列で返す"""
+    pages = []
+    for page_number in range(1, page_count + 1):
+        region = {"pageNumber": page_number, "polygon": [1.0, 1.0, 4.0, 1.0, 4.0, 3.0, 1.0, 3.0]}
+        pages.append({
+            "page_number": page_number,
+            "width": 8.5,
+            "height": 11.0,
+            "lines": [
+                {
+                    "content": f"ページ{page_number}の{i}行目の本文テキスト",
+                    "polygon": [1.0, 2.0 + i, 6.5, 2.0 + i, 6.5, 2.2 + i, 1.0, 2.2 + i],
+                    "spans": [{"offset": page_number * 1000 + i * 20, "length": 18}],
+                }
+                for i in range(LINES_PER_PAGE)
+            ],
+            "tables": [{
+                "row_count": 2,
+                "column_count": 2,
+                "cells": [
+                    {"row_index": row, "column_index": column, "content": f"{row}-{column}", "bounding_regions": [region]}
+                    for row in range(2) for column in range(2)
+                ],
+            }],
+            "figures": [{"id": f"{page_number}.1", "bounding_regions": [region],
+                         "spans": [{"offset": page_number * 1000, "length": 10}], "elements": []}],
+        })
+    return json.dumps(pages, ensure_ascii=False)
+
+
+def legacy_validate(pages):
+    return [Page(**page) for page in pages]
+
+
+def current_validate(pages):
+    return DocumentPages.from_pages(pages)
+
+
+def measure(validate, pages_json: str, repeat: int):
+    """(検証時間[ms], 保持するメモリ[MB], テキスト取得時間[ms]) を返す"""
+    best = float("inf")
+    for _ in range(repeat):
+        pages = json.loads(pages_json)
+        started = time.perf_counter()
+        validate(pages)
+        best = min(best, time.perf_counter() - started)
+        del pages
+
+    gc.collect()
+    tracemalloc.start()
+    pages = json.loads(pages_json)
+    validated = validate(pages)
+    del pages
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    lines_to_context(validated)
+    context_seconds = time.perf_counter() - started
+    return best * 1000, retained / (1024 * 1024), context_seconds * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pages_json = build_pages_json(args.pages)
+    print(f"✅ 合成データ: {args.pages} pages / {args.pages * LINES_PER_PAGE} lines / "
+          f"{len(pages_json.encode('utf-8')) / (1024 * 1024):.1f} MB")
+    for name, validate in (("legacy", legacy_validate), ("current", current_validate)):
+        validate_ms, retained_mb, context_ms = measure(validate, pages_json, args.repeat)
+        print(f"   {name:8s}: validate={validate_ms:8.1f} ms, retained={retained_mb:7.1f} MB, "
+              f"lines_to_context={context_ms:6.1f} ms")
@@ -0,0 +1,144 @@
+"""
+ページ組み立て処理（utils.page_assembly.assemble_pages）のベンチマーク
+
+500ページ・2,000テーブルの合成解析結果で、旧実装（ページごとに全テーブル・全図を走査し、
+テーブルのセルを丸ごと複製する実装）と処理時間・出力セル数を比較する。
+
+実行方法（backendディレクトリで）:
+    python test/benchmark/bench_page_assembly.py
+"""
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from utils.page_assembly import assemble_pages  # noqa: E402
+
+PAGE_COUNT = 500
+TABLE_COUNT = 2000
+FIGURE_COUNT = 1000
+ROWS, COLUMNS = 10, 5
+LINES_PER_PAGE = 40
+
+
+def _region(page_number):
+    return SimpleNamespace(page_number=page_number, polygon=[0.0] * 8)
+
+
+def build_synthetic_result():
+    """合成の解析結果を生成する。一部のテーブルは2ページにまたがる"""
+    pages = [
+        SimpleNamespace(
+            page_number=page_number,
+            width=8.5,
+            height=11.0,
+            lines=[
+                SimpleNamespace(content=f"line {i}", polygon=[
+                                0.0] * 8, spans=[{"offset": i, "length": 6}])
+                for i in range(LINES_PER_PAGE)
+            ],
+        )
+        for page_number in range(1, PAGE_COUNT + 1)
+    ]
+    tables = []
+    for i in range(TABLE_COUNT):
+        first_page = i % PAGE_COUNT + 1
+        # 10テーブルに1つは次ページにまたがる
+        spans_two_pages = i % 10 == 0 and first_page < PAGE_COUNT
+        cells = []
+        for row in range(ROWS):
+            page_number = first_page + 1 if spans_two_pages and row >= ROWS // 2 else first_page
+            for column in range(COLUMNS):
+                cells.append(SimpleNamespace(
+                    row_index=row,
+                    column_index=column,
+                    content=f"{row}-{column}",
+                    bounding_regions=[_region(page_number)],
+                ))
+        regions = [_region(first_page)]
+        if spans_two_pages:
+            regions.append(_region(first_page + 1))
+        tables.append(SimpleNamespace(
+            row_count=ROWS, column_count=COLUMNS, cells=cells, bounding_regions=regions))
+    figures = [
+        SimpleNamespace(id=f"{i % PAGE_COUNT + 1}.{i}", bounding_regions=[_region(i % PAGE_COUNT + 1)],
+                        spans=[], elements=[])
+        for i in range(FIGURE_COUNT)
+    ]
+    return SimpleNamespace(content="", pages=pages, tables=tables, figures=figures)
+
+
+def legacy_assemble_pages(result):
+    """旧実装: O(pages × (tables + figures))、テーブルの全セルを領域ごとに複製"""
+    pages = []
+    for page in result.pages:
+        page_data = {
+            "page_number": page.page_number,
+            "width": page.width,
+            "height": page.height,
+            "lines": [],
+            "tables": [],
+            "figures": [],
+        }
+        if page.lines:
+            for line in page.lines:
+                page_data["lines"].append({
+                    "content": line.content,
+                    "polygon": getattr(line, "polygon", []),
+                    "spans": getattr(line, "spans", []),
+                })
+        for table in result.tables:
+            for region in table.bounding_regions:
+                if region.page_number == page.page_number:
+                    page_data["tables"].append({
+                        "row_count": table.row_count,
+                        "column_count": table.column_count,
+                        "cells": [
+                            {
+                                "row_index": cell.row_index,
+                                "column_index": cell.column_index,
+                                "content": cell.content,
+                                "bounding_regions": cell.bounding_regions,
+                            }
+                            for cell in table.cells
+                        ],
+                    })
+        for figure in result.figures:
+            for region in figure.bounding_regions:
+                if region.page_number == page.page_number:
+                    page_data["figures"].append({
+                        "id": figure.id,
+                        "bounding_regions": figure.bounding_regions,
+                        "spans": figure.spans,
+                        "elements": figure.elements,
+                    })
+        pages.append(page_data)
+    return pages
+
+
+def measure(func, result, repeat=3):
+    best = float("inf")
+    pages = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        pages = func(result)
+        best = min(best, time.perf_counter() - started)
+    cell_count = sum(len(table["cells"])
+                     for page in pages for table in page["tables"])
+    return best, cell_count
+
+
+if __name__ == "__main__":
+    result = build_synthetic_result()
+    print(
+        f"✅ 合成データ: {PAGE_COUNT} pages / {TABLE_COUNT} tables / {FIGURE_COUNT} figures")
+
+    legacy_seconds, legacy_cells = measure(legacy_assemble_pages, result)
+    new_seconds, new_cells = measure(assemble_pages, result)
+
+    print(f"   legacy : {legacy_seconds * 1000:8.1f} ms, cells={legacy_cells}")
+    print(f"   current: {new_seconds * 1000:8.1f} ms, cells={new_cells}")
+    print(f"   speedup: {legacy_seconds / new_seconds:.1f}x")
@@ -0,0 +1,127 @@
+"""
+analyze_document_structure のレスポンス作成（シリアライズ・圧縮）のベンチマーク
+
+合成の解析結果（行の spans・図の bounding_regions はSDKのモデルと同じ Mapping）で、
+旧実装（pydanticのモデルで全体を検証し、.dict() → json.dumps(default=str) → 圧縮）と
+現在の実装（routes.analyze_document.build_analyze_response: ページ単位でシリアライズしながら圧縮）の
+処理時間とピークメモリ（tracemalloc）を、ページ数を変えて比較する。
+現在の実装のピークメモリは、ページ数が増えても出力（圧縮後のボディ）の分しか増えない。
+
+実行方法（backendディレクトリで）:
+    python test/benchmark/bench_response_serialization.py [--pages 100,400,1600] [--encoding gzip]
+"""
+import argparse
+import html
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections.abc import Mapping
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import azure.functions as func  # noqa: E402
+from domains.analyze_categories import AnalyzeDocStructureResponseData, Category  # noqa: E402
+from routes.analyze_document import build_analyze_response  # noqa: E402
+from utils.http_compression import compress_body  # noqa: E402
+from utils.json_stream import orjson  # noqa: E402
+
+LINES_PER_PAGE = 40
+
+
+class _Model(Mapping):
+    """Document IntelligenceのSDKのモデルの代わり（Mappingだがdictではない）"""
+
+    def __init__(self, **values):
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __str__(self):
+        return str(self._values)
+
+
+def build_synthetic_response(page_count: int):
+    pages = [
+        {
+            "page_number": page_number,
+            "width": 8.5,
+            "height": 11.0,
+            "lines": [
+                {
+                    "content": f"ページ{page_number}の{i}行目 <注記> & 本文",
+                    "polygon": [1.0, 2.0, 3.0, 2.0, 3.0, 2.5, 1.0, 2.5],
+                    "spans": [_Model(offset=i * 30, length=28)],
+                }
+                for i in range(LINES_PER_PAGE)
+            ],
+            "tables": [],
+            "figures": [{
+                "id": f"{page_number}.1",
+                "bounding_regions": [_Model(pageNumber=page_number, polygon=[1.0, 1.0, 4.0, 1.0, 4.0, 3.0, 1.0, 3.0])],
+                "spans": [_Model(offset=0, length=10)],
+                "elements": [],
+            }],
+        }
+        for page_number in range(1, page_count + 1)
+    ]
+    markdown = "\n<!-- PageBreak -->\n".join(
+        "\n".join(line["content"] for line in page["lines"]) for page in pages)
+    categories = [Category(category="本文", page_numbers=list(range(1, page_count + 1)))]
+    return categories, {"content_markdown": markdown, "pages": pages}
+
+
+def legacy_build_response(categories, di_response, accept_encoding):
+    """旧実装: 全体をpydanticで検証し、辞書・JSON文字列・バイト列・圧縮後のボディを順に作る"""
+    response_data = AnalyzeDocStructureResponseData(
+        categories=categories,
+        content_markdown=html.escape(di_response["content_markdown"]),
+        pages=di_response["pages"],
+    )
+    body = json.dumps(
+        response_data.dict(),
+        ensure_ascii=False,
+        default=lambda o: o.dict() if hasattr(o, 'dict') else str(o)
+    ).encode("utf-8")
+    return compress_body(body, accept_encoding)[0]
+
+
+def current_build_response(categories, di_response, accept_encoding):
+    req = func.HttpRequest(method="POST", url="/api/analyze_document_structure", body=b"",
+                           headers={"Accept-Encoding": accept_encoding})
+    return build_analyze_response(categories, di_response, req).get_body()
+
+
+def measure(build, categories, di_response, accept_encoding):
+    """(処理時間[ms], ピークメモリ[MB], ボディのサイズ[KB]) を返す"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    body = build(categories, di_response, accept_encoding)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed * 1000, peak / (1024 * 1024), len(body) / 1024
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", default="100,400,1600")
+    parser.add_argument("--encoding", default="gzip", help="Accept-Encoding（identity で圧縮なし）")
+    args = parser.parse_args()
+
+    print(f"✅ JSONバックエンド: {'orjson' if orjson is not None else 'json'} / Accept-Encoding: {args.encoding}")
+    for page_count in [int(value) for value in args.pages.split(",")]:
+        categories, di_response = build_synthetic_response(page_count)
+        for name, build in (("legacy", legacy_build_response), ("current", current_build_response)):
+            elapsed_ms, peak_mb, size_kb = measure(build, categories, di_response, args.encoding)
+            print(f"   {page_count:5d} pages {name:8s}: {elapsed_ms:8.1f} ms, "
+                  f"peak={peak_mb:7.1f} MB, body={size_kb:8.1f} KB")
@@ -0,0 +1,217 @@
+"""
+analyze_document_structure・extraction_categories のオフラインベンチマーク
+
+Document Intelligence・Azure OpenAIを記録済みのレスポンスを再生する代替実装（fakes.py）に差し替え、
+両ルートをプロセス内で実行する。ネットワークには接続しない。
+ドキュメントの大きさ（small / medium / large）ごとに、以下を計測する:
+- 経過時間（Server-Timingヘッダーのステージごとの所要時間を含む）
+- ピークメモリ（tracemalloc）
+- ペイロードサイズ（リクエスト・レスポンス・Document Intelligenceの解析結果・プロンプトの構成要素ごとのトークン数）
+
+実行方法（backendディレクトリで）:
+    python test/benchmark/bench_routes.py [--sizes small,medium] [--repeat 3] [--output results.json]
+    python test/benchmark/bench_routes.py --baseline results.json --max-regression 1.25
+--baseline を指定すると、いずれかの経過時間（中央値）が基準の max-regression 倍を超えた場合に終了コード1で終了する（CI用）
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..")))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+import azure.functions as func  # noqa: E402
+from fakes import FaultInjector, build_synthetic_document, install_fakes  # noqa: E402
+from routes.analyze_document import analyze_document_structure_route_async  # noqa: E402
+from routes.extraction_categories import extraction_categories_route_async  # noqa: E402
+from services.telemetry import token_accounting  # noqa: E402
+
+# 記録済みドキュメント（23ページ）を繰り返す回数
+SIZES = {"small": 1, "medium": 5, "large": 20}
+# Document IntelligenceはPDFの中身を見ないため、ペイロードの大きさだけを模擬する
+PDF_BYTES_PER_PAGE = 50_000
+
+
+def parse_server_timing(value: str) -> dict:
+    """Server-Timingヘッダーを {ステージ名: ミリ秒} に変換する"""
+    stages = {}
+    for entry in filter(None, (part.strip() for part in (value or "").split(","))):
+        name, *params = entry.split(";")
+        for param in params:
+            if param.startswith("dur="):
+                stages[name] = float(param[4:])
+    return stages
+
+
+def parse_sections(value: str) -> dict:
+    """X-Token-Sectionsヘッダーを {構成要素: トークン数} に変換する"""
+    sections = {}
+    for entry in filter(None, (part.strip() for part in (value or "").split(","))):
+        name, _, tokens = entry.partition("=")
+        sections[name] = int(tokens)
+    return sections
+
+
+def run_route(route, url: str, body: bytes) -> dict:
+    """ルートを1回実行し、経過時間・ピークメモリ・ペイロードサイズを返す"""
+    req = func.HttpRequest(method="POST", url=url, body=body,
+                           headers={"Content-Type": "application/json"})
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        response = asyncio.run(route(req))
+        wall_ms = (time.perf_counter() - started) * 1000
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    response_body = response.get_body()
+    if response.status_code != 200:
+        raise RuntimeError(
+            f"{url} returned {response.status_code}: {response_body[:200]!r}")
+    return {
+        "wall_ms": wall_ms,
+        "peak_memory_bytes": peak,
+        "request_bytes": len(body),
+        "response_bytes": len(response_body),
+        "stages_ms": parse_server_timing(response.headers.get("Server-Timing")),
+        "prompt_tokens_by_section": parse_sections(response.headers.get("X-Token-Sections")),
+        "body": response_body,
+    }
+
+
+def summarize(runs: list) -> dict:
+    """複数回の実行結果を中央値でまとめる"""
+    stages = {name for run in runs for name in run["stages_ms"]}
+    return {
+        "wall_ms": round(statistics.median(run["wall_ms"] for run in runs), 1),
+        "peak_memory_bytes": max(run["peak_memory_bytes"] for run in runs),
+        "request_bytes": runs[0]["request_bytes"],
+        "response_bytes": runs[0]["response_bytes"],
+        "stages_ms": {
+            name: round(statistics.median(run["stages_ms"].get(name, 0.0) for run in runs), 1)
+            for name in sorted(stages)
+        },
+        "prompt_tokens_by_section": runs[0]["prompt_tokens_by_section"],
+    }
+
+
+def bench_size(size: str, repeat: int, args) -> dict:
+    document = build_synthetic_document(SIZES[size])
+    page_count = len(document["pages"])
+    pdf_binary = os.urandom(PDF_BYTES_PER_PAGE * page_count)
+    analyze_body = json.dumps({
+        "classification_prompt": "背景、まとめ",
+        "pdf_binary": base64.b64encode(pdf_binary).decode("ascii"),
+        # 毎回Document Intelligence（の代替実装）を呼び出すため、キャッシュを使わない
+        "use_cache": False,
+    }).encode("utf-8")
+
+    di_faults = FaultInjector(
+        latency=args.di_latency, jitter=args.jitter, seed=1)
+    openai_faults = FaultInjector(
+        latency=args.openai_latency, jitter=args.jitter, failure_rate=args.failure_rate, seed=2)
+    analyze_runs, extraction_runs = [], []
+    with install_fakes(document, di_faults=di_faults, openai_faults=openai_faults) as fakes:
+        for _ in range(repeat):
+            analyze_run = run_route(
+                analyze_document_structure_route_async, "/api/analyze_document_structure", analyze_body)
+            analyze_runs.append(analyze_run)
+            # 毎回Azure OpenAI（の代替実装）を呼び出すため、抽出結果キャッシュも使わない
+            extraction_body = json.loads(analyze_run.pop("body"))
+            extraction_body["use_cache"] = False
+            extraction_runs.append(run_route(
+                extraction_categories_route_async, "/api/extraction_categories",
+                json.dumps(extraction_body, ensure_ascii=False).encode("utf-8")))
+            extraction_runs[-1].pop("body")
+        di_result_bytes = max(fakes.async_document_intelligence.result_sizes)
+
+    analyze = summarize(analyze_runs)
+    analyze["di_result_bytes"] = di_result_bytes
+    return {
+        "pages": page_count,
+        "categories": len(document["categories"]),
+        "analyze_document_structure": analyze,
+        "extraction_categories": summarize(extraction_runs),
+    }
+
+
+def print_results(results: dict) -> None:
+    for size, result in results.items():
+        print(
+            f"✅ {size}: {result['pages']} pages / {result['categories']} categories")
+        for route in ("analyze_document_structure", "extraction_categories"):
+            summary = result[route]
+            print(f"   {route}: {summary['wall_ms']:8.1f} ms, peak={summary['peak_memory_bytes'] / 1e6:.1f} MB, "
+                  f"request={summary['request_bytes'] / 1e6:.2f} MB, response={summary['response_bytes'] / 1e6:.2f} MB")
+            stages = ", ".join(
+                f"{name}={ms:.1f}" for name, ms in summary["stages_ms"].items())
+            print(f"      stages(ms): {stages}")
+            if summary["prompt_tokens_by_section"]:
+                print(
+                    f"      prompt tokens: {summary['prompt_tokens_by_section']}")
+
+
+def check_regressions(results: dict, baseline: dict, max_regression: float) -> list:
+    """基準と比べて経過時間が max_regression 倍を超えたものを返す"""
+    regressions = []
+    for size, result in results.items():
+        for route in ("analyze_document_structure", "extraction_categories"):
+            base = baseline.get(size, {}).get(route)
+            if not base:
+                continue
+            ratio = result[route]["wall_ms"] / max(base["wall_ms"], 0.001)
+            if ratio > max_regression:
+                regressions.append(
+                    f"{size}/{route}: {base['wall_ms']:.1f} ms -> {result[route]['wall_ms']:.1f} ms ({ratio:.2f}x)")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", default=",".join(SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--di-latency", type=float, default=0.0,
+                        help="Document Intelligenceの遅延（秒）")
+    parser.add_argument("--openai-latency", type=float,
+                        default=0.0, help="Azure OpenAIの遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="遅延に加えるジッターの幅（秒）")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Azure OpenAIの呼び出しでRateLimitErrorを注入する確率（スケジューラが再試行する）")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", help="比較する基準の結果（JSON）")
+    parser.add_argument("--max-regression", type=float, default=1.25)
+    args = parser.parse_args()
+
+    # プロンプトの構成要素ごとのトークン数をレスポンスヘッダーから取得する
+    token_accounting.TOKEN_USAGE_HEADERS = True
+
+    results = {size: bench_size(size, args.repeat, args)
+               for size in args.sizes.split(",")}
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ 結果を保存しました: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = check_regressions(
+                results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"❌ 性能が低下しました: {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+analyze_document_structure のアップロード形式ごとのピークメモリ（RSS）比較
+
+JSON（Base64）・application/pdf・multipart/form-data の各形式でリクエストを組み立て、
+parse_analyze_request でPDFバイナリを取り出すまでのピークRSSを、形式ごとに別プロセスで計測する。
+Document Intelligence・Azure OpenAIへの通信は行わない。
+
+実行方法（backendディレクトリで）:
+    python test/benchmark/bench_upload_memory.py [PDFファイルのパス] [--repeat N]
+--repeat を指定すると、PDFをN回連結して大きなペイロードを模擬する（既定: 20）
+"""
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..")))
+
+DEFAULT_PDF_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "消費者トラブルの現状.pdf")
+MODES = ["baseline", "json", "pdf", "multipart"]
+BOUNDARY = "----benchmarkboundary"
+
+
+def _peak_rss_mb() -> float:
+    # Linuxではキロバイト、macOSではバイト単位
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_mode(mode: str, pdf_path: str, repeat: int) -> None:
+    """1つの形式でリクエストを解析し、ピークRSSとペイロードサイズをJSONで出力する"""
+    import azure.functions as func
+    from routes.analyze_document import parse_analyze_request
+
+    with open(pdf_path, "rb") as f:
+        pdf = f.read() * repeat
+
+    url = "http://localhost:7071/api/analyze_document_structure"
+    if mode == "json":
+        body = json.dumps({
+            "classification_prompt": "背景、まとめ",
+            "pdf_binary": base64.b64encode(pdf).decode("utf-8"),
+        }).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        params = {}
+    elif mode == "pdf":
+        body = pdf
+        headers = {"Content-Type": "application/pdf"}
+        params = {"classification_prompt": "背景、まとめ"}
+    elif mode == "multipart":
+        body = (
+            f"--{BOUNDARY}\r\n"
+            'Content-Disposition: form-data; name="classification_prompt"\r\n\r\n'
+            "背景、まとめ\r\n"
+            f"--{BOUNDARY}\r\n"
+            'Content-Disposition: form-data; name="pdf_binary"; filename="document.pdf"\r\n'
+            "Content-Type: application/pdf\r\n\r\n"
+        ).encode("utf-8") + pdf + f"\r\n--{BOUNDARY}--\r\n".encode("utf-8")
+        headers = {
+            "Content-Type": f"multipart/form-data; boundary={BOUNDARY}"}
+        params = {}
+    else:
+        # インポートとPDFの読み込みだけを行い、基準値とする
+        print(json.dumps({"mode": mode, "payload_bytes": 0,
+              "peak_rss_mb": _peak_rss_mb()}))
+        return
+
+    payload_bytes = len(body)
+    req = func.HttpRequest(method="POST", url=url,
+                           headers=headers, params=params, body=body)
+    del body
+    _, pdf_binary, _ = parse_analyze_request(req)
+    assert len(pdf_binary) == len(pdf)
+
+    print(json.dumps({"mode": mode, "payload_bytes": payload_bytes,
+          "peak_rss_mb": _peak_rss_mb()}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdf_path", nargs="?", default=DEFAULT_PDF_PATH)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--mode", choices=MODES)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.pdf_path, args.repeat)
+        sys.exit(0)
+
+    print(
+        f"✅ アップロード形式ごとのピークRSSを計測します (PDF: {os.path.getsize(args.pdf_path) * args.repeat / 1024 / 1024:.1f} MB)")
+    results = {}
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, args.pdf_path,
+                "--repeat", str(args.repeat), "--mode", mode],
+            check=True, capture_output=True, text=True,
+        ).stdout.strip().splitlines()[-1]
+        results[mode] = json.loads(output)
+
+    baseline = results["baseline"]["peak_rss_mb"]
+    for mode in MODES[1:]:
+        result = results[mode]
+        print(f"   {mode:9}: payload={result['payload_bytes'] / 1024 / 1024:7.1f} MB, "
+              f"peak RSS +{result['peak_rss_mb'] - baseline:7.1f} MB")
@@ -0,0 +1,414 @@
+"""
+Document Intelligence・Azure OpenAIのオフライン用の代替実装（ベンチマーク・オフラインテスト用）
+
+記録済みのレスポンス（test/output_categories.json・test/output_extract_categories.json）を再生する。
+- FakeDocumentIntelligenceClient / FakeAsyncDocumentIntelligenceClient:
+  begin_analyze_document で、記録済みのページから組み立てた解析結果を返す（pages指定のシャードにも対応）
+- FakeOpenAIClient / FakeAsyncOpenAIClient:
+  分類は記録済みの分類を、抽出は記録済みの抽出結果を返す
+- FaultInjector: 応答の遅延（ジッター付き）と、一定の確率での失敗を注入する
+- install_fakes: サービスが使うクライアントを代替実装に差し替える
+"""
+import ast
+import asyncio
+import contextlib
+import copy
+import html
+import json
+import os
+import random
+import re
+import time
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+import openai
+from azure.core.exceptions import HttpResponseError
+
+from domains.analyze_categories import Category, CategoryList
+from services.azure import azure_openai, document_intelligence
+from utils.analyze_result_merge import PAGE_BREAK
+from utils.token_estimator import count_message_tokens, count_text_tokens
+
+TEST_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+RECORDED_ANALYZE_PATH = os.path.join(TEST_DIR, "output_categories.json")
+RECORDED_EXTRACTIONS_PATH = os.path.join(
+    TEST_DIR, "output_extract_categories.json")
+
+_PAGE_NUMBER_PATTERN = re.compile(r"# ページ番号: (\d+)")
+_TARGET_CATEGORY_PATTERN = re.compile(
+    r"------ 抽出対象分類 -------\n(\{.*\})", re.S)
+_COPY_SUFFIX_PATTERN = re.compile(r" \(\d+\)$")
+
+
+class FaultInjector:
+    """
+    応答の遅延と失敗を注入する
+    :param latency: 1回の呼び出しの遅延（秒）
+    :param jitter: 遅延に加える一様乱数の幅（秒）
+    :param failure_rate: 失敗させる確率（0〜1）
+    :param seed: 乱数のシード（再現性のため）
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0, seed: int = 0) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+
+    def next_delay(self) -> float:
+        self.calls += 1
+        return self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def should_fail(self) -> bool:
+        failed = self.failure_rate > 0 and self._random.random() < self.failure_rate
+        if failed:
+            self.failures += 1
+        return failed
+
+
+def _literal(value):
+    """記録済みのJSONで文字列化されている辞書（"{'offset': 10, ...}"）を元に戻す"""
+    return ast.literal_eval(value) if isinstance(value, str) else value
+
+
+def load_recorded_document() -> dict:
+    """記録済みの analyze_document_structure のレスポンス（categories・content_markdown・pages）を読み込む"""
+    with open(RECORDED_ANALYZE_PATH, encoding="utf-8") as f:
+        document = json.load(f)
+    document["content_markdown"] = html.unescape(document["content_markdown"])
+    return document
+
+
+def load_recorded_extractions() -> Dict[str, str]:
+    """記録済みの抽出結果を、分類名から内容への辞書として読み込む"""
+    with open(RECORDED_EXTRACTIONS_PATH, encoding="utf-8") as f:
+        return {item["category"]: item["content"] for item in json.load(f)}
+
+
+def build_synthetic_document(copies: int = 1) -> dict:
+    """
+    記録済みのドキュメントを copies 回繰り返した合成ドキュメントを返す
+    ページ番号は通し番号に振り直し、分類は「分類名 (n)」として複製する
+    :return: {"categories": [...], "pages": [...]}（pagesは記録済みのレスポンスと同じ形式）
+    """
+    recorded = load_recorded_document()
+    page_count = len(recorded["pages"])
+    pages = []
+    categories = []
+    for n in range(copies):
+        offset = n * page_count
+        for page in recorded["pages"]:
+            page = copy.deepcopy(page)
+            page["page_number"] += offset
+            pages.append(page)
+        for category in recorded["categories"]:
+            categories.append({
+                "category": category["category"] if n == 0 else f"{category['category']} ({n + 1})",
+                "page_numbers": [page_number + offset for page_number in category["page_numbers"]],
+            })
+    return {"categories": categories, "pages": pages}
+
+
+def _page_markdown(page: dict) -> str:
+    lines = [line["content"] for line in page["lines"]]
+    if not lines:
+        return ""
+    return f"# {lines[0]}\n\n" + "\n".join(lines[1:])
+
+
+def build_analyze_result(pages: List[dict]) -> dict:
+    """
+    ページ（記録済みのレスポンスの形式）から、Document IntelligenceのAnalyzeResultと同じ形式の辞書を組み立てる
+    contentはページごとのMarkdownをPageBreakでつないだもので、行のspanはcontent内の位置を指す
+    """
+    content_parts: List[str] = []
+    offset = 0
+    result_pages = []
+    tables = []
+    figures = []
+    for i, page in enumerate(pages):
+        if i:
+            content_parts.append(PAGE_BREAK)
+            offset += len(PAGE_BREAK)
+        markdown = _page_markdown(page)
+        lines = []
+        search_from = 0
+        for line in page["lines"]:
+            position = markdown.find(line["content"], search_from)
+            if position < 0:
+                position = search_from
+            search_from = position + len(line["content"])
+            lines.append({
+                "content": line["content"],
+                "polygon": line.get("polygon", []),
+                "spans": [{"offset": offset + position, "length": len(line["content"])}],
+            })
+        page_number = page["page_number"]
+        result_pages.append({
+            "pageNumber": page_number,
+            "width": page.get("width", 0),
+            "height": page.get("height", 0),
+            "unit": "inch",
+            "lines": lines,
+            "spans": [{"offset": offset, "length": len(markdown)}],
+        })
+        for table in page.get("tables", []):
+            tables.append({
+                "rowCount": table["row_count"],
+                "columnCount": table["column_count"],
+                "cells": [
+                    {
+                        "rowIndex": cell["row_index"],
+                        "columnIndex": cell["column_index"],
+                        "content": cell["content"],
+                        "boundingRegions": [
+                            dict(_literal(region), pageNumber=page_number)
+                            for region in cell.get("bounding_regions", [])
+                        ],
+                    }
+                    for cell in table["cells"]
+                ],
+                "boundingRegions": [{"pageNumber": page_number, "polygon": []}],
+            })
+        for figure in page.get("figures", []):
+            figures.append({
+                "id": figure["id"],
+                "boundingRegions": [
+                    dict(_literal(region), pageNumber=page_number)
+                    for region in figure.get("bounding_regions", [])
+                ],
+                "spans": [{"offset": offset, "length": len(markdown)}],
+                "elements": [],
+            })
+        content_parts.append(markdown)
+        offset += len(markdown)
+    return {
+        "apiVersion": "2024-11-30",
+        "modelId": "prebuilt-layout",
+        "contentFormat": "markdown",
+        "content": "".join(content_parts),
+        "pages": result_pages,
+        "tables": tables,
+        "figures": figures,
+    }
+
+
+def _select_pages(pages: List[dict], page_ranges: Optional[str]) -> List[dict]:
+    """"1-50,60" 形式のページ指定に含まれるページだけを返す"""
+    if not page_ranges:
+        return pages
+    selected = set()
+    for part in page_ranges.split(","):
+        first, _, last = part.partition("-")
+        selected.update(range(int(first), int(last or first) + 1))
+    return [page for page in pages if page["page_number"] in selected]
+
+
+def _injected_di_error() -> HttpResponseError:
+    return HttpResponseError(message="Injected Document Intelligence failure")
+
+
+class _FakePoller:
+    def __init__(self, result: dict, delay: float) -> None:
+        self._result = result
+        self._delay = delay
+
+    def result(self):
+        time.sleep(self._delay)
+        return document_intelligence.AnalyzeResult(self._result)
+
+
+class _FakeAsyncPoller(_FakePoller):
+    async def result(self):
+        await asyncio.sleep(self._delay)
+        return document_intelligence.AnalyzeResult(self._result)
+
+
+class FakeDocumentIntelligenceClient:
+    """記録済みのページから組み立てた解析結果を返すDocument Intelligenceクライアント"""
+
+    def __init__(self, pages: List[dict], faults: Optional[FaultInjector] = None) -> None:
+        self.pages = pages
+        self.faults = faults or FaultInjector()
+        self.result_sizes: List[int] = []
+
+    def _analyze(self, pages: Optional[str]) -> dict:
+        if self.faults.should_fail():
+            raise _injected_di_error()
+        result = build_analyze_result(_select_pages(self.pages, pages))
+        self.result_sizes.append(
+            len(json.dumps(result, ensure_ascii=False).encode("utf-8")))
+        return result
+
+    def begin_analyze_document(self, model_id: str, body=None, pages: Optional[str] = None, **kwargs) -> _FakePoller:
+        return _FakePoller(self._analyze(pages), self.faults.next_delay())
+
+
+class FakeAsyncDocumentIntelligenceClient(FakeDocumentIntelligenceClient):
+    async def begin_analyze_document(self, model_id: str, body=None, pages: Optional[str] = None, **kwargs) -> _FakeAsyncPoller:
+        return _FakeAsyncPoller(self._analyze(pages), self.faults.next_delay())
+
+
+def _injected_rate_limit_error() -> openai.RateLimitError:
+    request = httpx.Request(
+        "POST", "https://fake.openai.azure.com/chat/completions")
+    response = httpx.Response(
+        429, request=request, headers={"retry-after-ms": "10"})
+    return openai.RateLimitError("Injected rate limit error", response=response, body=None)
+
+
+class FakeOpenAIClient:
+    """
+    記録済みの分類・抽出結果を返すAzure OpenAIクライアント
+    分類はユーザメッセージに含まれるページ番号に該当する分類だけを、
+    抽出はユーザメッセージの抽出対象分類に該当する記録済みの内容を返す
+    """
+
+    def __init__(
+        self,
+        categories: List[dict],
+        extractions: Optional[Dict[str, str]] = None,
+        faults: Optional[FaultInjector] = None,
+    ) -> None:
+        self.categories = categories
+        self.extractions = extractions if extractions is not None else load_recorded_extractions()
+        self.faults = faults or FaultInjector()
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self._create))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(
+            completions=SimpleNamespace(parse=self._parse)))
+
+    def _classify(self, messages: list) -> List[Category]:
+        page_numbers = {int(number) for number in _PAGE_NUMBER_PATTERN.findall(
+            messages[-1]["content"])}
+        categories = []
+        for category in self.categories:
+            pages = [page_number for page_number in category["page_numbers"]
+                     if page_number in page_numbers]
+            if pages:
+                categories.append(
+                    Category(category=category["category"], page_numbers=pages))
+        return categories
+
+    def _extract(self, messages: list) -> str:
+        match = _TARGET_CATEGORY_PATTERN.search(messages[-1]["content"])
+        name = json.loads(match.group(1))["category"] if match else ""
+        return self.extractions.get(_COPY_SUFFIX_PATTERN.sub("", name), f"## {name}")
+
+    def _response(self, messages: list, content: str, parsed=None) -> SimpleNamespace:
+        prompt_tokens = count_message_tokens(messages)
+        completion_tokens = count_text_tokens(content)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(
+                content=content, parsed=parsed))],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+                prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+            ),
+        )
+
+    def _create_response(self, messages: list) -> SimpleNamespace:
+        if self.faults.should_fail():
+            raise _injected_rate_limit_error()
+        return self._response(messages, self._extract(messages))
+
+    def _stream_chunks(self, messages: list) -> List[SimpleNamespace]:
+        """stream=True の応答のチャンク（行ごとの断片と、最後にusageだけのチャンク）"""
+        response = self._create_response(messages)
+        content = response.choices[0].message.content
+        chunks = [
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], usage=None)
+            for piece in content.splitlines(keepends=True)
+        ]
+        chunks.append(SimpleNamespace(choices=[], usage=response.usage))
+        return chunks
+
+    def _parse_response(self, messages: list) -> SimpleNamespace:
+        if self.faults.should_fail():
+            raise _injected_rate_limit_error()
+        parsed = CategoryList(categories=self._classify(messages))
+        return self._response(messages, json.dumps(parsed.dict(), ensure_ascii=False), parsed)
+
+    def _create(self, model: str, messages: list, stream: bool = False, **kwargs):
+        time.sleep(self.faults.next_delay())
+        if stream:
+            return iter(self._stream_chunks(messages))
+        return self._create_response(messages)
+
+    def _parse(self, model: str, messages: list, response_format=None, **kwargs) -> SimpleNamespace:
+        time.sleep(self.faults.next_delay())
+        return self._parse_response(messages)
+
+
+class _AsyncChunks:
+    """ストリーミング応答（AsyncStream）の代わりに、チャンクを非同期イテレータとして返す"""
+
+    def __init__(self, chunks: List[SimpleNamespace]) -> None:
+        self._chunks = iter(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> SimpleNamespace:
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeAsyncOpenAIClient(FakeOpenAIClient):
+    async def _create(self, model: str, messages: list, stream: bool = False, **kwargs):
+        await asyncio.sleep(self.faults.next_delay())
+        if stream:
+            return _AsyncChunks(self._stream_chunks(messages))
+        return self._create_response(messages)
+
+    async def _parse(self, model: str, messages: list, response_format=None, **kwargs) -> SimpleNamespace:
+        await asyncio.sleep(self.faults.next_delay())
+        return self._parse_response(messages)
+
+
+@contextlib.contextmanager
+def install_fakes(
+    document: dict,
+    di_faults: Optional[FaultInjector] = None,
+    openai_faults: Optional[FaultInjector] = None,
+) -> Iterator[SimpleNamespace]:
+    """
+    サービスが使用するクライアントを、document（build_synthetic_document の戻り値）を再生する代替実装に差し替える
+    with install_fakes(document) as fakes: ... の範囲でのみ有効
+    """
+    fakes = SimpleNamespace(
+        document_intelligence=FakeDocumentIntelligenceClient(
+            document["pages"], di_faults),
+        async_document_intelligence=FakeAsyncDocumentIntelligenceClient(
+            document["pages"], di_faults),
+        openai=FakeOpenAIClient(
+            document["categories"], faults=openai_faults),
+        async_openai=FakeAsyncOpenAIClient(
+            document["categories"], faults=openai_faults),
+    )
+    patches = [
+        (document_intelligence, "get_document_intelligence_client",
+         lambda **kwargs: fakes.document_intelligence),
+        (document_intelligence, "get_async_document_intelligence_client",
+         lambda **kwargs: fakes.async_document_intelligence),
+        (azure_openai, "get_openai_client", lambda **kwargs: fakes.openai),
+        (azure_openai, "get_async_openai_client",
+         lambda **kwargs: fakes.async_openai),
+    ]
+    originals = [(module, name, getattr(module, name))
+                 for module, name, _ in patches]
+    try:
+        for module, name, replacement in patches:
+            setattr(module, name, replacement)
+        yield fakes
+    finally:
+        for module, name, original in originals:
+            setattr(module, name, original)
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+import pytest
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+# function_app の読み込み時間（累積、ミリ秒）の上限
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "500"))
+# 起動時には読み込まず、最初に使うルートで読み込むモジュール
+DEFERRED_MODULES = [
+    "openai",
+    "azure.ai.documentintelligence",
+    "pydantic",
+    "httpx",
+    "aiohttp",
+    "routes.analyze_document",
+    "routes.extraction_category",
+    "routes.extraction_categories",
+]
+
+
+def measure_import_time(module: str) -> dict:
+    """python -X importtime で module を読み込み、{モジュール名: 累積時間（マイクロ秒）} を返す"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        env={**os.environ, "WARMUP_ON_LOAD": "false"},
+    )
+    imports = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports[name.strip()] = int(cumulative)
+    return imports
+
+def test_function_app_defers_heavy_imports():
+    pytest.importorskip("azure.functions")
+    measure_import_time("function_app")  # .pyc を作成してから計測する
+    imports = measure_import_time("function_app")
+
+    assert [module for module in DEFERRED_MODULES if module in imports] == []
+    assert imports["function_app"] / 1000 <= IMPORT_TIME_BUDGET_MS
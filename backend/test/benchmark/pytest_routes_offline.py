@@ -0,0 +1,199 @@
+import asyncio
+import base64
+import json
+import pytest
+import azure.functions as func
+from fakes import FaultInjector, build_synthetic_document, install_fakes
+from routes.analyze_batch import analyze_document_batch_route, analyze_document_batch_stream_route
+from routes.analyze_document import analyze_document_structure_route_async
+from routes.extraction_categories import extraction_categories_route_async, extraction_categories_stream_route
+from routes.extraction_category_stream import extraction_category_stream_buffered_route
+from services.azure.rate_limiter import get_rate_limit_scheduler
+
+
+def _analyze_request():
+    body = json.dumps({
+        "classification_prompt": "背景、まとめ",
+        "pdf_binary": base64.b64encode(b"%PDF-1.7 fake").decode("ascii"),
+        "use_cache": False,
+    }).encode("utf-8")
+    return func.HttpRequest(method="POST", url="/api/analyze_document_structure", body=body,
+                            headers={"Content-Type": "application/json"})
+
+def test_routes_run_offline_with_recorded_responses():
+    document = build_synthetic_document(2)
+
+    with install_fakes(document):
+        response = asyncio.run(analyze_document_structure_route_async(_analyze_request()))
+        assert response.status_code == 200
+        analyzed = json.loads(response.get_body())
+        assert len(analyzed["pages"]) == len(document["pages"])
+        assert {c["category"] for c in analyzed["categories"]} == {c["category"] for c in document["categories"]}
+        assert "Server-Timing" in response.headers
+
+        req = func.HttpRequest(method="POST", url="/api/extraction_categories", body=response.get_body(),
+                               headers={"Content-Type": "application/json"})
+        response = asyncio.run(extraction_categories_route_async(req))
+
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.get_body().decode("utf-8").splitlines()]
+    assert len(lines) == len(document["categories"])
+    assert all("content" in line for line in lines)
+
+def test_rate_limit_failures_are_injected(monkeypatch):
+    document = build_synthetic_document(1)
+    monkeypatch.setattr(get_rate_limit_scheduler("gpt-4o"), "max_retries", 0)
+
+    with install_fakes(document, openai_faults=FaultInjector(failure_rate=1.0)) as fakes:
+        response = asyncio.run(analyze_document_structure_route_async(_analyze_request()))
+
+    assert response.status_code == 429
+    assert fakes.async_openai.faults.failures == 1
+
+def test_extraction_stream_ends_with_result_event():
+    document = build_synthetic_document(1)
+    category = document["categories"][0]
+    body = json.dumps({
+        "target_category": category,
+        "categories": document["categories"],
+        "content_markdown": "",
+        "pages": [page for page in document["pages"] if page["page_number"] in category["page_numbers"]],
+        "use_cache": False,
+    }, ensure_ascii=False).encode("utf-8")
+    req = func.HttpRequest(method="POST", url="/api/extraction_category_stream", body=body,
+                           headers={"Content-Type": "application/json"})
+
+    with install_fakes(document):
+        response = asyncio.run(extraction_category_stream_buffered_route(req))
+
+    events = [event.split("\n", 1) for event in response.get_body().decode("utf-8").strip().split("\n\n")]
+    names = [name for name, _ in events]
+    assert response.mimetype == "text/event-stream"
+    assert names[-1] == "event: result" and set(names[:-1]) == {"event: delta"}
+    deltas = "".join(json.loads(data[len("data: "):])["content"] for _, data in events[:-1])
+    result = json.loads(events[-1][1][len("data: "):])
+    assert result["category"] == category["category"]
+    assert result["content"] == deltas
+
+def _batch_request(documents):
+    body = json.dumps({
+        "classification_prompt": "背景、まとめ",
+        "documents": documents,
+        "use_cache": False,
+        "llm_concurrency": 1,
+    }).encode("utf-8")
+    return func.HttpRequest(method="POST", url="/api/analyze_document_batch", body=body,
+                            headers={"Content-Type": "application/json"})
+
+def test_batch_reports_each_document_in_completion_order():
+    document = build_synthetic_document(2)
+    pdf_binary = base64.b64encode(b"%PDF-1.7 fake").decode("ascii")
+
+    with install_fakes(document):
+        response = asyncio.run(analyze_document_batch_route(_batch_request([
+            {"name": "a.pdf", "pdf_binary": pdf_binary},
+            {"name": "b.pdf", "pdf_binary": pdf_binary},
+        ])))
+        # BATCH_LOCAL_ROOT が未設定の場合、ローカルファイルの参照は受け付けない
+        rejected = asyncio.run(analyze_document_batch_route(_batch_request([{"path": "c.pdf"}])))
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_body().decode("utf-8").splitlines()]
+    assert sorted(line["name"] for line in lines) == ["a.pdf", "b.pdf"]
+    assert all(line["status"] == 200 and len(line["pages"]) == len(document["pages"]) for line in lines)
+    assert rejected.status_code == 400
+
+def test_batch_rejects_malformed_requests_and_documents():
+    document = build_synthetic_document(1)
+    list_body = func.HttpRequest(method="POST", url="/api/analyze_document_batch", body=b"[]",
+                                 headers={"Content-Type": "application/json"})
+
+    with install_fakes(document):
+        rejected = asyncio.run(analyze_document_batch_route(list_body))
+        # Base64のデコードはOCRの直前に行うため、不正な文書はその文書の結果行だけが失敗になる
+        response = asyncio.run(analyze_document_batch_route(_batch_request([
+            {"name": "broken.pdf", "pdf_binary": "not base64!"},
+        ])))
+
+    assert rejected.status_code == 400
+    lines = [json.loads(line) for line in response.get_body().decode("utf-8").splitlines()]
+    assert [(line["name"], line["status"]) for line in lines] == [("broken.pdf", 400)]
+
+def test_batch_stream_sends_each_document_as_completed():
+    pytest.importorskip("azurefunctions.extensions.http.fastapi")
+    from starlette.requests import Request
+
+    document = build_synthetic_document(1)
+    pdf_binary = base64.b64encode(b"%PDF-1.7 fake").decode("ascii")
+    body = json.dumps({"classification_prompt": "背景、まとめ", "use_cache": False, "documents": [
+        {"name": "a.pdf", "pdf_binary": pdf_binary}, {"name": "b.pdf", "pdf_binary": pdf_binary},
+    ]}).encode("utf-8")
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def stream():
+        req = Request({"type": "http", "method": "POST", "path": "/api/analyze_document_batch",
+                       "headers": [(b"content-type", b"application/json")]}, receive)
+        response = await analyze_document_batch_stream_route(req)
+        return response, [chunk async for chunk in response.body_iterator]
+
+    with install_fakes(document):
+        response, chunks = asyncio.run(stream())
+
+    assert response.media_type == "application/x-ndjson"
+    # 1文書 = 1チャンク（完了した時点で送られる）
+    assert sorted(json.loads(chunk)["name"] for chunk in chunks) == ["a.pdf", "b.pdf"]
+
+def test_concurrent_duplicate_requests_share_upstream_calls():
+    document = build_synthetic_document(1)
+
+    async def submit_twice():
+        return await asyncio.gather(
+            analyze_document_structure_route_async(_analyze_request()),
+            analyze_document_structure_route_async(_analyze_request()))
+
+    with install_fakes(document) as fakes:
+        responses = asyncio.run(submit_twice())
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert responses[0].get_body() == responses[1].get_body()
+    assert fakes.async_document_intelligence.faults.calls == 1
+    assert fakes.async_openai.faults.calls == 1
+
+def test_extraction_categories_rejects_zero_max_concurrency():
+    document = build_synthetic_document(1)
+    body = json.dumps({"categories": document["categories"], "content_markdown": "",
+                       "pages": document["pages"], "max_concurrency": 0}).encode("utf-8")
+    req = func.HttpRequest(method="POST", url="/api/extraction_categories", body=body,
+                           headers={"Content-Type": "application/json"})
+
+    with install_fakes(document):
+        response = asyncio.run(extraction_categories_route_async(req))
+
+    assert response.status_code == 400
+
+def test_extraction_categories_stream_sends_each_category_as_completed():
+    pytest.importorskip("azurefunctions.extensions.http.fastapi")
+    from starlette.requests import Request
+
+    document = build_synthetic_document(2)
+    body = json.dumps({"categories": document["categories"], "content_markdown": "",
+                       "pages": document["pages"], "use_cache": False}).encode("utf-8")
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def stream():
+        req = Request({"type": "http", "method": "POST", "path": "/api/extraction_categories", "headers": []}, receive)
+        response = await extraction_categories_stream_route(req)
+        return response, [chunk async for chunk in response.body_iterator]
+
+    with install_fakes(document):
+        response, chunks = asyncio.run(stream())
+
+    assert response.media_type == "application/x-ndjson"
+    # 1分類 = 1チャンク（完了した時点で送られる）
+    assert len(chunks) == len(document["categories"])
+    assert all("content" in json.loads(chunk) for chunk in chunks)
@@ -0,0 +1,84 @@
+import pytest
+from domains.analyze_categories import ExtractionCategoriesRequestData
+from domains.document_model import DocumentPages
+
+
+def _page(page_number, *lines):
+    return {
+        "page_number": page_number,
+        "width": 8.5,
+        "height": 11.0,
+        "lines": [
+            {"content": line, "polygon": [0.5, 1.0, 2.5, 1.0], "spans": [{"offset": i * 10, "length": len(line)}]}
+            for i, line in enumerate(lines)
+        ],
+        "tables": [{
+            "row_count": 1,
+            "column_count": 1,
+            "cells": [{"row_index": 0, "column_index": 0, "content": "セル",
+                       "bounding_regions": [{"pageNumber": page_number, "polygon": [0.0, 1.0]}]}],
+        }],
+        "figures": [{
+            "id": f"{page_number}.1",
+            "bounding_regions": [f"{{'pageNumber': {page_number}, 'polygon': [0.1, 0.2]}}"],
+            "spans": ["{'offset': 3, 'length': 4}"],
+            "elements": ["/paragraphs/0"],
+        }],
+    }
+
+def test_round_trip_and_page_text():
+    pages = [_page(1, "背景", "本文"), _page(2), _page(3, "まとめ")]
+
+    document = DocumentPages.from_pages(pages)
+
+    assert [page.text for page in document] == ["背景\n本文", "", "まとめ"]
+    round_trip = document.to_pages()
+    assert [page["lines"] for page in round_trip] == [page["lines"] for page in pages]
+    assert round_trip[0]["tables"] == pages[0]["tables"]
+    assert round_trip[2]["figures"] == [{
+        "id": "3.1",
+        "bounding_regions": [{"pageNumber": 3, "polygon": [0.1, 0.2]}],
+        "spans": [{"offset": 3, "length": 4}],
+        "elements": ["/paragraphs/0"],
+    }]
+
+def test_select_shares_lines_and_compact_pages_keep_their_shape():
+    document = DocumentPages.from_pages([
+        {"page_number": 1, "lines": [{"content": "背景"}]},
+        {"page_number": 2, "lines": [{"content": "本文"}, {"content": "続き"}]},
+    ])
+
+    selected = document.select([2])
+
+    assert [page.page_number for page in selected] == [2]
+    assert selected[0].text == "本文\n続き"
+    assert selected.to_pages()[0]["lines"] == [{"content": "本文"}, {"content": "続き"}]
+
+@pytest.mark.parametrize("pages", [
+    None,
+    [{"lines": []}],
+    [{"page_number": 1}],
+    [{"page_number": 1, "lines": [{"polygon": []}]}],
+    [{"page_number": 1, "lines": [{"content": "a", "polygon": ["x"]}]}],
+    [{"page_number": 1, "lines": [{"content": "a", "spans": [{"offset": -1, "length": 3}]}]}],
+    [{"page_number": 1, "lines": [{"content": "a", "spans": [{"offset": 0, "length": 2 ** 64}]}]}],
+    [{"page_number": 1, "lines": [{"content": "a", "spans": ["{'offset': 0, 'length': 99999999999999999999999}"]}]}],
+    [{"page_number": 1, "lines": [], "figures": [{"id": "1.1", "spans": [{"offset": -5, "length": 1}]}]}],
+    # 文字列として出力された値: 深いネスト・長すぎる入力
+    [{"page_number": 1, "lines": [], "figures": [{"id": "1.1", "bounding_regions": ["[" * 2000 + "]" * 2000]}]}],
+    [{"page_number": 1, "lines": [], "figures": [{"id": "1.1", "bounding_regions": ["[" * 100000]}]}],
+    [{"page_number": 1, "lines": [{"content": "a", "spans": ["{'offset': 1" * 10000]}]}],
+])
+def test_invalid_pages_raise_value_error(pages):
+    with pytest.raises(ValueError):
+        DocumentPages.from_pages(pages)
+
+def test_request_model_converts_pages_once_and_rejects_invalid_pages():
+    pages = [{"page_number": 1, "lines": [{"content": "a"}]}]
+    request_data = ExtractionCategoriesRequestData(categories=[], content_markdown="", pages=pages)
+
+    assert isinstance(request_data.pages, DocumentPages)
+    assert ExtractionCategoriesRequestData(
+        categories=[], content_markdown="", pages=request_data.pages).pages is request_data.pages
+    with pytest.raises(ValueError):
+        ExtractionCategoriesRequestData(categories=[], content_markdown="", pages=[{"lines": []}])
@@ -0,0 +1,36 @@
+from domains.analyze_categories import Category, ExtractionCategoryRequestData
+from routes.extraction_category import build_extraction_prompts
+
+CATEGORIES = [Category(category="背景", page_numbers=[1]), Category(category="費用", page_numbers=[2])]
+MARKDOWN = "\n\n<!-- PageBreak -->\n\n".join([
+    "# 背景\n" + "調査の背景と目的について説明する。" * 40,
+    "# 費用\n" + "費用の見積もりと内訳について説明する。" * 40,
+])
+
+
+def _request(category: Category, budget: int) -> ExtractionCategoryRequestData:
+    return ExtractionCategoryRequestData(
+        target_category=category,
+        categories=CATEGORIES,
+        content_markdown=MARKDOWN,
+        pages=[{"page_number": category.page_numbers[0], "lines": [{"content": category.category}]}],
+        context_token_budget=budget,
+    )
+
+
+def test_excerpt_goes_to_user_prompt_and_system_prompt_is_shared():
+    background_system, background_prompt = build_extraction_prompts(_request(CATEGORIES[0], 800))
+    cost_system, cost_prompt = build_extraction_prompts(_request(CATEGORIES[1], 800))
+
+    assert background_system == cost_system
+    assert "調査の背景" not in background_system
+    assert background_prompt.startswith("------ Markdown（抜粋） -------\n")
+    assert background_prompt.index("調査の背景") < background_prompt.index("------ pages -------")
+    assert "費用の見積もり" in cost_prompt
+
+
+def test_whole_document_stays_in_system_prompt():
+    system_prompt, prompt = build_extraction_prompts(_request(CATEGORIES[0], 0))
+
+    assert system_prompt.endswith("------ Markdown -------\n" + MARKDOWN)
+    assert prompt.startswith("------ pages -------\n")
@@ -1,6 +1,10 @@
+import asyncio
 import pytest
-from unittest.mock import patch, MagicMock
-from services.azure.azure_openai import AzureOpenAIChatService
+from unittest.mock import AsyncMock, patch, MagicMock
+from services.azure.azure_openai import (
+    IMAGE_DETAIL, AsyncAzureOpenAIChatService, AzureOpenAIChatService, build_user_content,
+)
+from services.telemetry.token_accounting import start_token_account
 
 @pytest.fixture
 def mock_openai(monkeypatch):
@@ -8,38 +12,72 @@ def mock_openai(monkeypatch):
     monkeypatch.setattr("services.azure.azure_openai.openai", mock)
     return mock
 
-def test_init_sets_openai_attributes(mock_openai):
+@pytest.fixture
+def mock_get_openai_client(monkeypatch):
+    mock = MagicMock()
+    monkeypatch.setattr("services.azure.azure_openai.get_openai_client", mock)
+    return mock
+
+def test_init_uses_shared_client(mock_get_openai_client):
     endpoint = "https://example.com"
     api_key = "test-key"
     api_version = "2023-06-01-preview"
 
     service = AzureOpenAIChatService(endpoint, api_key, api_version)
 
-    assert service.openai is mock_openai
-    assert mock_openai.azure_endpoint == endpoint
-    assert mock_openai.api_key == api_key
-    assert mock_openai.api_version == api_version
+    assert service.client is mock_get_openai_client.return_value
+    mock_get_openai_client.assert_called_once_with(
+        endpoint=endpoint, api_key=api_key, api_version=api_version)
 
-def test_init_with_empty_strings(mock_openai):
-    endpoint = ""
-    api_key = ""
-    api_version = ""
+def test_init_does_not_modify_openai_module(mock_openai, mock_get_openai_client):
+    mock_openai.azure_endpoint = None
+    mock_openai.api_key = None
+    mock_openai.api_version = None
 
-    service = AzureOpenAIChatService(endpoint, api_key, api_version)
+    AzureOpenAIChatService("https://example.com", "test-key", "2023-06-01-preview")
 
-    assert service.openai is mock_openai
-    assert mock_openai.azure_endpoint == ""
-    assert mock_openai.api_key == ""
-    assert mock_openai.api_version == ""
+    assert mock_openai.azure_endpoint is None
+    assert mock_openai.api_key is None
+    assert mock_openai.api_version is None
 
-def test_init_with_none_values(mock_openai):
-    endpoint = None
-    api_key = None
-    api_version = None
+def test_init_with_injected_client(mock_get_openai_client):
+    client = MagicMock()
 
-    service = AzureOpenAIChatService(endpoint, api_key, api_version)
+    service = AzureOpenAIChatService("", "", "", client=client)
 
-    assert service.openai is mock_openai
-    assert mock_openai.azure_endpoint is None
-    assert mock_openai.api_key is None
-    assert mock_openai.api_version is None
\ No newline at end of file
+    assert service.client is client
+    mock_get_openai_client.assert_not_called()
+
+def test_completions_category_content_uses_client(mock_get_openai_client):
+    client = MagicMock()
+    client.chat.completions.create.return_value.choices = [
+        MagicMock(message=MagicMock(content="抽出結果"))]
+    service = AzureOpenAIChatService("", "", "", client=client)
+
+    content = service.completions_category_content(
+        system_prompt="system", text="text", image_urls=[], deployment_name="gpt-4o-mini")
+
+    assert content == "抽出結果"
+    client.chat.completions.create.assert_called_once()
+
+
+def test_build_user_content_adds_images_after_text():
+    assert build_user_content("text", []) == "text"
+    assert build_user_content("text", ["data:image/png;base64,AA=="]) == [
+        {"type": "text", "text": "text"},
+        {"type": "image_url", "image_url": {"url": "data:image/png;base64,AA==", "detail": IMAGE_DETAIL}},
+    ]
+
+
+def test_async_classification_is_recorded_as_classification_stage():
+    client = MagicMock()
+    client.beta.chat.completions.parse = AsyncMock()
+    client.beta.chat.completions.parse.return_value.choices = [
+        MagicMock(message=MagicMock(parsed=MagicMock(categories=[])))]
+    service = AsyncAzureOpenAIChatService("", "", "", client=client)
+    account = start_token_account()
+
+    asyncio.run(service.completions_format_categories(
+        system_prompt="system", text="text", deployment_name="gpt-4o"))
+
+    assert set(account.summary()["stages"]) == {"classification"}
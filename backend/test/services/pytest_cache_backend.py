@@ -0,0 +1,115 @@
+import pytest
+from services.cache.cache_backend import MemoryLRUCache, DiskCache, create_cache_backend
+from services.cache.analysis_cache import build_analysis_cache_key
+
+
+def test_memory_cache_hit_and_miss():
+    cache = MemoryLRUCache(max_entries=2)
+
+    assert cache.get("a") is None
+    cache.set("a", {"value": 1})
+
+    assert cache.get("a") == {"value": 1}
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryLRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+def test_memory_cache_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("services.cache.cache_backend.time.time", lambda: now[0])
+    cache = MemoryLRUCache(max_entries=2, ttl_seconds=10)
+    cache.set("a", 1)
+
+    now[0] += 11
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+def test_disk_cache_roundtrip_and_eviction(tmp_path):
+    cache = DiskCache(directory=str(tmp_path), max_entries=1)
+    cache.set("a", {"content": "テスト"})
+
+    assert cache.get("a") == {"content": "テスト"}
+
+    cache.set("b", {"content": "b"})
+
+    assert len(cache) == 1
+    assert cache.get("b") == {"content": "b"}
+
+def test_memory_cache_evicts_by_size():
+    cache = MemoryLRUCache(max_entries=10, max_bytes=50)
+    cache.set("a", {"content": "a" * 10})
+    cache.set("b", {"content": "b" * 10})
+    cache.set("c", {"content": "c" * 10})
+
+    assert cache.get("a") is None
+    assert cache.get("b") is not None and cache.get("c") is not None
+
+    cache.set("large", {"content": "x" * 100})
+
+    assert cache.get("large") is None
+    assert len(cache) == 2
+
+def test_disk_cache_evicts_by_size(tmp_path):
+    cache = DiskCache(directory=str(tmp_path), max_entries=10, max_bytes=60)
+    for key in ("a", "b", "c"):
+        cache.set(key, {"content": key * 10})
+
+    assert cache.get("a") is None
+    assert cache.get("c") == {"content": "c" * 10}
+    assert sum(path.stat().st_size for path in tmp_path.glob("*.json")) <= 60
+
+    cache.set("large", {"content": "x" * 100})
+
+    assert cache.get("large") is None
+    assert cache.get("c") == {"content": "c" * 10}
+
+def test_touch_checks_presence_without_reading_or_counting(tmp_path):
+    for cache in (MemoryLRUCache(max_entries=4), DiskCache(directory=str(tmp_path), max_entries=4)):
+        cache.set("a", {"content": "a"})
+
+        assert cache.touch("a") is True
+        assert cache.touch("missing") is False
+        assert cache.stats()["hits"] == 0 and cache.stats()["misses"] == 0
+
+def test_disk_cache_scans_directory_only_when_over_limit(tmp_path, monkeypatch):
+    cache = DiskCache(directory=str(tmp_path), max_entries=10)
+    scans = []
+    scan = cache._scan
+    monkeypatch.setattr(cache, "_scan", lambda: scans.append(1) or scan())
+
+    for i in range(10):
+        cache.set(f"k{i}", {"content": i})
+    assert scans == []
+
+    cache.set("k10", {"content": 10})
+
+    # 上限を超えた時点で1回だけ走査し、上限の9割まで削除する
+    assert scans == [1]
+    assert len(cache) == 9 == len(list(tmp_path.glob("*.json")))
+    assert cache.get("k10") == {"content": 10}
+
+def test_create_cache_backend():
+    assert create_cache_backend("none") is None
+    assert isinstance(create_cache_backend("memory"), MemoryLRUCache)
+    with pytest.raises(ValueError):
+        create_cache_backend("disk")
+
+def test_analysis_cache_key_depends_on_pdf_and_options():
+    key = build_analysis_cache_key(b"pdf", "prebuilt-layout", "markdown", ["figures"], [])
+
+    assert key == build_analysis_cache_key(b"pdf", "prebuilt-layout", "markdown", ["figures"], [])
+    assert key != build_analysis_cache_key(b"pdf2", "prebuilt-layout", "markdown", ["figures"], [])
+    assert key != build_analysis_cache_key(b"pdf", "prebuilt-read", "markdown", ["figures"], [])
+    assert key != build_analysis_cache_key(b"pdf", "prebuilt-layout", "text", ["figures"], [])
+    assert key != build_analysis_cache_key(b"pdf", "prebuilt-layout", "markdown", ["figures"], [],
+                                           string_index_type="unicodeCodePoint")
@@ -0,0 +1,36 @@
+from domains.analyze_categories import Category
+from services.classification import build_page_texts, build_page_windows, merge_categories
+
+DI_RESPONSE = {
+    "content_markdown": "# 表紙\n\n<!-- PageBreak -->\n\n# 概要\n\n本文",
+    "pages": [
+        {"page_number": 1, "lines": [{"content": "表紙"}]},
+        {"page_number": 2, "lines": [{"content": "概要"}, {"content": "本文"}]},
+    ],
+}
+
+def test_build_page_texts_uses_markdown_per_page():
+    assert build_page_texts(DI_RESPONSE) == [(1, "# 表紙"), (2, "# 概要\n\n本文")]
+
+def test_build_page_texts_falls_back_to_lines():
+    di_response = dict(DI_RESPONSE, content_markdown="# 表紙")
+
+    assert build_page_texts(di_response) == [(1, "表紙"), (2, "概要\n本文")]
+
+def test_build_page_windows_respects_token_budget():
+    page_texts = [(1, "あ" * 10), (2, "い" * 10), (3, "う" * 25)]
+
+    windows = build_page_windows(page_texts, window_tokens=20)
+
+    assert [[page_number for page_number, _ in window] for window in windows] == [[1, 2], [3]]
+
+def test_merge_categories_deduplicates_names_and_pages():
+    partials = [
+        [Category(category="概要", page_numbers=[1, 2]), Category(category="料金", page_numbers=[2])],
+        [Category(category="概 要", page_numbers=[3]), Category(category="ＦＡＱ", page_numbers=[3, 99])],
+    ]
+
+    merged = merge_categories(partials, valid_page_numbers={1, 2, 3})
+
+    assert [(c.category, c.page_numbers) for c in merged] == [
+        ("概要", [1, 2, 3]), ("料金", [2]), ("ＦＡＱ", [3])]
@@ -0,0 +1,26 @@
+from domains.analyze_categories import Category, Page
+from services.cache.extraction_cache import build_extraction_cache_key, build_page_content_hashes
+
+
+def _page(page_number, *lines, **extra):
+    return Page(page_number=page_number, lines=[{"content": line, **extra} for line in lines])
+
+def test_page_hashes_ignore_layout_fields():
+    full = _page(1, "背景", "本文", polygon=[0.1, 0.2], spans=[])
+    compact = _page(1, "背景", "本文")
+
+    assert build_page_content_hashes([full]) == build_page_content_hashes([compact])
+    assert build_page_content_hashes([full]) != build_page_content_hashes([_page(1, "背景", "変更後")])
+
+def test_extraction_cache_key_depends_on_category_pages_deployment_and_version():
+    category = Category(category="背景", page_numbers=[1])
+    pages = [_page(1, "背景", "本文")]
+    key = build_extraction_cache_key(category, pages, "gpt-4o-mini", "1")
+
+    assert key.startswith("extraction:")
+    assert key == build_extraction_cache_key(category, pages, "gpt-4o-mini", "1")
+    assert key != build_extraction_cache_key(Category(category="まとめ", page_numbers=[1]), pages, "gpt-4o-mini", "1")
+    assert key != build_extraction_cache_key(Category(category="背景", page_numbers=[1, 2]), pages, "gpt-4o-mini", "1")
+    assert key != build_extraction_cache_key(category, [_page(1, "背景", "変更後")], "gpt-4o-mini", "1")
+    assert key != build_extraction_cache_key(category, pages, "gpt-4o", "1")
+    assert key != build_extraction_cache_key(category, pages, "gpt-4o-mini", "2")
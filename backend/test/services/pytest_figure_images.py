@@ -0,0 +1,59 @@
+from domains.document_model import DocumentPages
+from services import figure_images
+from services.cache.cache_backend import DiskCache
+
+
+def _pages():
+    return DocumentPages.from_pages([
+        {
+            "page_number": page_number,
+            "width": 8.0,
+            "height": 10.0,
+            "lines": [],
+            "figures": [{"id": f"{page_number}.1", "spans": [], "elements": [],
+                         "bounding_regions": [{"pageNumber": page_number, "polygon": [1.0, 2.0, 5.0, 2.0, 5.0, 6.0, 1.0, 6.0]}]}],
+        }
+        for page_number in (1, 2, 3)
+    ])
+
+
+def test_crop_box_scales_polygon_to_rendered_image():
+    page = _pages()[0]
+
+    # 8x10インチのページを 800x1000 ピクセルで描画した場合
+    assert figure_images._crop_box(page, page.figures[0].bounding_regions[0].polygon, (800, 1000)) == (100, 200, 501, 601)
+    assert figure_images._crop_box(page, [1.0, 2.0], (800, 1000)) is None
+
+
+def _use_caches(tmp_path, monkeypatch):
+    caches = (DiskCache(str(tmp_path / "source"), max_entries=4), DiskCache(str(tmp_path / "image"), max_entries=16))
+    monkeypatch.setattr(figure_images, "get_figure_caches", lambda: caches)
+    monkeypatch.setattr(figure_images, "figure_images_available", lambda: True)
+    return caches
+
+
+def test_renders_only_requested_pages_once_and_caches(tmp_path, monkeypatch):
+    _, image_cache = _use_caches(tmp_path, monkeypatch)
+    document_hash = figure_images.register_figure_source(b"%PDF", {"pages": [{"figures": [{"id": "1.1"}]}]})
+    rendered = []
+
+    def render(pdf_binary, page, figures, max_size):
+        assert pdf_binary == b"%PDF"
+        rendered.append(page.page_number)
+        return {figure.id: f"png-{figure.id}".encode() for figure in figures}
+
+    monkeypatch.setattr(figure_images, "_render_page_figures", render)
+
+    first = figure_images.get_figure_images(document_hash, _pages(), [2, 3], max_size=256)
+    second = figure_images.get_figure_images(document_hash, _pages(), [2, 3], max_size=256)
+
+    assert first == second == {2: [b"png-2.1"], 3: [b"png-3.1"]}
+    assert rendered == [2, 3]
+    assert len(image_cache) == 2
+
+
+def test_unknown_document_returns_no_images(tmp_path, monkeypatch):
+    _use_caches(tmp_path, monkeypatch)
+
+    assert figure_images.get_figure_images("../../etc", _pages(), [1]) == {}
+    assert figure_images.register_figure_source(b"%PDF", {"pages": [{"figures": []}]}) is None
@@ -0,0 +1,79 @@
+import time
+import pytest
+from services.jobs.job_store import MemoryJobStore, SQLiteJobStore, INTERRUPTED_JOB_ERROR
+from services.jobs.job_worker import JobWorker
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryJobStore()
+    return SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+
+def test_job_succeeds_with_stage_progress(store):
+    worker = JobWorker(store, max_concurrency=1)
+
+    def job_func(report_stage):
+        report_stage("ocr", "running")
+        report_stage("ocr", "succeeded")
+        report_stage("classification", "running")
+        report_stage("classification", "succeeded")
+        return {"categories": []}
+
+    job = worker.submit("analyze_document_structure", job_func)
+    assert job["status"] == "queued"
+    worker.shutdown()
+
+    job = store.get(job["job_id"])
+    assert job["status"] == "succeeded"
+    assert job["result"] == {"categories": []}
+    assert [(stage["stage"], stage["status"]) for stage in job["stages"]] == [
+        ("ocr", "succeeded"), ("classification", "succeeded")]
+    assert all(stage["finished_at"] is not None for stage in job["stages"])
+
+def test_job_failure_is_recorded(store):
+    worker = JobWorker(store, max_concurrency=1)
+
+    def job_func(report_stage):
+        report_stage("ocr", "running")
+        raise ValueError("Failed to analyze document")
+
+    job = worker.submit("analyze_document_structure", job_func)
+    worker.shutdown()
+
+    job = store.get(job["job_id"])
+    assert job["status"] == "failed"
+    assert job["error"] == "Failed to analyze document"
+    assert job["stages"][0]["status"] == "failed"
+
+def test_unknown_job_returns_none(store):
+    assert store.get("missing") is None
+
+def test_expired_jobs_are_removed(store, monkeypatch):
+    store.retention_seconds = 60
+    old = store.create("analyze_document_structure")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+
+    new = store.create("analyze_document_structure")
+
+    assert store.get(old["job_id"]) is None
+    assert store.get(new["job_id"])["status"] == "queued"
+
+def test_reopened_sqlite_store_fails_interrupted_jobs(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    store = SQLiteJobStore(path)
+    queued = store.create("analyze_document_structure")
+    running = store.create("analyze_document_structure")
+    store.set_status(running["job_id"], "running")
+    store.set_stage(running["job_id"], "ocr", "running")
+    succeeded = store.create("analyze_document_structure")
+    store.set_status(succeeded["job_id"], "succeeded", result={"categories": []})
+
+    reopened = SQLiteJobStore(path)
+
+    for job_id in (queued["job_id"], running["job_id"]):
+        job = reopened.get(job_id)
+        assert job["status"] == "failed"
+        assert job["error"] == INTERRUPTED_JOB_ERROR
+    assert reopened.get(running["job_id"])["stages"][0]["status"] == "failed"
+    assert reopened.get(succeeded["job_id"])["status"] == "succeeded"
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+import httpx
+import openai
+import pytest
+from services.azure import rate_limiter
+from services.azure.rate_limiter import RateLimitScheduler, TokenBucket, PRIORITY_CLASSIFICATION, PRIORITY_EXTRACTION
+
+
+def _rate_limit_error(headers):
+    request = httpx.Request("POST", "https://example.com")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(capacity_per_minute=60)
+    now = time.monotonic()
+    bucket.consume(60, now)
+
+    assert bucket.wait_time(30, now) == pytest.approx(30.0)
+    assert TokenBucket(None).wait_time(10 ** 9, now) == 0.0
+
+def test_run_retries_and_honours_retry_after():
+    scheduler = RateLimitScheduler("gpt-4o-mini", max_retries=2)
+    calls = []
+
+    def call():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise _rate_limit_error({"retry-after-ms": "50"})
+        return "ok"
+
+    assert scheduler.run(call, estimated_tokens=10) == "ok"
+    assert calls[1] - calls[0] >= 0.05
+    metrics = scheduler.metrics()
+    assert metrics["rate_limit_errors"] == 1
+    assert metrics["retries"] == 1
+    assert metrics["queue_depth"] == 0
+
+def test_failed_attempt_refunds_estimated_tokens():
+    scheduler = RateLimitScheduler("refund", tpm=1000)
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) == 1:
+            raise _rate_limit_error({"retry-after-ms": "1"})
+        return "ok"
+
+    assert scheduler.run(call, estimated_tokens=300) == "ok"
+    # 失敗した1回目の300トークンは返却され、成功した2回目の分だけが減っている
+    assert scheduler._tokens.tokens == pytest.approx(700, abs=5)
+
+def test_failed_attempt_refunds_request_slot():
+    scheduler = RateLimitScheduler("refund-rpm", rpm=60)
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) == 1:
+            raise _rate_limit_error({"retry-after-ms": "1"})
+        return "ok"
+
+    assert scheduler.run(call, estimated_tokens=1) == "ok"
+    # リクエスト数の枠は、成功した1回分だけが減っている
+    assert scheduler._requests.tokens == pytest.approx(59, abs=0.1)
+
+def test_run_raises_after_max_retries():
+    scheduler = RateLimitScheduler("gpt-4o-mini", max_retries=1)
+
+    def call():
+        raise _rate_limit_error({"retry-after-ms": "1"})
+
+    with pytest.raises(openai.RateLimitError):
+        scheduler.run(call, estimated_tokens=10)
+
+def test_higher_priority_is_served_first():
+    # TPMの枠を使い切った状態で、優先度の異なる2つのリクエストを待機させる
+    scheduler = RateLimitScheduler("shared", tpm=600)
+    scheduler.acquire(600)
+    order = []
+
+    def wait(priority, label):
+        scheduler.acquire(3, priority)
+        order.append(label)
+
+    extraction = threading.Thread(target=wait, args=(PRIORITY_EXTRACTION, "extraction"))
+    extraction.start()
+    time.sleep(0.1)
+    classification = threading.Thread(target=wait, args=(PRIORITY_CLASSIFICATION, "classification"))
+    classification.start()
+    extraction.join(timeout=5)
+    classification.join(timeout=5)
+
+    assert order == ["classification", "extraction"]
+
+def test_quota_group_shares_one_scheduler(monkeypatch):
+    monkeypatch.setenv("AOAI_QUOTA_GROUPS", '{"shared": {"deployments": ["group-4o", "group-4o-mini"], "tpm": 600}}')
+    monkeypatch.setattr(rate_limiter, "_schedulers", {})
+
+    classification = rate_limiter.get_rate_limit_scheduler("group-4o")
+    extraction = rate_limiter.get_rate_limit_scheduler("group-4o-mini")
+
+    # 分類と抽出が同じキューで待機するため、優先度が効く
+    assert classification is extraction
+    assert classification.name == "shared"
+    assert classification._tokens.capacity == 600
+    assert list(rate_limiter.get_rate_limit_metrics()) == ["shared"]
+    assert rate_limiter.get_rate_limit_scheduler("other") is not classification
+
+def test_async_waiter_is_woken_when_its_turn_comes():
+    scheduler = RateLimitScheduler("async-wake", tpm=600)
+    scheduler.acquire(600)
+
+    async def scenario():
+        first = asyncio.ensure_future(scheduler.acquire_async(3))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(scheduler.acquire_async(3))
+        await asyncio.wait_for(asyncio.gather(first, second), timeout=5)
+
+    started = time.monotonic()
+    asyncio.run(scenario())
+    # 2番目は先頭が枠を確保した時点で起こされ、自分の待ち時間（0.3秒）だけ待つ
+    assert time.monotonic() - started < 2.0
+    assert scheduler.metrics()["queue_depth"] == 0
+
+def test_cancelled_async_waiter_leaves_queue():
+    scheduler = RateLimitScheduler("async", rpm=1)
+
+    async def scenario():
+        await scheduler.acquire_async(1)
+        task = asyncio.ensure_future(scheduler.acquire_async(1))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert scheduler.metrics()["queue_depth"] == 0
@@ -0,0 +1,92 @@
+from domains.analyze_categories import Category
+from services import revision_analysis
+from services.cache.cache_backend import MemoryLRUCache
+from services.cache.revision_store import build_revision_key
+from services.revision_analysis import (
+    RevisionPlan, build_text_page_hashes, match_pages, merge_revision_response, plan_revision, remap_categories,
+    renumber_page,
+)
+from utils.analyze_result_merge import STRING_INDEX_TYPE
+
+
+def _page(page_number, text):
+    return {
+        "page_number": page_number,
+        "lines": [{"content": text}],
+        "tables": [],
+        "figures": [{"id": f"{page_number}.1", "bounding_regions": [{"pageNumber": page_number, "polygon": [0.1]}]}],
+    }
+
+PREVIOUS = {
+    "classification_prompt": "背景",
+    "categories": [{"category": "表紙", "page_numbers": [1]}, {"category": "背景", "page_numbers": [2, 3]}],
+    "content_markdown": "# 表紙\n\n<!-- PageBreak -->\n\n背景\n\n<!-- PageBreak -->\n\nまとめ",
+    "pages": [_page(1, "表紙"), _page(2, "背景"), _page(3, "まとめ")],
+}
+
+def test_match_pages_detects_inserted_and_moved_pages():
+    page_map, changed_pages = match_pages(["a", "x", "b", "c"], ["a", "b", "c"])
+
+    assert page_map == {1: 1, 3: 2, 4: 3}
+    assert changed_pages == [2]
+
+def test_remap_categories_drops_changed_pages():
+    categories = remap_categories(
+        [Category(category="背景", page_numbers=[2, 3])], {1: 1, 3: 2})
+
+    assert categories == [Category(category="背景", page_numbers=[3])]
+
+def test_renumber_page_updates_bounding_regions():
+    page = renumber_page(_page(2, "背景"), 5)
+
+    assert page["page_number"] == 5
+    assert page["figures"][0]["bounding_regions"] == [{"pageNumber": 5, "polygon": [0.1]}]
+
+def test_merge_revision_response_reuses_unchanged_pages():
+    plan = RevisionPlan("doc", PREVIOUS, ["h1", "new", "h2", "h3"])
+    plan.match(plan.pdf_page_hashes, ["h1", "h2", "h3"])
+    partial = {"content_markdown": "追加", "pages": [_page(2, "追加")]}
+
+    merged = merge_revision_response(plan, partial)
+
+    assert [page["page_number"] for page in merged["pages"]] == [1, 2, 3, 4]
+    assert [page["lines"][0]["content"] for page in merged["pages"]] == ["表紙", "追加", "背景", "まとめ"]
+    assert merged["content_markdown"].split("\n\n<!-- PageBreak -->\n\n") == ["# 表紙", "追加", "背景", "まとめ"]
+    assert plan.previous_categories("背景") == [
+        Category(category="表紙", page_numbers=[1]), Category(category="背景", page_numbers=[3, 4])]
+    assert plan.previous_categories("別の指示") is None
+
+def test_text_page_hashes_ignore_page_numbers():
+    assert build_text_page_hashes([_page(1, "背景")]) == build_text_page_hashes([_page(7, "背景")])
+
+def test_merge_revision_response_shifts_spans_into_merged_markdown():
+    def page(page_number, markdown, text, offset):
+        span = {"offset": offset + markdown.index(text), "length": len(text)}
+        return {"page_number": page_number, "lines": [{"content": text, "spans": [span]}],
+                "tables": [], "figures": []}
+
+    previous_markdown = ["# 表紙", "背景の説明", "まとめ"]
+    previous = dict(PREVIOUS, content_markdown="\n\n<!-- PageBreak -->\n\n".join(previous_markdown), pages=[
+        page(1, previous_markdown[0], "表紙", 0),
+        page(2, previous_markdown[1], "説明", len("# 表紙") + 22),
+        page(3, previous_markdown[2], "まとめ", len("# 表紙") + len("背景の説明") + 44),
+    ])
+    plan = RevisionPlan("doc", previous, ["h1", "new", "h2", "h3"])
+    plan.match(plan.pdf_page_hashes, ["h1", "h2", "h3"])
+    partial = {"content_markdown": "追加のページ", "pages": [page(2, "追加のページ", "ページ", 0)]}
+
+    merged = merge_revision_response(plan, partial)
+
+    markdown = merged["content_markdown"]
+    assert [markdown[span["offset"]:span["offset"] + span["length"]]
+            for page in merged["pages"] for span in page["lines"][0]["spans"]] == ["表紙", "ページ", "説明", "まとめ"]
+
+def test_plan_revision_ignores_previous_result_with_other_string_index_type(monkeypatch):
+    store = MemoryLRUCache(max_entries=4)
+    monkeypatch.setattr(revision_analysis, "get_revision_store", lambda: store)
+
+    store.set(build_revision_key("doc"), dict(PREVIOUS, string_index_type="textElements"))
+    assert plan_revision("doc", b"%PDF-1.7").previous is None
+
+    store.set(build_revision_key("doc"), dict(PREVIOUS, string_index_type=STRING_INDEX_TYPE))
+    assert plan_revision("doc", b"%PDF-1.7").previous is not None
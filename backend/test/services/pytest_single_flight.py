@@ -0,0 +1,64 @@
+import asyncio
+import threading
+import time
+from services.cache.single_flight import SingleFlight, build_single_flight_key
+
+
+def test_concurrent_threads_share_one_execution():
+    single_flight = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+    executions = []
+
+    def work():
+        executions.append(1)
+        started.set()
+        release.wait(5)
+        return {"pages": 3}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(single_flight.do("key", work)))
+    leader.start()
+    started.wait(5)
+    waiters = [threading.Thread(target=lambda: results.append(single_flight.do("key", work))) for _ in range(4)]
+    for thread in waiters:
+        thread.start()
+    while single_flight.metrics()["coalesced"] < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader, *waiters]:
+        thread.join(5)
+
+    assert len(executions) == 1
+    assert sorted(coalesced for _, coalesced in results) == [False, True, True, True, True]
+    assert all(result == {"pages": 3} for result, _ in results)
+    assert single_flight.metrics() == {"calls": 5, "executions": 1, "coalesced": 4, "in_flight": 0}
+
+def test_async_duplicates_share_result_and_errors():
+    single_flight = SingleFlight("test")
+    executions = []
+
+    async def work(value):
+        executions.append(value)
+        await asyncio.sleep(0.01)
+        if value == "error":
+            raise RuntimeError("upstream failed")
+        return value
+
+    async def main():
+        shared = await asyncio.gather(*[single_flight.do_async("a", lambda: work("a")) for _ in range(3)])
+        other = await single_flight.do_async("b", lambda: work("b"))
+        errors = await asyncio.gather(
+            *[single_flight.do_async("c", lambda: work("error")) for _ in range(2)], return_exceptions=True)
+        return shared, other, errors
+
+    shared, other, errors = asyncio.run(main())
+
+    assert shared == [("a", False), ("a", True), ("a", True)]
+    assert other == ("b", False)
+    assert all(isinstance(error, RuntimeError) for error in errors)
+    assert executions == ["a", "b", "error"]
+    assert single_flight.metrics()["coalesced"] == 3
+
+def test_key_depends_on_part_boundaries():
+    assert build_single_flight_key(b"ab", "c") == build_single_flight_key(b"ab", "c")
+    assert build_single_flight_key(b"ab", "c") != build_single_flight_key(b"a", "bc")
@@ -0,0 +1,38 @@
+import pytest
+from services.telemetry import token_accounting
+from services.telemetry.token_accounting import (
+    PromptBudgetExceededError, check_prompt_budget, count_prompt_sections, record_token_usage,
+    start_token_account, trim_budget_for,
+)
+
+def test_account_collects_sections_and_usage():
+    account = start_token_account()
+
+    count_prompt_sections({"markdown": "あいう", "pages": "abcd"})
+    record_token_usage("extraction", "gpt-4o-mini", 10, {
+        "prompt_tokens": 9, "completion_tokens": 5, "total_tokens": 14, "cached_tokens": 0})
+    record_token_usage("extraction", "gpt-4o-mini", 7, None)
+
+    summary = account.summary()
+    assert summary["sections"] == {"markdown": 3, "pages": 1}
+    assert summary["calls"] == 2
+    assert summary["estimated_prompt_tokens"] == 17
+    assert summary["prompt_tokens"] == 9
+    assert summary["stages"]["extraction"]["completion_tokens"] == 5
+    assert account.response_headers()["X-Token-Sections"] == "markdown=3, pages=1"
+
+def test_check_prompt_budget(monkeypatch):
+    monkeypatch.setattr(token_accounting, "PROMPT_TOKEN_BUDGET", 100)
+
+    check_prompt_budget("classification", 100)
+    with pytest.raises(PromptBudgetExceededError):
+        check_prompt_budget("classification", 101)
+
+def test_trim_budget_for(monkeypatch):
+    monkeypatch.setattr(token_accounting, "PROMPT_TOKEN_BUDGET", 100)
+    monkeypatch.setattr(token_accounting, "PROMPT_BUDGET_ACTION", "trim")
+    assert trim_budget_for(30) == 70
+    assert trim_budget_for(130) == 0
+
+    monkeypatch.setattr(token_accounting, "PROMPT_BUDGET_ACTION", "reject")
+    assert trim_budget_for(30) is None
@@ -0,0 +1,57 @@
+import asyncio
+from services.telemetry import profiling
+from services.telemetry.tracing import span, start_trace, traced_route
+
+
+class FakeRequest:
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+
+
+class FakeResponse:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.headers = {}
+
+
+def test_spans_record_parent_and_server_timing():
+    trace = start_trace("test")
+
+    with span("ocr"):
+        with span("di_analyze", pages="1-2"):
+            pass
+    with span("openai"):
+        pass
+    with span("openai"):
+        pass
+
+    names = [(s["name"], s["parent"]) for s in trace.spans]
+    assert names == [("di_analyze", "ocr"), ("ocr", None), ("openai", None), ("openai", None)]
+    assert trace.spans[0]["attributes"] == {"pages": "1-2"}
+    server_timing = trace.server_timing()
+    assert server_timing.startswith("di_analyze;dur=")
+    assert 'openai;dur=' in server_timing and 'desc="2 calls"' in server_timing
+    assert "total;dur=" in server_timing
+
+def test_traced_route_adds_server_timing_header():
+    @traced_route("route")
+    async def route(req):
+        with span("parse_request"):
+            pass
+        return FakeResponse()
+
+    response = asyncio.run(route(FakeRequest()))
+
+    assert response.headers["Server-Timing"].startswith("parse_request;dur=")
+
+def test_profiling_requires_opt_in(monkeypatch):
+    @traced_route("route")
+    def route(req):
+        return FakeResponse()
+
+    response = route(FakeRequest({"X-Profile": "memory"}))
+    assert "X-Profile-Peak-Memory" not in response.headers
+
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", True)
+    response = route(FakeRequest({"X-Profile": "cpu,memory"}))
+    assert int(response.headers["X-Profile-Peak-Memory"]) >= 0
@@ -0,0 +1,67 @@
+from utils.analyze_result_merge import merge_analyze_results, PAGE_BREAK
+from utils.pdf_utils import build_page_ranges, count_pdf_pages, format_page_numbers
+
+
+def _shard(page_number, content, figure_id):
+    return {
+        "modelId": "prebuilt-layout",
+        "content": content,
+        "pages": [{
+            "pageNumber": page_number,
+            "spans": [{"offset": 0, "length": len(content)}],
+            "lines": [{"content": content, "spans": [{"offset": 0, "length": len(content)}]}],
+            "words": [{"content": content, "span": {"offset": 0, "length": len(content)}}],
+            "selectionMarks": [{"state": "selected", "span": {"offset": 0, "length": len(content)}}],
+        }],
+        "paragraphs": [{"content": content, "spans": [{"offset": 0, "length": len(content)}]}],
+        "figures": [{
+            "id": figure_id,
+            "spans": [{"offset": 0, "length": len(content)}],
+            "elements": ["/paragraphs/0"],
+        }],
+    }
+
+def test_merge_concatenates_content_and_shifts_offsets():
+    merged = merge_analyze_results([_shard(1, "ページ1", "1.1"), _shard(2, "ページ2", "2.1")])
+
+    assert merged["modelId"] == "prebuilt-layout"
+    assert merged["content"] == "ページ1" + PAGE_BREAK + "ページ2"
+    assert [page["pageNumber"] for page in merged["pages"]] == [1, 2]
+
+    second_offset = len("ページ1" + PAGE_BREAK)
+    line_span = merged["pages"][1]["lines"][0]["spans"][0]
+    assert line_span["offset"] == second_offset
+    assert merged["content"][line_span["offset"]:line_span["offset"] + line_span["length"]] == "ページ2"
+    assert merged["figures"][1]["spans"][0]["offset"] == second_offset
+
+def test_merge_shifts_word_and_selection_mark_spans():
+    merged = merge_analyze_results([_shard(1, "ページ1", "1.1"), _shard(2, "ページ2", "2.1")])
+
+    second_offset = len("ページ1" + PAGE_BREAK)
+    first_page, second_page = merged["pages"]
+    assert first_page["words"][0]["span"]["offset"] == 0
+    assert first_page["selectionMarks"][0]["span"]["offset"] == 0
+    word_span = second_page["words"][0]["span"]
+    assert word_span["offset"] == second_offset
+    assert merged["content"][word_span["offset"]:word_span["offset"] + word_span["length"]] == "ページ2"
+    assert second_page["selectionMarks"][0]["span"]["offset"] == second_offset
+
+def test_merge_renumbers_element_references():
+    merged = merge_analyze_results([_shard(1, "a", "1.1"), _shard(2, "b", "2.1")])
+
+    assert merged["figures"][0]["elements"] == ["/paragraphs/0"]
+    assert merged["figures"][1]["elements"] == ["/paragraphs/1"]
+    assert merged["paragraphs"][1]["content"] == "b"
+
+def test_build_page_ranges():
+    assert build_page_ranges(120, 50) == ["1-50", "51-100", "101-120"]
+    assert build_page_ranges(51, 50) == ["1-50", "51"]
+
+def test_format_page_numbers():
+    assert format_page_numbers([9, 1, 2, 3, 7, 10]) == "1-3,7,9-10"
+    assert format_page_numbers([]) == ""
+
+def test_count_pdf_pages_from_page_objects():
+    pdf_binary = b"%PDF-1.4 /Type /Pages /Count 2 /Type /Page /Type/Page %%EOF"
+
+    assert count_pdf_pages(pdf_binary) == 2
@@ -0,0 +1,32 @@
+import gzip
+from utils import http_compression
+from utils.http_compression import compress_body, compress_chunks, negotiate_encoding
+
+def test_negotiate_encoding(monkeypatch):
+    monkeypatch.setattr(http_compression, "brotli", None)
+
+    assert negotiate_encoding("gzip, deflate, br") == "gzip"
+    assert negotiate_encoding("gzip;q=0, deflate") is None
+    assert negotiate_encoding(None) is None
+
+def test_compress_body_gzip(monkeypatch):
+    monkeypatch.setattr(http_compression, "brotli", None)
+    body = ("あいうえお" * 1000).encode("utf-8")
+
+    compressed, headers = compress_body(body, "gzip")
+
+    assert headers == {"Vary": "Accept-Encoding", "Content-Encoding": "gzip"}
+    assert gzip.decompress(compressed) == body
+
+def test_compress_body_skips_small_bodies():
+    assert compress_body(b"{}", "gzip") == (b"{}", {"Vary": "Accept-Encoding"})
+
+def test_compress_chunks_matches_compress_body(monkeypatch):
+    monkeypatch.setattr(http_compression, "brotli", None)
+    chunks = [("あいうえお" * 100).encode("utf-8") for _ in range(10)]
+
+    compressed, headers = compress_chunks(iter(chunks), "gzip")
+
+    assert headers == {"Vary": "Accept-Encoding", "Content-Encoding": "gzip"}
+    assert gzip.decompress(compressed) == b"".join(chunks)
+    assert compress_chunks([b"{", b"}"], "gzip") == compress_body(b"{}", "gzip")
@@ -0,0 +1,33 @@
+import html
+import json
+from collections.abc import Mapping
+from utils import json_stream
+from utils.json_stream import dumps, iter_json_string
+
+class _Model(Mapping):
+    def __init__(self, **values):
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+def test_dumps_encodes_sdk_models_as_objects():
+    region = _Model(pageNumber=3, polygon=[0.1, 0.2], spans=[_Model(offset=0, length=4)])
+
+    assert json.loads(dumps({"bounding_regions": [region]})) == {
+        "bounding_regions": [{"pageNumber": 3, "polygon": [0.1, 0.2], "spans": [{"offset": 0, "length": 4}]}],
+    }
+
+def test_iter_json_string_matches_whole_string_encoding(monkeypatch):
+    monkeypatch.setattr(json_stream, "JSON_STREAM_CHUNK_CHARS", 3)
+    text = '表<a href="x">\n</a> & \'末尾\''
+
+    encoded = b"".join(iter_json_string(text, escape_html=True)).decode("utf-8")
+
+    assert encoded == json.dumps(html.escape(text), ensure_ascii=False)
@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+from utils.page_projection import compact_page, parse_fields, project, shape_pages
+
+PAGE = {
+    "page_number": 1,
+    "width": 10.0,
+    "height": 7.5,
+    "lines": [{"content": "独立行政法人", "polygon": [0.97171, 0.2136, 2.0535, 0.2101], "spans": [{"offset": 10, "length": 6}]}],
+    "tables": [{
+        "row_count": 1,
+        "column_count": 1,
+        "cells": [{"row_index": 0, "column_index": 0, "content": "お名前", "bounding_regions": ["..."]}],
+    }],
+    "figures": [{
+        "id": "1.1",
+        "bounding_regions": [SimpleNamespace(page_number=1, polygon=[0.18523, 0.109])],
+        "spans": [{"offset": 0, "length": 36}],
+        "elements": ["/paragraphs/0"],
+    }],
+}
+
+def test_parse_fields_builds_nested_projection():
+    assert parse_fields("page_number, lines.content") == {"page_number": True, "lines": {"content": True}}
+    assert parse_fields("lines,lines.content") == {"lines": True}
+    assert parse_fields("") is None
+
+def test_project_keeps_only_requested_fields():
+    projected = project([PAGE], parse_fields("page_number,lines.content"))
+
+    assert projected == [{"page_number": 1, "lines": [{"content": "独立行政法人"}]}]
+
+def test_compact_page_flattens_polygons_and_drops_spans():
+    page = compact_page(PAGE)
+
+    assert page["lines"] == [{"content": "独立行政法人"}]
+    assert page["tables"][0]["cells"] == [{"row_index": 0, "column_index": 0, "content": "お名前"}]
+    assert page["figures"] == [{"id": "1.1", "bounding_regions": [{"page_number": 1, "polygon": [0.1852, 0.109]}]}]
+
+def test_shape_pages_without_options_returns_pages_unchanged():
+    assert shape_pages([PAGE]) == [PAGE]
@@ -0,0 +1,41 @@
+from utils.retrieval import BM25Index, get_markdown_index, split_markdown_chunks, tokenize
+
+MARKDOWN = "\n\n<!-- PageBreak -->\n\n".join([
+    "# 消費者トラブルの現状\n\n令和6年4月30日",
+    "# フィッシング\n\n通販サイトなどを装った偽SMSや偽メールが届く。フィッシングサイトに誘導される。",
+    "# サポート詐欺\n\nパソコンに偽の警告画面が表示され、サポート窓口に電話をかけさせる。",
+    "# 定期購入\n\n初回のみ無料と思って申し込んだら定期購入だった。",
+])
+
+def test_tokenize_uses_character_bigrams():
+    assert tokenize("偽 SMS") == ["偽s", "sm", "ms"]
+    assert tokenize("偽") == ["偽"]
+
+def test_split_markdown_chunks_by_page():
+    chunks = split_markdown_chunks(MARKDOWN)
+
+    assert [chunk["page_number"] for chunk in chunks] == [1, 2, 3, 4]
+    assert chunks[2]["text"].startswith("# サポート詐欺")
+
+def test_split_markdown_chunks_splits_long_pages():
+    chunks = split_markdown_chunks("あ" * 10 + "\n\n" + "い" * 10, max_chars=15)
+
+    assert [chunk["text"] for chunk in chunks] == ["あ" * 10, "い" * 10]
+
+def test_search_ranks_relevant_page_first():
+    index = BM25Index(split_markdown_chunks(MARKDOWN))
+
+    results = index.search("フィッシング")
+
+    assert index.chunks[results[0][1]]["page_number"] == 2
+    assert all(index.chunks[i]["page_number"] != 4 for _, i in results)
+
+def test_select_context_respects_budget_and_required_pages():
+    index = BM25Index(split_markdown_chunks(MARKDOWN))
+
+    selected = index.select_context("サポート詐欺", token_budget=70, required_pages=[4])
+
+    assert [chunk["page_number"] for chunk in selected] == [3, 4]
+
+def test_markdown_index_is_reused():
+    assert get_markdown_index(MARKDOWN) is get_markdown_index(MARKDOWN)
@@ -0,0 +1,82 @@
+import re
+from typing import List
+
+# Markdown出力でページの境界に挿入される区切り
+PAGE_BREAK = "\n\n<!-- PageBreak -->\n\n"
+# spansのoffsetの単位（Document IntelligenceのstringIndexType）
+# シャードや改訂版のページの結合時にPythonの文字列長でoffsetをずらせるよう、すべての解析でコードポイント単位にする
+STRING_INDEX_TYPE = "unicodeCodePoint"
+
+_ELEMENT_REFERENCE_PATTERN = re.compile(r"^/(\w+)/(\d+)$")
+
+
+def _shift_spans(node, offset_delta: int, index_deltas: dict) -> None:
+    """
+    解析結果の辞書を再帰的にたどり、spans・span（words・selectionMarks）のoffsetと
+    要素参照（例: "/paragraphs/3"）を付け替える
+    """
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "spans" and isinstance(value, list):
+                for span in value:
+                    if isinstance(span, dict) and "offset" in span:
+                        span["offset"] += offset_delta
+            elif key == "span" and isinstance(value, dict) and "offset" in value:
+                value["offset"] += offset_delta
+            elif key == "elements" and isinstance(value, list):
+                node[key] = [_shift_element_reference(
+                    element, index_deltas) for element in value]
+            else:
+                _shift_spans(value, offset_delta, index_deltas)
+    elif isinstance(node, list):
+        for item in node:
+            _shift_spans(item, offset_delta, index_deltas)
+
+
+def _shift_element_reference(element, index_deltas: dict):
+    if not isinstance(element, str):
+        return element
+    match = _ELEMENT_REFERENCE_PATTERN.match(element)
+    if not match or match.group(1) not in index_deltas:
+        return element
+    collection, index = match.group(1), int(match.group(2))
+    return f"/{collection}/{index + index_deltas[collection]}"
+
+
+def merge_analyze_results(results: List[dict]) -> dict:
+    """
+    ページ範囲ごとに解析したAnalyzeResult（as_dict()の辞書）を、1つの解析結果に結合する
+    - content: ページ区切りを挟んで連結し、後続シャードのspansのoffsetをずらす
+    - pages/tables/figures/paragraphs などの配列: 連結し、要素参照のインデックスをずらす
+    前提: 各シャードはページ順に並んでおり、offsetはUnicodeコードポイント単位であること
+    """
+    if not results:
+        raise ValueError("results must not be empty.")
+
+    merged = {key: value for key, value in results[0].items()
+              if not isinstance(value, list)}
+    merged["content"] = ""
+    list_keys = []
+    for result in results:
+        for key, value in result.items():
+            if isinstance(value, list) and key not in list_keys:
+                list_keys.append(key)
+    for key in list_keys:
+        merged[key] = []
+
+    for result in results:
+        content = result.get("content", "")
+        offset_delta = 0
+        if merged["content"]:
+            merged["content"] += PAGE_BREAK
+            offset_delta = len(merged["content"])
+        index_deltas = {key: len(merged[key]) for key in list_keys}
+
+        _shift_spans({key: result[key] for key in list_keys if key in result},
+                     offset_delta, index_deltas)
+
+        merged["content"] += content
+        for key in list_keys:
+            merged[key].extend(result.get(key, []))
+
+    return merged
@@ -0,0 +1,108 @@
+import gzip
+import io
+import os
+import zlib
+from typing import Dict, Iterable, Optional, Tuple
+
+try:
+    # brotliがインストールされている場合は br にも対応する（任意の依存関係）
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# これより小さいレスポンスは圧縮しない（バイト）
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Accept-Encodingヘッダーから使用する圧縮方式（br / gzip）を選ぶ。対応する方式がなければNone
+    q=0 が指定された方式は使わない
+    """
+    accepted: Dict[str, float] = {}
+    for item in (accept_encoding or "").split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        accepted[name.lower()] = quality
+
+    def allowed(encoding: str) -> bool:
+        return accepted.get(encoding, accepted.get("*", 0.0)) > 0
+
+    if brotli is not None and allowed("br"):
+        return "br"
+    if allowed("gzip"):
+        return "gzip"
+    return None
+
+
+def compress_body(body: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, Dict[str, str]]:
+    """
+    クライアントが受け付ける場合にレスポンスボディを圧縮する
+    :return: (ボディ, レスポンスに追加するヘッダー)
+    """
+    headers = {"Vary": "Accept-Encoding"}
+    if len(body) < COMPRESSION_MIN_BYTES:
+        return body, headers
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding == "br":
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+    elif encoding == "gzip":
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+    else:
+        return body, headers
+    headers["Content-Encoding"] = encoding
+    return body, headers
+
+
+class _BrotliCompressor:
+    """brotli.Compressor を zlib の圧縮オブジェクトと同じ compress・flush で扱う"""
+
+    def __init__(self) -> None:
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+def _create_compressor(encoding: str):
+    if encoding == "br":
+        return _BrotliCompressor()
+    # wbits に16を加えると gzip 形式（ヘッダー・CRC付き）で出力する
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def compress_chunks(chunks: Iterable[bytes], accept_encoding: Optional[str]) -> Tuple[bytes, Dict[str, str]]:
+    """
+    compress_body のストリーミング版。チャンクを受け取った順に圧縮し、圧縮前のボディ全体を保持しない
+    合計が COMPRESSION_MIN_BYTES に満たない場合は圧縮しない
+    :return: (ボディ, レスポンスに追加するヘッダー)
+    """
+    headers = {"Vary": "Accept-Encoding"}
+    encoding = negotiate_encoding(accept_encoding)
+    output = io.BytesIO()
+    compressor = None
+    for chunk in chunks:
+        if compressor is None and encoding is not None and output.tell() + len(chunk) >= COMPRESSION_MIN_BYTES:
+            compressor = _create_compressor(encoding)
+            head = output.getvalue()
+            output = io.BytesIO()
+            output.write(compressor.compress(head))
+        output.write(compressor.compress(chunk) if compressor is not None else chunk)
+    if compressor is None:
+        return output.getvalue(), headers
+    output.write(compressor.flush())
+    headers["Content-Encoding"] = encoding
+    return output.getvalue(), headers
@@ -0,0 +1,52 @@
+import html
+import json
+import os
+from collections.abc import Mapping
+from typing import Any, Iterator
+
+try:
+    # orjsonがインストールされている場合は、ページ情報のシリアライズに使用する（任意の依存関係）
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# 長い文字列（content_markdown）をエスケープ・エンコードする単位（文字数）
+JSON_STREAM_CHUNK_CHARS = int(os.getenv("JSON_STREAM_CHUNK_CHARS", "65536"))
+
+
+def encode_default(o: Any) -> Any:
+    """
+    JSONにできないオブジェクトの変換規則
+    - Document IntelligenceのSDKのモデル（Mapping）: 辞書。値に含まれるモデルも同じ規則で変換される
+    - pydanticのモデル: dict()
+    :raises TypeError: 上記以外の型（str() で文字列にはしない）
+    """
+    if isinstance(o, Mapping):
+        return dict(o)
+    if hasattr(o, "dict"):
+        return o.dict()
+    if isinstance(o, (tuple, set)):
+        return list(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def dumps(value: Any) -> bytes:
+    """値を1行のJSON（UTF-8）にする。orjsonがあれば使用する"""
+    if orjson is not None:
+        return orjson.dumps(value, default=encode_default)
+    return json.dumps(value, ensure_ascii=False, default=encode_default).encode("utf-8")
+
+
+def iter_json_string(text: str, escape_html: bool = False) -> Iterator[bytes]:
+    """
+    長い文字列をJSONの文字列として、JSON_STREAM_CHUNK_CHARS 文字ずつエンコードして返す
+    エスケープは1文字単位のため、任意の位置で区切っても結果は文字列全体をエンコードした場合と同じになる
+    :param escape_html: Trueの場合は html.escape してからエンコードする
+    """
+    yield b'"'
+    for start in range(0, len(text), JSON_STREAM_CHUNK_CHARS):
+        chunk = text[start:start + JSON_STREAM_CHUNK_CHARS]
+        if escape_html:
+            chunk = html.escape(chunk)
+        yield json.dumps(chunk, ensure_ascii=False)[1:-1].encode("utf-8")
+    yield b'"'
@@ -1,18 +1,23 @@
 from domains.analyze_categories import Page
-from typing import List
+from domains.document_model import PageView
+from typing import List, Union
 
 
-def lines_to_context(pages: List[Page]) -> List:
+def lines_to_context(pages: List[Union[Page, PageView]]) -> List:
     """
     Pageオブジェクトのlinesからテキストを改行区切りで取得し、
     コンテキストとpage_numberを含む辞書のリストを返す
+    DocumentPages のページは、行のテキストを1つの文字列として保持しているため、そのまま切り出す
     """
 
     pages_content = []
     for page in pages:
-        page_content = "\n".join(
-            line["content"] for line in page.lines  # 辞書アクセスに変更
-        )
+        if isinstance(page, PageView):
+            page_content = page.text
+        else:
+            page_content = "\n".join(
+                line["content"] for line in page.lines  # 辞書アクセスに変更
+            )
         pages_content.append({
             "context": page_content,
             "page_number": page.page_number
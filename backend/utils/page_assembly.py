@@ -0,0 +1,85 @@
+from collections import defaultdict
+from typing import Dict, List
+
+
+def _region_page_numbers(element) -> List[int]:
+    """要素のbounding_regionsに含まれるページ番号を、重複を除いて出現順に返す"""
+    return list(dict.fromkeys(
+        region.page_number for region in (element.bounding_regions or [])
+    ))
+
+
+def _index_tables_by_page(tables) -> Dict[int, List[dict]]:
+    """
+    テーブルをページ番号ごとに振り分ける
+    各ページには、そのページに領域を持つセルだけを含める（複数領域のテーブルもページごとに1回だけ）
+    """
+    tables_by_page: Dict[int, List[dict]] = defaultdict(list)
+    for table in tables or []:
+        page_numbers = _region_page_numbers(table)
+        if not page_numbers:
+            continue
+
+        cells_by_page: Dict[int, List[dict]] = defaultdict(list)
+        for cell in table.cells or []:
+            cell_page_numbers = _region_page_numbers(cell) or page_numbers[:1]
+            cell_data = {
+                "row_index": cell.row_index,
+                "column_index": cell.column_index,
+                "content": cell.content,
+                "bounding_regions": cell.bounding_regions,
+            }
+            for page_number in cell_page_numbers:
+                cells_by_page[page_number].append(cell_data)
+
+        for page_number in page_numbers:
+            tables_by_page[page_number].append({
+                "row_count": table.row_count,
+                "column_count": table.column_count,
+                "cells": cells_by_page.get(page_number, []),
+            })
+    return tables_by_page
+
+
+def _index_figures_by_page(figures) -> Dict[int, List[dict]]:
+    """図をページ番号ごとに振り分ける（複数領域の図もページごとに1回だけ）"""
+    figures_by_page: Dict[int, List[dict]] = defaultdict(list)
+    for figure in figures or []:
+        figure_data = {
+            "id": figure.id,
+            "bounding_regions": figure.bounding_regions,
+            "spans": figure.spans,
+            "elements": figure.elements,
+        }
+        for page_number in _region_page_numbers(figure):
+            figures_by_page[page_number].append(figure_data)
+    return figures_by_page
+
+
+def assemble_pages(result) -> List[dict]:
+    """
+    Document Intelligenceの解析結果から、ページごとの lines / tables / figures を組み立てる
+    テーブルと図を先にページ番号で索引化するため、処理量は O(pages + tables + figures + cells) となる
+    """
+    tables_by_page = _index_tables_by_page(result.tables)
+    figures_by_page = _index_figures_by_page(result.figures)
+
+    pages = []
+    for page in result.pages:
+        pages.append({
+            "page_number": page.page_number,
+            "width": page.width,
+            "height": page.height,
+            "lines": [
+                {
+                    "content": line.content,
+                    "polygon": getattr(line, "polygon", []),
+                    "spans": getattr(line, "spans", []),
+                }
+                for line in page.lines or []
+            ],
+            # ページ内のテーブルデータ・図データ
+            "tables": tables_by_page.get(page.page_number, []),
+            "figures": figures_by_page.get(page.page_number, []),
+        })
+    return pages
@@ -0,0 +1,129 @@
+from typing import Any, Dict, List, Optional
+
+# コンパクト形式で座標を丸める桁数
+POLYGON_PRECISION = 4
+
+
+def parse_fields(fields: Optional[str]) -> Optional[dict]:
+    """
+    フィールド指定（例: "page_number,lines.content"）を射影の木構造に変換する
+    {"page_number": True, "lines": {"content": True}}
+    未指定・空の場合はNone（射影しない）を返す
+    """
+    if not fields or not fields.strip():
+        return None
+    projection: dict = {}
+    for field in fields.split(","):
+        path = [name.strip() for name in field.strip().split(".") if name.strip()]
+        if not path:
+            continue
+        node = projection
+        for name in path[:-1]:
+            child = node.get(name)
+            if child is True:
+                # 親のフィールド全体が指定済みの場合は、それ以上絞り込まない
+                break
+            node = node.setdefault(name, {})
+        else:
+            node[path[-1]] = True
+    return projection
+
+
+def project(value: Any, projection: Optional[dict]) -> Any:
+    """辞書（またはそのリスト）から、projection で指定したフィールドだけを残す"""
+    if projection is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, projection) for item in value]
+    if not isinstance(value, dict):
+        return value
+    projected = {}
+    for name, child in projection.items():
+        if name in value:
+            projected[name] = value[name] if child is True else project(
+                value[name], child)
+    return projected
+
+
+def _get(obj: Any, *names: str, default=None):
+    """SDKのモデル（属性）と辞書（snake_case / camelCase のキー）のどちらからも値を取り出す"""
+    for name in names:
+        if isinstance(obj, dict):
+            if name in obj:
+                return obj[name]
+        elif hasattr(obj, name):
+            return getattr(obj, name)
+    return default
+
+
+def compact_polygon(polygon: Any) -> List[float]:
+    """ポリゴンを丸めたフラットな数値配列にする（[x1, y1, x2, y2, ...]）"""
+    flat: List[float] = []
+    for point in polygon or []:
+        if isinstance(point, (int, float)):
+            flat.append(round(point, POLYGON_PRECISION))
+        elif isinstance(point, (list, tuple)):
+            flat.extend(round(v, POLYGON_PRECISION) for v in point)
+        else:
+            flat.append(round(_get(point, "x", default=0.0), POLYGON_PRECISION))
+            flat.append(round(_get(point, "y", default=0.0), POLYGON_PRECISION))
+    return flat
+
+
+def compact_bounding_regions(regions: Any) -> List[dict]:
+    """bounding_regions をページ番号とフラットなポリゴンだけにする"""
+    return [
+        {
+            "page_number": _get(region, "page_number", "pageNumber"),
+            "polygon": compact_polygon(_get(region, "polygon", default=[])),
+        }
+        for region in regions or []
+    ]
+
+
+def compact_page(page: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    ページ情報をコンパクト形式にする
+    - lines: content だけにする（polygon・spansを除く）
+    - tables: セルの bounding_regions を除く
+    - figures: bounding_regions をフラットなポリゴンにし、spans・elementsを除く
+    """
+    return {
+        "page_number": page["page_number"],
+        "width": page.get("width"),
+        "height": page.get("height"),
+        "lines": [{"content": line["content"]} for line in page.get("lines", [])],
+        "tables": [
+            {
+                "row_count": table["row_count"],
+                "column_count": table["column_count"],
+                "cells": [
+                    {
+                        "row_index": cell["row_index"],
+                        "column_index": cell["column_index"],
+                        "content": cell["content"],
+                    }
+                    for cell in table.get("cells", [])
+                ],
+            }
+            for table in page.get("tables", [])
+        ],
+        "figures": [
+            {
+                "id": figure["id"],
+                "bounding_regions": compact_bounding_regions(figure.get("bounding_regions")),
+            }
+            for figure in page.get("figures", [])
+        ],
+    }
+
+
+def shape_pages(pages: List[Dict[str, Any]], fields: Optional[str] = None, compact: bool = False) -> List[Dict[str, Any]]:
+    """
+    レスポンスに含めるページ情報を、コンパクト形式・フィールド射影の順に整形する
+    :param fields: ページごとに残すフィールド（例: "page_number,lines.content"）
+    :param compact: Trueの場合はコンパクト形式にする
+    """
+    if compact:
+        pages = [compact_page(page) for page in pages]
+    return project(pages, parse_fields(fields))
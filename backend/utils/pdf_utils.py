@@ -0,0 +1,81 @@
+import hashlib
+import io
+import logging
+import re
+from typing import List, Optional
+
+try:
+    # pypdfがインストールされていれば、より正確にページ数を数える（任意の依存関係）
+    from pypdf import PdfReader
+except ImportError:  # pragma: no cover
+    PdfReader = None
+
+_PAGE_OBJECT_PATTERN = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+
+
+def count_pdf_pages(pdf_binary: bytes) -> int:
+    """
+    PDFのページ数を返す
+    pypdfが利用できない場合は、ページオブジェクト（/Type /Page）の数から推定する
+    """
+    if PdfReader is not None:
+        try:
+            return len(PdfReader(io.BytesIO(pdf_binary)).pages)
+        except Exception:
+            pass
+    return len(_PAGE_OBJECT_PATTERN.findall(pdf_binary))
+
+
+def build_pdf_page_hashes(pdf_binary: bytes) -> Optional[List[str]]:
+    """
+    PDFのページごとの内容のハッシュを返す（ページの描画命令・参照する画像などのXObject・用紙サイズから求める）
+    pypdfが利用できない場合や、PDFを解析できない場合はNoneを返す
+    """
+    if PdfReader is None:
+        logging.warning("pypdf is not installed: cannot detect changed PDF pages, analyzing all pages.")
+        return None
+    try:
+        page_hashes = []
+        for page in PdfReader(io.BytesIO(pdf_binary)).pages:
+            digest = hashlib.sha256(str(list(page.mediabox)).encode("utf-8"))
+            contents = page.get_contents()
+            if contents is not None:
+                digest.update(contents.get_data())
+            resources = page["/Resources"] if "/Resources" in page else {}
+            xobjects = resources["/XObject"] if "/XObject" in resources else {}
+            for name in sorted(xobjects):
+                digest.update(name.encode("utf-8"))
+                digest.update(xobjects[name].get_object().get_data())
+            page_hashes.append(digest.hexdigest())
+        return page_hashes
+    except Exception as e:
+        logging.warning(f"Failed to hash PDF pages: {e}")
+        return None
+
+
+def format_page_numbers(page_numbers: List[int]) -> str:
+    """
+    ページ番号のリストを、Document Intelligenceの pages に指定する形式にする
+    例: format_page_numbers([1, 2, 3, 7, 9, 10]) -> "1-3,7,9-10"
+    """
+    ranges = []
+    for page_number in sorted(set(page_numbers)):
+        if ranges and ranges[-1][1] == page_number - 1:
+            ranges[-1][1] = page_number
+        else:
+            ranges.append([page_number, page_number])
+    return ",".join(f"{start}-{end}" if start != end else f"{start}" for start, end in ranges)
+
+
+def build_page_ranges(page_count: int, shard_size: int) -> List[str]:
+    """
+    ページ数をshard_sizeごとのページ範囲に分割する
+    例: build_page_ranges(120, 50) -> ["1-50", "51-100", "101-120"]
+    """
+    if shard_size < 1:
+        raise ValueError("shard_size must be greater than 0.")
+    page_ranges = []
+    for start in range(1, page_count + 1, shard_size):
+        end = min(start + shard_size - 1, page_count)
+        page_ranges.append(f"{start}-{end}" if start != end else f"{start}")
+    return page_ranges
@@ -0,0 +1,141 @@
+import hashlib
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import List, Optional
+from utils.token_estimator import estimate_text_tokens
+
+# Markdown出力でページの境界に挿入される区切り
+_PAGE_BREAK_PATTERN = re.compile(r"\s*<!-- PageBreak -->\s*")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def tokenize(text: str, n: int = 2) -> List[str]:
+    """
+    文字n-gramに分割する（日本語のように単語の区切りがない文章向け）
+    NFKC正規化・小文字化し、空白は除去する。n文字未満の文字列はそのまま1トークンとする
+    """
+    text = _WHITESPACE_PATTERN.sub(
+        "", unicodedata.normalize("NFKC", text).lower())
+    if len(text) < n:
+        return [text] if text else []
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+
+def split_markdown_chunks(content_markdown: str, max_chars: int = 1500) -> List[dict]:
+    """
+    Markdownをページ区切りでページに分け、長いページは段落単位でmax_chars程度のチャンクに分割する
+    :return: [{"page_number": int, "text": str}, ...]（文書内の出現順）
+    """
+    chunks = []
+    for page_index, page_text in enumerate(_PAGE_BREAK_PATTERN.split(content_markdown)):
+        buffer = ""
+        for paragraph in page_text.split("\n\n"):
+            if buffer and len(buffer) + len(paragraph) > max_chars:
+                chunks.append({"page_number": page_index + 1, "text": buffer})
+                buffer = ""
+            buffer = f"{buffer}\n\n{paragraph}" if buffer else paragraph
+        if buffer.strip():
+            chunks.append({"page_number": page_index + 1, "text": buffer})
+    return chunks
+
+
+class BM25Index:
+    """文字n-gramによるBM25の語彙検索インデックス"""
+
+    def __init__(self, chunks: List[dict], n: int = 2, k1: float = 1.5, b: float = 0.75) -> None:
+        self.chunks = chunks
+        self.n = n
+        self.k1 = k1
+        self.b = b
+        self._term_frequencies = [Counter(tokenize(chunk["text"], n))
+                                  for chunk in chunks]
+        self._lengths = [sum(tf.values()) for tf in self._term_frequencies]
+        self._average_length = (
+            sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        document_frequencies: Counter = Counter()
+        for tf in self._term_frequencies:
+            document_frequencies.update(tf.keys())
+        total = len(chunks)
+        self._idf = {
+            term: math.log(1 + (total - df + 0.5) / (df + 0.5))
+            for term, df in document_frequencies.items()
+        }
+
+    def search(self, query: str, top_k: Optional[int] = None) -> List[tuple]:
+        """クエリとの関連度が高い順に (スコア, チャンクの添字) を返す。スコア0のチャンクは含めない"""
+        query_terms = set(tokenize(query, self.n))
+        scores = []
+        for index, tf in enumerate(self._term_frequencies):
+            length_norm = self.k1 * (1 - self.b + self.b * self._lengths[index] / (self._average_length or 1))
+            score = 0.0
+            for term in query_terms:
+                frequency = tf.get(term)
+                if frequency:
+                    score += self._idf[term] * frequency * \
+                        (self.k1 + 1) / (frequency + length_norm)
+            if score > 0:
+                scores.append((score, index))
+        scores.sort(key=lambda item: (-item[0], item[1]))
+        return scores[:top_k] if top_k else scores
+
+    def select_context(
+        self,
+        query: str,
+        token_budget: int,
+        required_pages: Optional[List[int]] = None,
+        top_k: Optional[int] = None,
+    ) -> List[dict]:
+        """
+        トークン予算内に収まるように、関連度の高いチャンクを選ぶ
+        required_pages のチャンクは関連度に関係なく優先して含める
+        :return: 選ばれたチャンク（文書内の出現順）
+        """
+        required_pages = set(required_pages or [])
+        candidates = [index for index, chunk in enumerate(self.chunks)
+                      if chunk["page_number"] in required_pages]
+        candidates += [index for _, index in self.search(query, top_k)
+                       if index not in candidates]
+
+        selected = []
+        used_tokens = 0
+        for index in candidates:
+            tokens = estimate_text_tokens(self.chunks[index]["text"])
+            if used_tokens + tokens > token_budget:
+                continue
+            selected.append(index)
+            used_tokens += tokens
+        return [self.chunks[index] for index in sorted(selected)]
+
+
+def format_chunks(chunks: List[dict]) -> str:
+    """選ばれたチャンクを、ページ番号の見出し付きのMarkdownに整形する"""
+    return "\n\n".join(
+        f"<!-- ページ番号: {chunk['page_number']} -->\n{chunk['text']}" for chunk in chunks
+    )
+
+
+_index_cache: "OrderedDict[str, BM25Index]" = OrderedDict()
+_index_cache_lock = threading.Lock()
+_INDEX_CACHE_MAX_ENTRIES = 8
+
+
+def get_markdown_index(content_markdown: str) -> BM25Index:
+    """
+    ドキュメントのMarkdownに対するインデックスを返す
+    同じドキュメントの分類ごとの呼び出しで再利用するため、内容のハッシュをキーにプロセス内でキャッシュする
+    """
+    key = hashlib.sha256(content_markdown.encode("utf-8")).hexdigest()
+    with _index_cache_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+    index = BM25Index(split_markdown_chunks(content_markdown))
+    with _index_cache_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > _INDEX_CACHE_MAX_ENTRIES:
+            _index_cache.popitem(last=False)
+    return index
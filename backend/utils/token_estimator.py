@@ -0,0 +1,102 @@
+import logging
+from typing import Callable, Iterable
+
+try:
+    # tiktoken（requirements.txt に含む）でモデルと同じトークナイザで数える
+    # インストールされていない場合・エンコーディングのファイルを取得できない場合は文字数からの概算になり、
+    # プロンプトのトークン予算（PROMPT_TOKEN_BUDGET）の判定も概算に対して行う
+    import tiktoken
+except ImportError:  # pragma: no cover
+    tiktoken = None
+
+# gpt-4o / gpt-4o-mini のトークナイザ
+TOKENIZER_ENCODING = "o200k_base"
+
+_encoding = None
+# エンコーディングを取得できなかった場合は、呼び出しごとに取得し直さない
+_encoding_unavailable = False
+
+
+def estimate_text_tokens(text: str) -> int:
+    """
+    テキストのトークン数を概算する（送信前の見積もり用）
+    ASCII文字は約4文字で1トークン、日本語などの非ASCII文字は約1文字で1トークンとして数える
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _get_encoding():
+    global _encoding, _encoding_unavailable
+    if _encoding is None and tiktoken is not None and not _encoding_unavailable:
+        try:
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            # エンコーディングのファイルを取得できない環境では概算にフォールバックする
+            logging.warning(f"Failed to load tiktoken encoding {TOKENIZER_ENCODING}, using estimates: {e}")
+            _encoding_unavailable = True
+            return None
+    return _encoding
+
+
+def count_text_tokens(text: str) -> int:
+    """
+    テキストのトークン数を数える（トークン数の計測・予算の判定用）
+    tiktokenが使える場合はその値を、使えない場合は estimate_text_tokens の概算を返す
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_text_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_text_tokens(text: str, max_tokens: int) -> str:
+    """テキストの先頭から max_tokens トークン分を返す"""
+    if max_tokens <= 0:
+        return ""
+    if count_text_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    # 概算の場合は、文字ごとのトークン数を積み上げて切る
+    tokens = 0.0
+    for i, c in enumerate(text):
+        tokens += 0.25 if ord(c) < 128 else 1
+        if tokens > max_tokens:
+            return text[:i]
+    return text
+
+
+# 画像1枚あたりのトークン数（low は固定、high は1024px四方の画像を想定した上限）
+IMAGE_TOKENS = {"low": 85, "high": 765}
+
+
+def _message_tokens(messages: Iterable[dict], count: Callable[[str], int]) -> int:
+    total = 3
+    for message in messages:
+        total += 4
+        content = message.get("content")
+        if isinstance(content, str):
+            total += count(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    total += count(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    total += IMAGE_TOKENS.get(part["image_url"].get("detail"), IMAGE_TOKENS["high"])
+    return total
+
+
+def estimate_message_tokens(messages: Iterable[dict]) -> int:
+    """チャットメッセージのトークン数を概算する（メッセージごとのオーバーヘッドを含む）"""
+    return _message_tokens(messages, estimate_text_tokens)
+
+
+def count_message_tokens(messages: Iterable[dict]) -> int:
+    """チャットメッセージのトークン数を count_text_tokens で数える（メッセージごとのオーバーヘッドを含む）"""
+    return _message_tokens(messages, count_text_tokens)